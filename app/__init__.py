@@ -1,6 +1,7 @@
 from flask import Flask
 from flask_bootstrap import Bootstrap5
 from flask_pymongo import PyMongo
+from pymongo.errors import PyMongoError
 from flask_wtf import CSRFProtect
 from config import ConfiguracionFlask
 from flask_login import LoginManager
@@ -28,6 +29,23 @@ def create_app() -> Flask:
     csrf.init_app(app)
     mongo.init_app(app)
 
+    # Creamos los indices del manifiesto (si ya existen, Mongo no hace nada). Si la base de datos
+    # no esta disponible, la app arranca igualmente y se pueden crear con "flask crear-indices"
+    if app.config["CREAR_INDICES_AL_ARRANCAR"]:
+        from .indices import aplicar_indices
+        try:
+            aplicar_indices(mongo.db)
+        except PyMongoError:
+            app.logger.exception("No se han podido crear los indices al arrancar")
+
+    # Registramos los comandos de "flask"
+    from .comandos import registrar_comandos
+    registrar_comandos(app)
+
+    # Funciones globales de las plantillas
+    from .render_utils import fragmento_cacheado
+    app.add_template_global(fragmento_cacheado)
+
     # Vinculamos las rutas del modulo "rutas"
     with app.app_context():
         from . import rutas
@@ -0,0 +1,120 @@
+"""
+Modulo que mantiene la coleccion derivada "actuaciones": un documento por cada actuacion de cada festival,
+con los datos del concursante y los de la edicion (anyo, ciudad y pais organizador). Permite consultar las
+actuaciones de un pais con un recorrido del indice (id_pais, anyo), sin hacer "$unwind" de todas las ediciones.
+
+La coleccion se reconstruye a partir de "festivales" cada vez que cambia la version de sus datos
+(ver el modulo "version_datos").
+"""
+import threading
+from typing import List, Dict, Any, Optional, Iterable
+from pymongo import ReplaceOne, DeleteMany
+from .version_datos import COLECCION_METADATOS, version_datos
+from .indices import aplicar_indices
+
+COLECCION_ACTUACIONES = "actuaciones"
+
+# Campos de la edicion que se copian en cada actuacion: {campo en la actuacion: campo en el festival}
+CAMPOS_EDICION = {"anyo": "anyo", "ciudad": "ciudad", "pais_organizador": "pais"}
+
+# Campos de la actuacion que no son del concursante
+CAMPOS_NO_CONCURSANTE = ["_id", *CAMPOS_EDICION]
+
+# Numero de operaciones de cada "bulk_write" al sincronizar. Las actuaciones se escriben por lotes para
+# que la memoria usada no dependa del tamanyo de la coleccion
+TAM_LOTE_ACTUACIONES = 2000
+
+# Ultima version de los festivales con la que se ha comprobado la coleccion en este proceso
+_lock = threading.Lock()
+_version_sincronizada: Optional[int] = None
+
+
+def id_actuacion(anyo: int, id_pais: str) -> str:
+    """
+    Identificador de una actuacion. Cada pais actua como mucho una vez por edicion
+    """
+    return f"{anyo}-{id_pais}"
+
+
+def actuaciones_festival(festival: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Devuelve los documentos de las actuaciones de un festival
+    """
+    edicion = {campo: festival.get(origen) for campo, origen in CAMPOS_EDICION.items()}
+    return [{"_id": id_actuacion(festival["anyo"], concursante["id_pais"]), **edicion, **concursante}
+            for concursante in festival.get("concursantes", [])]
+
+
+def sincronizar_actuaciones(db, anyos: Optional[Iterable[int]] = None,
+                            tam_lote: int = TAM_LOTE_ACTUACIONES, version_anterior: Optional[int] = None) -> int:
+    """
+    Reconstruye las actuaciones de los anyos indicados (o de todos, si es None) a partir de "festivales".
+    Las actuaciones que ya no existen se borran. Devuelve el numero de actuaciones escritas.
+
+    Si solo han cambiado los anyos indicados desde la version "version_anterior" de los festivales, y la
+    coleccion estaba al dia con esa version, queda al dia con la actual sin reconstruirla entera. Si no
+    lo estaba, se reconstruye entera.
+    """
+    version = version_datos(db, "festivales")
+    if anyos is not None and version_anterior is not None:
+        metadatos = db[COLECCION_METADATOS].find_one({"_id": COLECCION_ACTUACIONES}) or {}
+        if metadatos.get("version_festivales") != version_anterior:
+            # La coleccion ya estaba desfasada antes de los cambios: hay que reconstruirla entera
+            anyos = None
+    anyos = None if anyos is None else list(anyos)
+    consulta = {} if anyos is None else {"anyo": {"$in": anyos}}
+    coleccion = db[COLECCION_ACTUACIONES]
+    operaciones = []
+    anyos_festivales = []
+    escritas = 0
+    for festival in db["festivales"].find(consulta, {"_id": 0}):
+        actuaciones = actuaciones_festival(festival)
+        anyos_festivales.append(festival["anyo"])
+        escritas += len(actuaciones)
+        operaciones.extend(ReplaceOne({"_id": actuacion["_id"]}, actuacion, upsert=True)
+                           for actuacion in actuaciones)
+        operaciones.append(DeleteMany({"anyo": festival["anyo"],
+                                       "_id": {"$nin": [actuacion["_id"] for actuacion in actuaciones]}}))
+        if len(operaciones) >= tam_lote:
+            coleccion.bulk_write(operaciones, ordered=False)
+            operaciones = []
+
+    # Anyos que ya no estan en "festivales"
+    if anyos is None:
+        desaparecidos = {"$nin": anyos_festivales}
+    else:
+        desaparecidos = {"$in": [anyo for anyo in anyos if anyo not in anyos_festivales]}
+    operaciones.append(DeleteMany({"anyo": desaparecidos}))
+
+    coleccion.bulk_write(operaciones, ordered=False)
+    aplicar_indices(db, [COLECCION_ACTUACIONES])
+
+    # Solo una reconstruccion completa (o una parcial de todos los anyos que han cambiado) deja la coleccion
+    # al dia con la version de los festivales
+    if anyos is None:
+        db[COLECCION_METADATOS].update_one({"_id": COLECCION_ACTUACIONES},
+                                           {"$set": {"version_festivales": version}}, upsert=True)
+    elif version_anterior is not None:
+        db[COLECCION_METADATOS].update_one({"_id": COLECCION_ACTUACIONES, "version_festivales": version_anterior},
+                                           {"$set": {"version_festivales": version}})
+    return escritas
+
+
+def asegurar_actuaciones(db, version: Optional[int] = None):
+    """
+    Comprueba que la coleccion de actuaciones esta al dia con la version de los festivales, y si no lo esta,
+    la reconstruye. Dentro del proceso solo se comprueba una vez por version.
+    """
+    global _version_sincronizada
+    if version is None:
+        version = version_datos(db, "festivales")
+    if version == _version_sincronizada:
+        return
+
+    with _lock:
+        if version == _version_sincronizada:
+            return
+        metadatos = db[COLECCION_METADATOS].find_one({"_id": COLECCION_ACTUACIONES}) or {}
+        if metadatos.get("version_festivales") != version:
+            sincronizar_actuaciones(db)
+        _version_sincronizada = version
@@ -0,0 +1,153 @@
+"""
+Modulo con un filtro de Bloom en memoria y el registro de los nombres de quizzes en uso.
+
+Un filtro de Bloom responde "seguro que no esta" o "puede que este" (con una tasa de falsos positivos
+acotada), con un array de bits de tamanyo fijo. Asi, comprobar si un nombre de quiz esta libre solo consulta
+a Mongo cuando el filtro dice que puede estar ocupado. La comprobacion definitiva la hace el indice unico
+del "_id" al insertar el quiz.
+"""
+import hashlib
+import math
+import threading
+import time
+from typing import List, Dict, Any, Callable, Optional
+
+
+class FiltroBloom:
+    """
+    Filtro de Bloom dimensionado para "capacidad" elementos con una tasa de falsos positivos de
+    "tasa_falsos_positivos". Las "num_hashes" posiciones de cada elemento se calculan con doble hashing
+    a partir de un solo "blake2b".
+    """
+
+    def __init__(self, capacidad: int, tasa_falsos_positivos: float = 0.01):
+        capacidad = max(capacidad, 1)
+        self.capacidad = capacidad
+        self.num_bits = max(8, math.ceil(-capacidad * math.log(tasa_falsos_positivos) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacidad * math.log(2)))
+        self.elementos = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _posiciones(self, elemento: str):
+        resumen = hashlib.blake2b(elemento.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(resumen[:8], "little")
+        h2 = int.from_bytes(resumen[8:], "little") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def anyadir(self, elemento: str):
+        for posicion in self._posiciones(elemento):
+            self._bits[posicion >> 3] |= 1 << (posicion & 7)
+        self.elementos += 1
+
+    def __contains__(self, elemento: str) -> bool:
+        return all(self._bits[posicion >> 3] & (1 << (posicion & 7)) for posicion in self._posiciones(elemento))
+
+    @property
+    def lleno(self) -> bool:
+        # Por encima de la capacidad, la tasa de falsos positivos crece rapidamente
+        return self.elementos > self.capacidad
+
+
+class NombresQuizzes:
+    """
+    Registro de los nombres de quizzes en uso, con un filtro de Bloom que se carga con los "_id" de la
+    coleccion de quizzes la primera vez que se usa. El filtro se vuelve a cargar cada "recarga" segundos
+    (para ver los quizzes guardados por otros procesos) y cuando se llena (con el doble de capacidad).
+
+    "pendiente" es una funcion opcional que indica si hay un quiz con ese nombre que todavia no esta
+    escrito (ver el modulo "escritura").
+    """
+
+    def __init__(self, capacidad: int = 100000, tasa_falsos_positivos: float = 0.01, recarga: float = 300,
+                 pendiente: Optional[Callable[[str], Any]] = None):
+        self.capacidad = capacidad
+        self.tasa_falsos_positivos = tasa_falsos_positivos
+        self.recarga = recarga
+        self.pendiente = pendiente
+        self._lock = threading.Lock()
+        self._lock_carga = threading.Lock()
+        self._filtro: Optional[FiltroBloom] = None
+        self._cargado = 0.0
+        self._anyadidos_carga: Optional[List[str]] = None
+
+        # Contadores
+        self.negativos = 0
+        self.consultas = 0
+        self.falsos_positivos = 0
+
+    def _vigente(self) -> Optional[FiltroBloom]:
+        filtro = self._filtro
+        if (filtro is not None and not filtro.lleno
+                and (not self.recarga or time.monotonic() - self._cargado < self.recarga)):
+            return filtro
+        return None
+
+    def _filtro_actual(self, coleccion_quizzes) -> FiltroBloom:
+        with self._lock:
+            filtro = self._vigente()
+        if filtro is not None:
+            return filtro
+
+        # Solo un hilo carga el filtro. Los demas esperan y usan el que ha cargado
+        with self._lock_carga:
+            with self._lock:
+                filtro = self._vigente()
+                if filtro is not None:
+                    return filtro
+                # Los nombres que se anyadan mientras se carga el filtro se guardan aparte, porque la
+                # consulta puede no verlos
+                self._anyadidos_carga = []
+
+            # La carga se hace fuera del lock (solo recorre el indice del "_id")
+            nombres = [str(quiz["_id"]) for quiz in coleccion_quizzes.find({}, {"_id": 1})]
+            nuevo = FiltroBloom(max(self.capacidad, 2 * len(nombres)), self.tasa_falsos_positivos)
+            for nombre in nombres:
+                nuevo.anyadir(nombre)
+            with self._lock:
+                for nombre in self._anyadidos_carga:
+                    nuevo.anyadir(nombre)
+                self._anyadidos_carga = None
+                self._filtro = nuevo
+                self._cargado = time.monotonic()
+                return nuevo
+
+    def disponible(self, coleccion_quizzes, nombre: str) -> bool:
+        """
+        Indica si el nombre esta libre. Si el filtro dice que no esta en uso, no se consulta a Mongo.
+        """
+        filtro = self._filtro_actual(coleccion_quizzes)
+        with self._lock:
+            if nombre not in filtro:
+                self.negativos += 1
+                return True
+            self.consultas += 1
+
+        ocupado = ((self.pendiente is not None and self.pendiente(nombre) is not None)
+                   or coleccion_quizzes.find_one({"_id": nombre}, {"_id": 1}) is not None)
+        if not ocupado:
+            with self._lock:
+                self.falsos_positivos += 1
+        return not ocupado
+
+    def anyadir(self, nombre: Any):
+        """
+        Anyade un nombre recien guardado
+        """
+        with self._lock:
+            if self._filtro is not None:
+                self._filtro.anyadir(str(nombre))
+            if self._anyadidos_carga is not None:
+                self._anyadidos_carga.append(str(nombre))
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "nombres": self._filtro.elementos if self._filtro is not None else 0,
+                "negativos": self.negativos,
+                "consultas": self.consultas,
+                "falsos_positivos": self.falsos_positivos,
+            }
+
+
+# Registro compartido por los formularios y las rutas
+nombres_quizzes = NombresQuizzes()
@@ -0,0 +1,159 @@
+"""
+Modulo con las caches en memoria de la aplicacion. Todas se invalidan con la version de los datos
+(ver el modulo "version_datos"), en lugar de caducar por tiempo.
+"""
+import sys
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple, Hashable, Optional
+
+
+class CacheDistinct:
+    """
+    Cache de las listas de valores distintos ("distinct") de un campo de una coleccion, ya ordenadas.
+    Cada entrada guarda la version de los datos con la que se calculo, y solo se vuelve a consultar
+    a Mongo cuando esa version cambia.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas: Dict[Tuple[str, str, bool], Tuple[int, List[Any]]] = {}
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, coleccion, campo: str, version: int, descendente: bool = False) -> List[Any]:
+        """
+        Devuelve los valores distintos del campo, ordenados. La lista devuelta es una copia,
+        asi que se puede modificar sin afectar a la cache.
+        """
+        clave = (coleccion.name, campo, descendente)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] == version:
+                self.aciertos += 1
+                return list(entrada[1])
+            self.fallos += 1
+
+        valores = sorted(coleccion.distinct(campo), reverse=descendente)
+        with self._lock:
+            self._entradas[clave] = (version, valores)
+        return list(valores)
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self._entradas)}
+
+
+class CacheLRU:
+    """
+    Cache acotada a "max_entradas" elementos. Cuando se llena, se expulsa el usado hace mas tiempo.
+    """
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave: Hashable) -> Optional[Any]:
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave]
+            self.fallos += 1
+            return None
+
+    def guardar(self, clave: Hashable, valor: Any):
+        with self._lock:
+            self._entradas[clave] = valor
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self._entradas)}
+
+
+def tamanyo_en_memoria(valor: Any) -> int:
+    """
+    Tamanyo aproximado en bytes de un valor y de todo lo que contiene (diccionarios, listas, tuplas y
+    conjuntos, recorridos recursivamente). Los objetos compartidos se cuentan una sola vez.
+    """
+    vistos = set()
+    pendientes = [valor]
+    total = 0
+    while pendientes:
+        actual = pendientes.pop()
+        if id(actual) in vistos:
+            continue
+        vistos.add(id(actual))
+        total += sys.getsizeof(actual)
+        if isinstance(actual, dict):
+            pendientes.extend(actual.keys())
+            pendientes.extend(actual.values())
+        elif isinstance(actual, (list, tuple, set, frozenset)):
+            pendientes.extend(actual)
+    return total
+
+
+class CacheLRUMemoria:
+    """
+    Cache LRU acotada por tamanyo (en bytes) en lugar de por numero de elementos. Cada elemento se guarda
+    con su tamanyo (por ejemplo, el de "tamanyo_en_memoria"). Cuando se supera "max_bytes", se
+    expulsan los usados hace mas tiempo. Los elementos mas grandes que toda la cache no se guardan.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def obtener(self, clave: Hashable) -> Optional[Any]:
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave][0]
+            self.fallos += 1
+            return None
+
+    def guardar(self, clave: Hashable, valor: Any, tamanyo: int):
+        with self._lock:
+            if clave in self._entradas:
+                self.bytes -= self._entradas.pop(clave)[1]
+            if tamanyo > self.max_bytes:
+                return
+            self._entradas[clave] = (valor, tamanyo)
+            self.bytes += tamanyo
+            while self.bytes > self.max_bytes:
+                self.bytes -= self._entradas.popitem(last=False)[1][1]
+                self.expulsiones += 1
+
+    def invalidar(self):
+        with self._lock:
+            self._entradas.clear()
+            self.bytes = 0
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self._entradas),
+                    "bytes": self.bytes, "expulsiones": self.expulsiones}
+
+
+# Instancias compartidas por toda la aplicacion
+cache_distinct = CacheDistinct()
+
+# Fragmentos de HTML renderizados (ver "render_utils")
+MAX_FRAGMENTOS = 4096
+cache_fragmentos = CacheLRU(MAX_FRAGMENTOS)
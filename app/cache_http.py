@@ -0,0 +1,73 @@
+"""
+Modulo con la cache HTTP de las paginas de solo lectura que dependen de los festivales. Las respuestas
+llevan ETag y Last-Modified a partir de la version de los datos (ver el modulo "version_datos"), de manera
+que el navegador puede revalidarlas con un GET condicional y recibir un 304. Ademas, el HTML renderizado se
+guarda en una cache del servidor por URL (ruta y parametros), que se invalida al cambiar la version. Las
+respuestas JSON (como los fragmentos de concursantes) se guardan igual, con su tipo de contenido.
+"""
+import datetime
+import functools
+from flask import request, session, make_response, g
+from . import mongo
+from .cache import CacheLRU
+from .version_datos import documento_version
+
+
+def _hay_mensajes() -> bool:
+    # Los mensajes flash pendientes se muestran en la pagina, asi que esa respuesta no se puede reutilizar
+    return bool(session.get("_flashes"))
+
+
+def _no_modificada(etag: str, actualizado) -> bool:
+    """
+    Indica si el GET condicional de la peticion coincide con la version actual de los datos
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and actualizado is not None:
+        # Las fechas HTTP no tienen fracciones de segundo
+        return actualizado.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def pagina_cacheada(cache: CacheLRU, coleccion: str = "festivales"):
+    """
+    Decorador para las vistas de solo lectura que solo dependen de los datos de "coleccion"
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltorio(*args, **kwargs):
+            version = documento_version(mongo.db, coleccion)
+            etag = f"{coleccion}-{version['version']}"
+            # La cache de fragmentos usa la version para sus claves (ver "render_utils")
+            g.version_datos = version["version"]
+            actualizado = version["actualizado"]
+            if actualizado is not None and actualizado.tzinfo is None:
+                # PyMongo devuelve las fechas en UTC, pero sin zona horaria
+                actualizado = actualizado.replace(tzinfo=datetime.timezone.utc)
+            mensajes = _hay_mensajes()
+
+            if not mensajes and _no_modificada(etag, actualizado):
+                respuesta = make_response("", 304)
+            else:
+                clave = (version["version"], request.full_path)
+                guardada = None if mensajes else cache.obtener(clave)
+                if guardada is not None:
+                    cuerpo, tipo = guardada
+                    respuesta = make_response(cuerpo)
+                    respuesta.content_type = tipo
+                else:
+                    respuesta = make_response(vista(*args, **kwargs))
+                    # Solo se guardan (y se validan) las paginas renderizadas correctamente
+                    if respuesta.status_code != 200 or mensajes:
+                        return respuesta
+                    cache.guardar(clave, (respuesta.get_data(), respuesta.content_type))
+
+            respuesta.set_etag(etag)
+            if actualizado is not None:
+                respuesta.last_modified = actualizado
+            # El navegador puede guardar la pagina, pero debe revalidarla en cada peticion
+            respuesta.cache_control.no_cache = True
+            return respuesta
+        return envoltorio
+    return decorador
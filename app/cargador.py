@@ -0,0 +1,144 @@
+"""
+Modulo con la carga de ediciones en la coleccion de festivales a partir de un fichero como
+"festivales.json": una edicion por linea, en Extended JSON ("$oid", "$date"...).
+
+El fichero se lee linea a linea y se escribe en lotes de "bulk_write" desordenados, con un "upsert"
+por edicion (la clave es el anyo), asi que la memoria usada solo depende del tamanyo del lote y se
+puede volver a cargar el mismo fichero sin duplicar ediciones.
+
+Cada edicion guarda un hash de su contenido ("hash_contenido"). Las ediciones cuyo hash no ha cambiado no
+se escriben, y si no ha cambiado ninguna, la version de los festivales se mantiene (y con ella todas las
+caches que dependen de los datos). Si ha cambiado alguna, al terminar se incrementa la version y solo se
+reconstruyen las actuaciones de los anyos modificados.
+"""
+import hashlib
+import time
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Callable, TextIO
+from bson import json_util
+from pymongo import ReplaceOne
+from .actuaciones import sincronizar_actuaciones
+from .indices import aplicar_indices
+from .version_datos import version_datos, incrementar_version
+
+# Numero de ediciones por defecto de cada "bulk_write"
+TAM_LOTE_CARGA = 500
+
+# Campo de cada edicion con el hash de su contenido
+CAMPO_HASH = "hash_contenido"
+
+
+class ResultadoCarga:
+    """
+    Contadores de una carga: ediciones leidas, insertadas, modificadas y sin cambios, actuaciones leidas,
+    anyos de las ediciones escritas y segundos
+    """
+
+    def __init__(self):
+        self.ediciones = 0
+        self.insertadas = 0
+        self.modificadas = 0
+        self.sin_cambios = 0
+        self.actuaciones = 0
+        self.anyos_modificados: List[int] = []
+        self.inicio = time.perf_counter()
+
+    @property
+    def segundos(self) -> float:
+        return time.perf_counter() - self.inicio
+
+    def __str__(self):
+        segundos = self.segundos
+        return (f"{self.ediciones} ediciones ({self.insertadas} nuevas, {self.modificadas} modificadas, "
+                f"{self.sin_cambios} sin cambios), "
+                f"{self.actuaciones} actuaciones en {segundos:.1f} s "
+                f"({self.ediciones / segundos if segundos else 0:.0f} ediciones/s, "
+                f"{self.actuaciones / segundos if segundos else 0:.0f} actuaciones/s)")
+
+
+def leer_ediciones(fichero: TextIO) -> Iterator[Dict[str, Any]]:
+    """
+    Devuelve las ediciones del fichero de una en una, decodificando el Extended JSON
+    """
+    for numero, linea in enumerate(fichero, 1):
+        if not linea.strip():
+            continue
+        try:
+            yield json_util.loads(linea)
+        except ValueError as error:
+            raise ValueError(f"Linea {numero} no valida: {error}") from error
+
+
+def hash_edicion(edicion: Dict[str, Any]) -> str:
+    """
+    Hash del contenido de una edicion (sin el "_id" ni el propio hash). No depende del orden de los campos.
+    """
+    contenido = {campo: valor for campo, valor in edicion.items() if campo not in ("_id", CAMPO_HASH)}
+    return hashlib.sha256(json_util.dumps(contenido, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def operacion_edicion(edicion: Dict[str, Any], hash_contenido: str, existe: bool) -> ReplaceOne:
+    """
+    Upsert de una edicion por su anyo. La edicion guardada se sustituye entera, para que los campos que ya
+    no estan en el fichero desaparezcan. El "_id" del fichero solo se usa si la edicion es nueva ("existe"
+    es False); si no, se mantiene el de la edicion guardada.
+    """
+    documento = {**edicion, CAMPO_HASH: hash_contenido}
+    if existe:
+        documento.pop("_id", None)
+    return ReplaceOne({"anyo": edicion["anyo"]}, documento, upsert=True)
+
+
+def cargar_ediciones(db, ediciones: Iterable[Dict[str, Any]], tam_lote: int = TAM_LOTE_CARGA,
+                     informar: Optional[Callable[[ResultadoCarga], None]] = None) -> ResultadoCarga:
+    """
+    Escribe las ediciones nuevas o modificadas en la coleccion de festivales, en lotes de "tam_lote".
+    Despues de cada lote se llama a "informar" (si se proporciona) con los contadores acumulados. Al
+    terminar, si ha cambiado alguna edicion, se incrementa la version, se reconstruyen las actuaciones de
+    los anyos modificados y se crean los indices.
+    """
+    coleccion = db["festivales"]
+    resultado = ResultadoCarga()
+    # El indice unico por anyo tiene que existir antes de la carga: cada "upsert" lo usa para buscar la edicion
+    aplicar_indices(db, ["festivales"])
+    version_anterior = version_datos(db, "festivales")
+
+    def escribir(lote):
+        # Hashes guardados de las ediciones del lote (las que no estan son nuevas)
+        guardados = {festival["anyo"]: festival.get(CAMPO_HASH) for festival in
+                     coleccion.find({"anyo": {"$in": [edicion["anyo"] for edicion, _ in lote]}},
+                                    {"_id": 0, "anyo": 1, CAMPO_HASH: 1})}
+        operaciones = []
+        for edicion, hash_contenido in lote:
+            if guardados.get(edicion["anyo"]) == hash_contenido:
+                resultado.sin_cambios += 1
+            else:
+                operaciones.append(operacion_edicion(edicion, hash_contenido, edicion["anyo"] in guardados))
+                # Si el anyo se repite en el lote, la segunda vez ya existe
+                guardados[edicion["anyo"]] = hash_contenido
+                resultado.anyos_modificados.append(edicion["anyo"])
+        if operaciones:
+            escrito = coleccion.bulk_write(operaciones, ordered=False)
+            resultado.insertadas += escrito.upserted_count
+            resultado.modificadas += escrito.modified_count
+        if informar is not None:
+            informar(resultado)
+
+    lote = []
+    try:
+        for edicion in ediciones:
+            lote.append((edicion, hash_edicion(edicion)))
+            resultado.ediciones += 1
+            resultado.actuaciones += len(edicion.get("concursantes", []))
+            if len(lote) >= tam_lote:
+                escribir(lote)
+                lote = []
+        if lote:
+            escribir(lote)
+    finally:
+        # Aunque la carga se interrumpa, los lotes ya escritos cambian los datos. Las caches que dependen
+        # de los festivales (y el indice en memoria de la trivia) se refrescan al ver la nueva version
+        if resultado.anyos_modificados:
+            incrementar_version(db, "festivales")
+            sincronizar_actuaciones(db, resultado.anyos_modificados, version_anterior=version_anterior)
+            aplicar_indices(db)
+    return resultado
@@ -0,0 +1,78 @@
+"""
+Modulo con los comandos de linea de comandos de la aplicacion (se ejecutan con "flask <comando>").
+"""
+import click
+from flask import Flask
+from . import mongo
+from .indices import aplicar_indices
+from .planes import comprobar_planes
+from .cargador import TAM_LOTE_CARGA, leer_ediciones, cargar_ediciones
+from .version_datos import version_datos
+from .trivia import exportar_instantanea
+
+# Numero maximo de anyos modificados que se muestran al terminar una carga
+MAX_ANYOS_INFORME = 50
+
+
+def registrar_comandos(app: Flask):
+    """
+    Registra los comandos en la aplicacion
+    """
+
+    @app.cli.command("crear-indices")
+    def crear_indices():
+        """
+        Crea los indices del manifiesto (los que ya existen no se modifican)
+        """
+        for coleccion, indices in aplicar_indices(mongo.db).items():
+            click.echo(f"{coleccion}: {', '.join(indices)}")
+
+    @app.cli.command("comprobar-planes")
+    def comprobar_planes_consulta():
+        """
+        Comprueba que ninguna forma de consulta de la aplicacion recorre una coleccion entera (COLLSCAN)
+        """
+        fallos = comprobar_planes(mongo.db)
+        for nombre in fallos:
+            click.echo(f"COLLSCAN: {nombre}", err=True)
+        if fallos:
+            raise click.ClickException(f"{len(fallos)} consultas sin indice")
+        click.echo("Todas las consultas usan un indice")
+
+    @app.cli.command("cargar-festivales")
+    @click.argument("fichero", type=click.File("r", encoding="utf-8"), default="festivales.json")
+    @click.option("--lote", default=TAM_LOTE_CARGA, show_default=True, type=click.IntRange(min=1),
+                  help="Ediciones por cada bulk_write")
+    def cargar_festivales(fichero, lote):
+        """
+        Carga (o actualiza) las ediciones de un fichero con una edicion por linea en Extended JSON
+        """
+        try:
+            resultado = cargar_ediciones(mongo.db, leer_ediciones(fichero), lote,
+                                         informar=lambda parcial: click.echo(parcial, err=True))
+        except ValueError as error:
+            raise click.ClickException(str(error))
+        click.echo(f"Carga completa: {resultado}")
+        anyos = sorted(resultado.anyos_modificados)
+        if anyos:
+            resto = f" y {len(anyos) - MAX_ANYOS_INFORME} mas" if len(anyos) > MAX_ANYOS_INFORME else ""
+            click.echo(f"Anyos modificados: {', '.join(map(str, anyos[:MAX_ANYOS_INFORME]))}{resto}")
+        else:
+            click.echo("No ha cambiado ninguna edicion: la version de los datos se mantiene")
+
+    @app.cli.command("exportar-instantanea")
+    @click.argument("ruta", required=False)
+    def exportar_instantanea_indice(ruta):
+        """
+        Exporta el indice de la trivia a una instantanea en disco (por defecto, en TRIVIA_INSTANTANEA)
+        """
+        ruta = ruta or app.config["TRIVIA_INSTANTANEA"]
+        if not ruta:
+            raise click.ClickException("Hay que indicar la ruta o configurar TRIVIA_INSTANTANEA")
+        try:
+            metadatos = exportar_instantanea(mongo.db["festivales"], ruta, version_datos(mongo.db, "festivales"))
+        except RuntimeError as error:
+            raise click.ClickException(str(error))
+        click.echo(f"Instantanea de la version {metadatos['version']} en {ruta}: {metadatos['actuaciones']} "
+                   f"actuaciones, {metadatos['anyos']} anyos, {metadatos['paises']} paises y "
+                   f"{metadatos['cadenas']} cadenas")
@@ -0,0 +1,51 @@
+"""
+Modulo con las consultas de las rutas. Estan definidas aqui (y no dentro de cada ruta) para que la
+comprobacion de los planes de consulta (ver "comprobar_planes" en el modulo "indices") ejecute exactamente
+las mismas consultas que la aplicacion.
+"""
+from typing import List, Dict, Any, Optional
+from .paginacion import PaginacionKeyset
+
+# Numero de elementos por pagina de cada listado
+EDICIONES_POR_PAGINA = 5
+ACTUACIONES_POR_PAGINA = 10
+QUIZZES_POR_PAGINA = 20
+
+# Resumen de cada edicion en la lista de ediciones. Los concursantes se cargan bajo demanda
+RESUMEN_EDICION = {"_id": 0, "anyo": 1, "ciudad": 1, "pais": 1, "fecha": 1,
+                   "num_concursantes": {"$size": "$concursantes"}}
+
+# Faceta extra de la pagina de un pais: su nombre (si no hay ninguno, el pais no existe)
+FACETAS_PAIS: Dict[str, List[Dict[str, Any]]] = {"nombre": [{"$limit": 1}, {"$project": {"_id": 0, "pais": 1}}]}
+
+
+def paginacion_ediciones(coleccion_festivales) -> PaginacionKeyset:
+    """
+    Ediciones ordenadas por anyo (descendente), solo con su resumen
+    """
+    return PaginacionKeyset(coleccion_festivales, [("anyo", -1)], EDICIONES_POR_PAGINA, proyeccion=RESUMEN_EDICION)
+
+
+def buscar_edicion(coleccion_festivales, anyo: int,
+                   proyeccion: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Edicion de un anyo (o None si no existe)
+    """
+    return coleccion_festivales.find_one({"anyo": anyo}, proyeccion)
+
+
+def paginacion_actuaciones_pais(coleccion_actuaciones, id_pais: str) -> PaginacionKeyset:
+    """
+    Actuaciones de un pais por la clave (anyo, id_pais). Se usa con "pagina_facet" y FACETAS_PAIS
+    """
+    return PaginacionKeyset(coleccion_actuaciones, [("anyo", -1), ("id_pais", 1)], ACTUACIONES_POR_PAGINA,
+                            [{"$match": {"id_pais": id_pais}}], {"_id": 0})
+
+
+def paginacion_quizzes(coleccion_quizzes) -> PaginacionKeyset:
+    """
+    Quizzes ordenados por fecha de creacion (descendente). El "_id" (nombre del quiz) desempata los quizzes
+    creados a la vez. Solo se leen los campos de la lista
+    """
+    return PaginacionKeyset(coleccion_quizzes, [("creacion", -1), ("_id", -1)], QUIZZES_POR_PAGINA,
+                            proyeccion={"_id": 1, "creacion": 1})
@@ -0,0 +1,246 @@
+"""
+Modulo que define una cola de escritura diferida ("write-behind"). Las peticiones solo encolan los
+documentos, y un hilo en segundo plano los escribe en lotes, cuando se llena un lote o cuando pasa el
+intervalo maximo de espera. Asi, la latencia de las peticiones no depende de la latencia de escritura de
+Mongo.
+
+La cola esta acotada: si se llena, las peticiones esperan (como mucho "espera_maxima" segundos) a que
+se vacie. Los "_id" de los documentos pendientes se guardan para detectar duplicados al encolar.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import List, Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentoDuplicado(Exception):
+    """
+    Ya existe (o esta pendiente de escribir) un documento con el mismo "_id"
+    """
+
+
+class ColaLlena(Exception):
+    """
+    La cola sigue llena despues de esperar el tiempo maximo
+    """
+
+
+class EscrituraParcial(Exception):
+    """
+    La funcion de escritura solo ha escrito una parte del lote. "fallidos" son los documentos que hay que
+    volver a intentar y "duplicados" los "_id" de los que ya existian en la base de datos (no se reintentan)
+    """
+
+    def __init__(self, fallidos: List[Dict[str, Any]], duplicados: Optional[List[Any]] = None):
+        super().__init__(f"{len(fallidos)} documentos sin escribir")
+        self.fallidos = fallidos
+        self.duplicados = duplicados or []
+
+
+class ColaEscritura:
+    """
+    Cola acotada de documentos pendientes de escribir. La funcion "escribir" recibe una lista de documentos
+    y los escribe (por ejemplo, con "insert_many"). Devuelve los "_id" de los documentos que no ha escrito
+    porque ya existian (o None si los ha escrito todos). Si lanza EscrituraParcial, solo se vuelven a
+    intentar sus documentos fallidos; con cualquier otra excepcion, el lote entero. Los reintentos se hacen
+    tras el intervalo de espera, hasta "max_intentos" veces. Despues los documentos se descartan (se
+    registran en el log), para que un error permanente no bloquee el resto de la cola.
+    """
+
+    def __init__(self, escribir: Callable[[List[Dict[str, Any]]], None], tam_lote: int = 100,
+                 intervalo: float = 0.5, max_pendientes: int = 1000, espera_maxima: float = 5.0,
+                 max_intentos: int = 3):
+        self._escribir = escribir
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        self.max_pendientes = max_pendientes
+        self.espera_maxima = espera_maxima
+        self.max_intentos = max_intentos
+
+        # Documentos encolados (con el instante en el que se encolaron) y "_id" de todos los documentos que
+        # todavia no estan escritos (encolados, reservados o en el lote que se esta escribiendo)
+        self._pendientes: "deque[tuple]" = deque()
+        self._ids: Dict[Any, Optional[Dict[str, Any]]] = {}
+        # Funciones que se llaman cuando se escribe cada documento (ver "encolar")
+        self._al_escribir: Dict[Any, Callable[[], None]] = {}
+        self._condicion = threading.Condition()
+        self._hilo = None
+        self._parar = False
+
+        # Contadores
+        self._escritos = 0
+        self._lotes = 0
+        self._errores = 0
+        self._esperas = 0
+        self._descartados = 0
+        self._duplicados = 0
+
+    def iniciar(self):
+        """
+        Arranca el hilo de escritura (si no esta ya arrancado)
+        """
+        with self._condicion:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._parar = False
+            self._hilo = threading.Thread(target=self._bucle_escritura, name="cola-escritura", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        """
+        Escribe todos los documentos pendientes y detiene el hilo de escritura
+        """
+        with self._condicion:
+            self._parar = True
+            self._condicion.notify_all()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+
+    def encolar(self, documento: Dict[str, Any], existe: Optional[Callable[[Any], bool]] = None,
+                al_escribir: Optional[Callable[[], None]] = None):
+        """
+        Encola un documento. Si ya hay uno pendiente con el mismo "_id", o si "existe" (la comprobacion en
+        la base de datos) devuelve True, lanza DocumentoDuplicado. Si la cola esta llena y no se vacia a
+        tiempo, lanza ColaLlena. La funcion "al_escribir" se llama desde el hilo de escritura cuando el
+        documento ya esta escrito (no se llama si resulta duplicado o se descarta).
+        """
+        self.iniciar()
+        identificador = documento["_id"]
+
+        with self._condicion:
+            if identificador in self._ids:
+                raise DocumentoDuplicado(identificador)
+            if len(self._ids) >= self.max_pendientes:
+                self._esperas += 1
+                if not self._condicion.wait_for(lambda: len(self._ids) < self.max_pendientes,
+                                                timeout=self.espera_maxima):
+                    raise ColaLlena()
+                if identificador in self._ids:
+                    raise DocumentoDuplicado(identificador)
+            # Reservamos el "_id" antes de comprobar la base de datos, para que un documento que se esta
+            # escribiendo en ese momento siga contando como pendiente
+            self._ids[identificador] = None
+
+        try:
+            if existe is not None and existe(identificador):
+                raise DocumentoDuplicado(identificador)
+        except BaseException:
+            with self._condicion:
+                del self._ids[identificador]
+                self._condicion.notify_all()
+            raise
+
+        with self._condicion:
+            self._ids[identificador] = documento
+            if al_escribir is not None:
+                self._al_escribir[identificador] = al_escribir
+            self._pendientes.append((time.monotonic(), documento))
+            if len(self._pendientes) >= self.tam_lote:
+                self._condicion.notify_all()
+
+    def pendiente(self, identificador: Any) -> Optional[Dict[str, Any]]:
+        """
+        Devuelve el documento pendiente de escribir con ese "_id" (o None), para poder leerlo antes de
+        que llegue a la base de datos
+        """
+        with self._condicion:
+            return self._ids.get(identificador)
+
+    def _bucle_escritura(self):
+        lote = []
+        intentos = 0
+        while True:
+            with self._condicion:
+                # Un lote que ha fallado se reintenta antes de coger documentos nuevos
+                if not lote:
+                    while not self._pendientes and not self._parar:
+                        self._condicion.wait()
+                    if not self._pendientes:
+                        return
+
+                    # Esperamos a completar un lote o a que el documento mas antiguo lleve "intervalo" segundos
+                    limite = self._pendientes[0][0] + self.intervalo
+                    while len(self._pendientes) < self.tam_lote and not self._parar:
+                        restante = limite - time.monotonic()
+                        if restante <= 0:
+                            break
+                        self._condicion.wait(restante)
+
+                    lote = [self._pendientes.popleft()[1]
+                            for _ in range(min(self.tam_lote, len(self._pendientes)))]
+                    intentos = 0
+                parar = self._parar
+
+            # La escritura se hace fuera del lock, para no bloquear a las peticiones
+            intentos += 1
+            duplicados = []
+            reintentar = []
+            try:
+                duplicados = list(self._escribir(lote) or [])
+            except EscrituraParcial as error:
+                logger.warning("No se han escrito %d de %d documentos (intento %d de %d)",
+                               len(error.fallidos), len(lote), intentos, self.max_intentos)
+                duplicados = list(error.duplicados)
+                reintentar = error.fallidos
+            except Exception:
+                logger.exception("Error al escribir un lote de %d documentos (intento %d de %d)",
+                                 len(lote), intentos, self.max_intentos)
+                reintentar = lote
+
+            ids_duplicados = set(duplicados)
+            ids_reintentar = {documento["_id"] for documento in reintentar}
+            escritos = [documento for documento in lote
+                        if documento["_id"] not in ids_duplicados and documento["_id"] not in ids_reintentar]
+            with self._condicion:
+                self._escritos += len(escritos)
+                self._duplicados += len(ids_duplicados)
+                if not reintentar:
+                    self._lotes += 1
+                    terminados, lote = lote, []
+                else:
+                    self._errores += 1
+                    # Al detener la cola no se reintenta, para no bloquear el cierre de la aplicacion
+                    if not parar and intentos < self.max_intentos:
+                        terminados = [documento for documento in lote if documento["_id"] not in ids_reintentar]
+                        lote = reintentar
+                    else:
+                        logger.error("Documentos descartados: %s", reintentar)
+                        self._descartados += len(reintentar)
+                        terminados, lote = lote, []
+
+                avisos = [self._al_escribir.pop(documento["_id"]) for documento in escritos
+                          if documento["_id"] in self._al_escribir]
+                for documento in terminados:
+                    self._ids.pop(documento["_id"], None)
+                    self._al_escribir.pop(documento["_id"], None)
+                self._condicion.notify_all()
+
+            for aviso in avisos:
+                try:
+                    aviso()
+                except Exception:
+                    logger.exception("Error al procesar un documento escrito")
+
+            # Un lote que ha fallado se reintenta tras el intervalo de espera
+            if lote:
+                with self._condicion:
+                    self._condicion.wait(self.intervalo)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """
+        Devuelve los contadores de la cola
+        """
+        with self._condicion:
+            return {
+                "pendientes": len(self._ids),
+                "escritos": self._escritos,
+                "lotes": self._lotes,
+                "errores": self._errores,
+                "esperas": self._esperas,
+                "descartados": self._descartados,
+                "duplicados": self._duplicados,
+            }
@@ -0,0 +1,75 @@
+"""
+Modulo con las estadisticas de las partidas de los quizzes guardados. Cada quiz tiene un documento en la
+coleccion "estadisticas_quizzes" (con el mismo "_id" que el quiz) con contadores que se actualizan con un
+solo "$inc" atomico por partida, de manera que leer las estadisticas de un quiz es una busqueda por "_id",
+sin recorrer los quizzes ni las partidas.
+
+Contadores de cada documento:
+    * "partidas", "aciertos", "respuestas" y "puntos": totales de todas las partidas.
+    * "distribucion.<n>": numero de partidas con n aciertos.
+    * "preguntas.<i>.partidas" y "preguntas.<i>.aciertos": contadores de la pregunta i del quiz.
+"""
+from typing import List, Dict, Any, Optional, Iterable
+
+COLECCION_ESTADISTICAS = "estadisticas_quizzes"
+
+
+def registrar_partida(db, nombre: Any, preguntas: List[Dict[str, Any]], seleccionadas: List[Optional[int]]):
+    """
+    Suma una partida a las estadisticas del quiz "nombre". Las "preguntas" son las del quiz (con los campos
+    "correcta" y "puntuacion") y "seleccionadas" las respuestas elegidas (None si no se contesto)
+    """
+    incrementos = {"partidas": 1, "respuestas": len(preguntas)}
+    aciertos = 0
+    puntos = 0
+    for i, (pregunta, seleccionada) in enumerate(zip(preguntas, seleccionadas)):
+        acierto = seleccionada is not None and seleccionada == pregunta.get("correcta")
+        aciertos += acierto
+        puntos += pregunta.get("puntuacion", 0) if acierto else 0
+        incrementos[f"preguntas.{i}.partidas"] = 1
+        incrementos[f"preguntas.{i}.aciertos"] = int(acierto)
+    incrementos["aciertos"] = aciertos
+    incrementos["puntos"] = puntos
+    incrementos[f"distribucion.{aciertos}"] = 1
+
+    db[COLECCION_ESTADISTICAS].update_one({"_id": nombre}, {"$inc": incrementos}, upsert=True)
+
+
+def resumen(documento: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Resumen de las estadisticas de un quiz: partidas, tasa de aciertos, puntuacion media, distribucion de
+    aciertos ({n: partidas}) y tasa de aciertos de cada pregunta
+    """
+    documento = documento or {}
+    partidas = documento.get("partidas", 0)
+    respuestas = documento.get("respuestas", 0)
+    preguntas = documento.get("preguntas", {})
+    return {
+        "partidas": partidas,
+        "tasa_aciertos": documento.get("aciertos", 0) / respuestas if respuestas else 0.0,
+        "puntuacion_media": documento.get("puntos", 0) / partidas if partidas else 0.0,
+        "distribucion": {int(n): veces for n, veces in sorted(documento.get("distribucion", {}).items(),
+                                                               key=lambda elemento: int(elemento[0]))},
+        "preguntas": [
+            preguntas[str(i)]["aciertos"] / preguntas[str(i)]["partidas"] if preguntas[str(i)]["partidas"] else 0.0
+            for i in sorted(map(int, preguntas))
+        ],
+    }
+
+
+def estadisticas_quiz(db, nombre: Any) -> Dict[str, Any]:
+    """
+    Devuelve el resumen de las estadisticas de un quiz
+    """
+    return resumen(db[COLECCION_ESTADISTICAS].find_one({"_id": nombre}))
+
+
+def estadisticas_quizzes(db, nombres: Iterable[Any]) -> Dict[Any, Dict[str, Any]]:
+    """
+    Devuelve el resumen de las estadisticas de varios quizzes (por ejemplo, los de una pagina) con una
+    sola consulta por "_id"
+    """
+    nombres = list(nombres)
+    documentos = {documento["_id"]: documento
+                  for documento in db[COLECCION_ESTADISTICAS].find({"_id": {"$in": nombres}})} if nombres else {}
+    return {nombre: resumen(documentos.get(nombre)) for nombre in nombres}
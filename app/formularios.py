@@ -3,6 +3,7 @@ Modulo en el que definimos los formularios de nuestra aplicacion
 """
 from typing import List
 from . import mongo
+from .bloom import nombres_quizzes
 from wtforms import StringField, SubmitField, ValidationError
 from .render_utils import MultiCheckboxField
 from flask_wtf import FlaskForm
@@ -41,9 +42,10 @@ class GenerarQuizForm(FlaskForm):
 
     def validate_nombre(self, field):
         """
-        Validador que comprueba si existe ya un quiz con el nombre asociado
+        Validador que comprueba si existe ya un quiz con el nombre asociado (solo consulta a Mongo si
+        el filtro de Bloom de nombres en uso no lo descarta)
         """
-        if mongo.db["quizzes"].find_one({"_id": field.data}, {"_id": 1}):
+        if not nombres_quizzes.disponible(mongo.db["quizzes"], field.data):
             raise ValidationError("Ya existe un quizz con ese nombre")
 
     def validate_seleccion_anyos(self, field):
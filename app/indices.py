@@ -0,0 +1,42 @@
+"""
+Modulo con el manifiesto de indices de la base de datos.
+
+Los indices se declaran en "MANIFIESTO_INDICES" y se crean con "aplicar_indices", que se puede llamar
+tantas veces como se quiera (Mongo no hace nada si el indice ya existe). La comprobacion de que las
+consultas los usan esta en el modulo "planes".
+"""
+from typing import List, Dict, Optional, Iterable
+from pymongo import IndexModel, ASCENDING, DESCENDING
+
+# Indices de cada coleccion
+MANIFIESTO_INDICES: Dict[str, List[IndexModel]] = {
+    "festivales": [
+        # Paginacion de ediciones, busqueda de una edicion y filtros de anyos de la trivia
+        IndexModel([("anyo", ASCENDING)], name="anyo", unique=True),
+        # Filtros y selecciones por pais organizador
+        IndexModel([("pais", ASCENDING)], name="pais"),
+        # Busquedas por pais participante
+        IndexModel([("concursantes.id_pais", ASCENDING)], name="concursantes_id_pais"),
+        IndexModel([("concursantes.pais", ASCENDING), ("anyo", ASCENDING)], name="concursantes_pais_anyo"),
+    ],
+    "actuaciones": [
+        # Paginas de cada pais
+        IndexModel([("id_pais", ASCENDING), ("anyo", ASCENDING)], name="id_pais_anyo"),
+        # Selecciones aleatorias de la trivia (tambien el orden de la seleccion reproducible sin filtros)
+        IndexModel([("anyo", ASCENDING), ("id_pais", ASCENDING)], name="anyo_id_pais"),
+        IndexModel([("pais", ASCENDING), ("anyo", ASCENDING)], name="pais_anyo"),
+    ],
+    "quizzes": [
+        # Paginacion de quizzes por fecha de creacion (el nombre desempata)
+        IndexModel([("creacion", DESCENDING), ("_id", DESCENDING)], name="creacion_id"),
+    ],
+}
+
+
+def aplicar_indices(db, colecciones: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+    """
+    Crea los indices del manifiesto de las colecciones indicadas (o de todas). Devuelve los nombres de los
+    indices de cada coleccion.
+    """
+    colecciones = MANIFIESTO_INDICES.keys() if colecciones is None else colecciones
+    return {coleccion: db[coleccion].create_indexes(MANIFIESTO_INDICES[coleccion]) for coleccion in colecciones}
@@ -0,0 +1,245 @@
+"""
+Modulo de paginacion por cursor ("keyset"). En lugar de saltar los documentos de las paginas anteriores
+con "skip" (cada vez mas lento segun avanzamos), cada pagina empieza despues de la clave del ultimo
+documento de la anterior, de manera que el coste de una pagina no depende de su posicion.
+
+Las claves se pasan entre paginas como cursores opacos (base64 del JSON extendido de la clave).
+"""
+import base64
+import binascii
+import math
+from typing import List, Dict, Any, Optional, Tuple, Callable
+from bson import json_util
+
+# Orden de la paginacion: lista de (campo, direccion). El ultimo campo debe hacer la clave unica
+Orden = List[Tuple[str, int]]
+
+# Numero de paginas que se enlazan a cada lado de la actual
+RADIO_VENTANA = 2
+
+
+def codificar_cursor(clave: List[Any]) -> str:
+    """
+    Convierte la clave de un documento en un cursor opaco que se puede usar en una URL
+    """
+    return base64.urlsafe_b64encode(json_util.dumps(clave).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> Optional[List[Any]]:
+    """
+    Recupera la clave de un cursor. Si el cursor no es valido, devuelve None.
+    """
+    try:
+        clave = json_util.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8"))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    return clave if isinstance(clave, list) else None
+
+
+def condicion_despues(orden: Orden, clave: List[Any]) -> Dict[str, Any]:
+    """
+    Condicion de los documentos que van despues de la clave en el orden dado (comparacion lexicografica)
+    """
+    alternativas = []
+    for i, (campo, direccion) in enumerate(orden):
+        condicion = {campo_previo: valor for (campo_previo, _), valor in zip(orden[:i], clave[:i])}
+        condicion[campo] = {"$gt" if direccion == 1 else "$lt": clave[i]}
+        alternativas.append(condicion)
+    return alternativas[0] if len(alternativas) == 1 else {"$or": alternativas}
+
+
+def _invertir(orden: Orden) -> Orden:
+    return [(campo, -direccion) for campo, direccion in orden]
+
+
+class Pagina:
+    """
+    Resultado de una consulta paginada: documentos de la pagina, numero de pagina y cursores de las
+    paginas cercanas. Un cursor None corresponde a la primera pagina.
+    """
+
+    def __init__(self, elementos: List[Dict[str, Any]], numero: int, total_paginas: int,
+                 ventana: List[Tuple[int, Optional[str]]], ultima: Optional[Tuple[int, Optional[str]]]):
+        self.elementos = elementos
+        self.numero = numero
+        self.total_paginas = total_paginas
+        self.ventana = ventana
+        self.ultima = ultima
+
+    def _cursor(self, numero: int) -> Tuple[bool, Optional[str]]:
+        for numero_ventana, cursor in self.ventana:
+            if numero_ventana == numero:
+                return True, cursor
+        return False, None
+
+    @property
+    def anterior(self) -> Tuple[bool, Optional[str]]:
+        """
+        (existe, cursor) de la pagina anterior
+        """
+        return self._cursor(self.numero - 1)
+
+    @property
+    def siguiente(self) -> Tuple[bool, Optional[str]]:
+        """
+        (existe, cursor) de la pagina siguiente
+        """
+        return self._cursor(self.numero + 1)
+
+
+class PaginacionKeyset:
+    """
+    Pagina el resultado de una agregacion por las claves de "orden". Las "fases" son las fases previas
+    de la agregacion (filtro, "$unwind", "$project"...), y tras ellas deben existir los campos de la clave.
+    La "proyeccion" opcional se aplica solo a los documentos de la pagina.
+    """
+
+    def __init__(self, coleccion, orden: Orden, por_pagina: int, fases: Optional[List[Dict[str, Any]]] = None,
+                 proyeccion: Optional[Dict[str, Any]] = None, radio: int = RADIO_VENTANA):
+        self._coleccion = coleccion
+        self.orden = orden
+        self.por_pagina = por_pagina
+        self._fases = fases or []
+        self._proyeccion = proyeccion
+        self.radio = radio
+
+    def _clave(self, documento: Dict[str, Any]) -> List[Any]:
+        return [documento[campo] for campo, _ in self.orden]
+
+    def _claves(self, documentos: List[Dict[str, Any]]) -> List[List[Any]]:
+        return [self._clave(documento) for documento in documentos]
+
+    def _decodificar(self, cursor: Optional[str]) -> Optional[List[Any]]:
+        if not cursor:
+            return None
+        clave = decodificar_cursor(cursor)
+        if clave is None or len(clave) != len(self.orden):
+            raise ValueError("Cursor de paginacion no valido")
+        return clave
+
+    def _fases_consulta(self, orden: Orden, despues: Optional[List[Any]], limite: int,
+                        solo_claves: bool = False, saltar: int = 0) -> List[Dict[str, Any]]:
+        """
+        Fases (posteriores a las fases previas) que devuelven los "limite" documentos siguientes a la clave
+        "despues" en el orden dado, saltando los "saltar" primeros
+        """
+        fases = []
+        if despues is not None:
+            fases.append({"$match": condicion_despues(orden, despues)})
+        fases.append({"$sort": dict(orden)})
+        if saltar:
+            fases.append({"$skip": saltar})
+        fases.append({"$limit": limite})
+        if solo_claves:
+            fases.append({"$project": {campo: 1 for campo, _ in orden}})
+        elif self._proyeccion is not None:
+            fases.append({"$project": self._proyeccion})
+        return fases
+
+    def _consultar(self, orden: Orden, despues: Optional[List[Any]], limite: int,
+                   solo_claves: bool = False) -> List[Dict[str, Any]]:
+        return list(self._coleccion.aggregate([*self._fases, *self._fases_consulta(orden, despues, limite,
+                                                                                   solo_claves)]))
+
+    def pagina(self, cursor: Optional[str], numero: int, total: int) -> Pagina:
+        """
+        Devuelve la pagina que empieza despues del cursor (o la primera, si no hay cursor). El "numero"
+        de pagina es el que llega en la URL: solo se usa para mostrarlo y se corrige cerca del principio.
+        El "total" de documentos (que puede estar en cache o ser estimado) solo se usa para la ultima pagina.
+        Si el cursor no es valido se lanza ValueError.
+        """
+        clave = self._decodificar(cursor)
+        elementos = self._consultar(self.orden, clave, self.por_pagina)
+        return self._construir(
+            cursor, clave, numero, total, elementos,
+            previas=lambda: self._claves(self._consultar(_invertir(self.orden), clave,
+                                                         self.radio * self.por_pagina, True)),
+            siguientes=lambda: self._claves(self._consultar(self.orden, self._clave(elementos[-1]),
+                                                            (self.radio - 1) * self.por_pagina + 1, True)),
+            finales=lambda limite: self._claves(self._consultar(_invertir(self.orden), None, limite, True))
+        )
+
+    def pagina_facet(self, cursor: Optional[str], numero: int,
+                     extras: Optional[Dict[str, List[Dict[str, Any]]]] = None) -> Tuple[Pagina, Dict[str, Any]]:
+        """
+        Igual que "pagina", pero con una sola agregacion "$facet" que devuelve tambien el total de documentos
+        y las facetas "extras". Devuelve la pagina y el resultado de la agregacion. Como las facetas no pueden
+        usar indices, las fases previas deben empezar con un filtro selectivo.
+        """
+        clave = self._decodificar(cursor)
+        facetas = {
+            "elementos": self._fases_consulta(self.orden, clave, self.por_pagina),
+            "siguientes": self._fases_consulta(self.orden, clave, (self.radio - 1) * self.por_pagina + 1, True,
+                                               self.por_pagina),
+            "finales": self._fases_consulta(_invertir(self.orden), None, self.por_pagina + 1, True),
+            "total": [{"$count": "total"}],
+            **(extras or {})
+        }
+        if clave is not None:
+            facetas["previas"] = self._fases_consulta(_invertir(self.orden), clave, self.radio * self.por_pagina,
+                                                      True)
+
+        resultado = next(self._coleccion.aggregate([*self._fases, {"$facet": facetas}]), {})
+        total = resultado["total"][0]["total"] if resultado.get("total") else 0
+        pagina = self._construir(
+            cursor, clave, numero, total, resultado.get("elementos", []),
+            previas=lambda: self._claves(resultado.get("previas", [])),
+            siguientes=lambda: self._claves(resultado.get("siguientes", [])),
+            finales=lambda limite: self._claves(resultado.get("finales", [])[:limite])
+        )
+        return pagina, resultado
+
+    def _construir(self, cursor: Optional[str], clave: Optional[List[Any]], numero: int, total: int,
+                   elementos: List[Dict[str, Any]], previas: Callable[[], List[List[Any]]],
+                   siguientes: Callable[[], List[List[Any]]],
+                   finales: Callable[[int], List[List[Any]]]) -> Pagina:
+        """
+        Construye la pagina a partir de sus documentos. Las claves de las paginas cercanas se piden solo
+        si hacen falta: "previas" (anteriores al cursor, en orden inverso), "siguientes" (posteriores al
+        ultimo documento) y "finales" (las n ultimas, en orden inverso).
+        """
+        total_paginas = max(1, math.ceil(total / self.por_pagina))
+
+        # Paginas anteriores
+        ventana = []
+        if clave is None:
+            numero = 1
+        else:
+            # La primera clave previa es la del propio cursor (ultimo documento de la pagina anterior)
+            claves_previas = [clave] + previas()
+            # Si llegamos al principio, sabemos exactamente en que pagina estamos
+            if len(claves_previas) <= self.radio * self.por_pagina:
+                numero = math.ceil(len(claves_previas) / self.por_pagina) + 1
+            else:
+                numero = max(numero, self.radio + 2)
+            for j in range(self.radio, 0, -1):
+                if numero - j < 1:
+                    continue
+                inicio = j * self.por_pagina
+                ventana.append((numero - j, codificar_cursor(claves_previas[inicio])
+                                if len(claves_previas) > inicio else None))
+
+        ventana.append((numero, cursor or None))
+
+        # Paginas siguientes
+        if len(elementos) == self.por_pagina:
+            ultima_clave = self._clave(elementos[-1])
+            claves_siguientes = siguientes()
+            for j in range(1, self.radio + 1):
+                inicio = (j - 1) * self.por_pagina
+                if len(claves_siguientes) <= inicio:
+                    break
+                ventana.append((numero + j, codificar_cursor(
+                    ultima_clave if j == 1 else claves_siguientes[inicio - 1])))
+
+        total_paginas = max(total_paginas, ventana[-1][0])
+
+        # Ultima pagina: se busca desde el final, con el numero de documentos que le corresponden
+        ultima = None
+        if total_paginas > ventana[-1][0]:
+            en_ultima = total - (total_paginas - 1) * self.por_pagina
+            claves_finales = finales(en_ultima + 1)
+            if len(claves_finales) > en_ultima:
+                ultima = (total_paginas, codificar_cursor(claves_finales[en_ultima]))
+
+        return Pagina(elementos, numero, total_paginas, ventana, ultima)
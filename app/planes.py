@@ -0,0 +1,299 @@
+"""
+Modulo con la comprobacion de los planes de consulta de la aplicacion.
+
+Las formas de consulta no se escriben a mano: se ejecutan las mismas funciones que usan las rutas (ver el
+modulo "consultas") y la trivia (OperacionesEurovision y OperacionesLote) sobre colecciones que registran
+cada comando que envian a Mongo. Despues, "comprobar_planes" ejecuta "explain" sobre cada comando registrado
+y devuelve los que recorren la coleccion entera. Asi la comprobacion no puede quedarse desfasada respecto
+al codigo.
+"""
+import random
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from pymongo import DESCENDING
+from .actuaciones import COLECCION_ACTUACIONES, asegurar_actuaciones, id_actuacion
+from .cache import CacheDistinct
+from .consultas import (paginacion_ediciones, buscar_edicion, paginacion_actuaciones_pais, FACETAS_PAIS,
+                        paginacion_quizzes)
+from .estadisticas import estadisticas_quizzes
+from .paginacion import codificar_cursor
+from .trivia import (OperacionesEurovision, OperacionesLote, PaisActuacion, expandir_preguntas,
+                     PreguntaNoDisponible)
+from .trivia.indice import datos_coleccion
+from .trivia.referencias import TIPOS_PREGUNTA
+
+# Errores de los datos de ejemplo (por ejemplo, un pais sin actuaciones en los anyos elegidos). La consulta
+# ya se ha registrado cuando la trivia falla al usar su resultado
+_ERRORES_DATOS = (KeyError, IndexError, TypeError, ValueError, StopIteration, PreguntaNoDisponible)
+
+
+class _CursorRegistrado:
+    """
+    Envuelve un cursor de "find" para anotar en el comando registrado el orden y el limite que se le
+    aplican despues de crearlo
+    """
+
+    def __init__(self, cursor, comando: Dict[str, Any]):
+        self._cursor = cursor
+        self._comando = comando
+
+    def sort(self, clave, direccion=None):
+        orden = [(clave, direccion if direccion is not None else 1)] if isinstance(clave, str) else clave
+        self._comando["sort"] = dict(orden)
+        self._cursor.sort(clave, direccion)
+        return self
+
+    def limit(self, limite: int):
+        self._comando["limit"] = limite
+        self._cursor.limit(limite)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+
+class ColeccionRegistrada:
+    """
+    Envuelve una coleccion de PyMongo y anota en "registro" el comando de cada consulta que ejecuta
+    (con la misma forma que le envia PyMongo a Mongo). El resto de atributos se delegan en la coleccion.
+    """
+
+    def __init__(self, coleccion, registro: "RegistroConsultas"):
+        self._coleccion = coleccion
+        self._registro = registro
+
+    def __getattr__(self, nombre):
+        return getattr(self._coleccion, nombre)
+
+    def _comando_find(self, filtro: Optional[Dict[str, Any]], proyeccion: Optional[Dict[str, Any]],
+                      orden=None, limite: int = 0) -> Dict[str, Any]:
+        comando = {"find": self._coleccion.name, "filter": filtro or {}}
+        if proyeccion is not None:
+            comando["projection"] = proyeccion
+        if orden:
+            comando["sort"] = dict(orden)
+        if limite:
+            comando["limit"] = limite
+        return comando
+
+    def aggregate(self, fases: List[Dict[str, Any]], *args, **kwargs):
+        self._registro.anotar({"aggregate": self._coleccion.name, "pipeline": list(fases), "cursor": {}})
+        return self._coleccion.aggregate(fases, *args, **kwargs)
+
+    def find(self, filtro: Optional[Dict[str, Any]] = None, proyeccion: Optional[Dict[str, Any]] = None,
+             *args, **kwargs):
+        comando = self._comando_find(filtro, proyeccion, kwargs.get("sort"), kwargs.get("limit", 0))
+        self._registro.anotar(comando)
+        return _CursorRegistrado(self._coleccion.find(filtro, proyeccion, *args, **kwargs), comando)
+
+    def find_one(self, filtro: Optional[Dict[str, Any]] = None, proyeccion: Optional[Dict[str, Any]] = None,
+                 *args, **kwargs):
+        self._registro.anotar(self._comando_find(filtro, proyeccion, kwargs.get("sort"), 1))
+        return self._coleccion.find_one(filtro, proyeccion, *args, **kwargs)
+
+    def count_documents(self, filtro: Dict[str, Any], *args, **kwargs) -> int:
+        self._registro.anotar({"aggregate": self._coleccion.name,
+                               "pipeline": [{"$match": filtro}, {"$group": {"_id": 1, "n": {"$sum": 1}}}],
+                               "cursor": {}})
+        return self._coleccion.count_documents(filtro, *args, **kwargs)
+
+    def distinct(self, campo: str, filtro: Optional[Dict[str, Any]] = None, *args, **kwargs) -> List[Any]:
+        self._registro.anotar({"distinct": self._coleccion.name, "key": campo, "query": filtro or {}})
+        return self._coleccion.distinct(campo, filtro, *args, **kwargs)
+
+
+class RegistroConsultas:
+    """
+    Registro de los comandos que ejecutan las colecciones registradas, agrupados por forma de consulta.
+    Cada comando se guarda como (nombre, comando, recorre_coleccion): el ultimo indica que la forma recorre
+    la coleccion entera por diseno (por ejemplo, "$sample" sobre todas las actuaciones) y no se comprueba.
+    Se puede usar en lugar de la base de datos en las funciones que reciben "db".
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._forma: Optional[Tuple[str, bool]] = None
+        self._comandos_forma = 0
+        self.comandos: List[Tuple[str, Dict[str, Any], bool]] = []
+
+    def coleccion(self, nombre: str) -> ColeccionRegistrada:
+        return ColeccionRegistrada(self._db[nombre], self)
+
+    def __getitem__(self, nombre: str) -> ColeccionRegistrada:
+        return self.coleccion(nombre)
+
+    @contextmanager
+    def forma(self, nombre: str, recorre_coleccion: bool = False):
+        """
+        Las consultas que se ejecuten dentro del bloque se registran con este nombre (numeradas si hay
+        varias). Los errores de los datos de ejemplo no interrumpen la comprobacion
+        """
+        self._forma = (nombre, recorre_coleccion)
+        self._comandos_forma = 0
+        try:
+            yield
+        except _ERRORES_DATOS:
+            pass
+        finally:
+            self._forma = None
+
+    def anotar(self, comando: Dict[str, Any]):
+        if self._forma is None:
+            return
+        nombre, recorre_coleccion = self._forma
+        self._comandos_forma += 1
+        if self._comandos_forma > 1:
+            nombre = f"{nombre} ({self._comandos_forma})"
+        self.comandos.append((nombre, comando, recorre_coleccion))
+
+
+def _formas_trivia(registro: RegistroConsultas, anyo: int, pais: str):
+    """
+    Ejecuta las selecciones de OperacionesEurovision y OperacionesLote con cada combinacion de filtros
+    (incluida la de sin filtros, que es la de /jugar por defecto), sobre festivales y sobre actuaciones,
+    con "$sample" y con la seleccion reproducible
+    """
+    festivales = registro.coleccion("festivales")
+    actuaciones = registro.coleccion(COLECCION_ACTUACIONES)
+    filtros = {"sin filtros": ([], []), "anyos": ([anyo - 1, anyo], []), "paises": ([], [pais]),
+               "anyos y paises": ([anyo - 1, anyo], [pais])}
+
+    for nombre_filtro, (anyos, paises) in filtros.items():
+        for nombre_coleccion, coleccion_actuaciones in (("festivales", None), ("actuaciones", actuaciones)):
+            # Sin filtros, las selecciones sobre festivales (que empiezan con "$unwind" de los concursantes)
+            # leen todas las ediciones por diseno. Las de actuaciones (la configuracion por defecto) si se
+            # comprueban
+            sin_indice = not anyos and not paises and coleccion_actuaciones is None
+            for nombre_muestra, aleatorio in (("$sample", None), ("semilla", random.Random(0))):
+                sufijo = f"[{nombre_filtro}, {nombre_coleccion}, {nombre_muestra}]"
+                operaciones = OperacionesEurovision(festivales, anyos, paises, aleatorio=aleatorio,
+                                                    actuaciones=coleccion_actuaciones)
+                selecciones = {
+                    "anyo aleatorio": lambda: operaciones.anyo_aleatorio(1),
+                    "paises organizadores": lambda: operaciones.paises_organizadores_aleatorios(1),
+                    "paises participantes": lambda: operaciones.paises_participantes_aleatorios(1),
+                    "participacion": lambda: operaciones.participacion_aleatoria(1),
+                    "primer anyo de participacion": lambda: operaciones.primer_anyo_participacion(pais),
+                    "valores del mismo pais": lambda: operaciones.valores_mismo_pais_aleatorios(pais, "cancion",
+                                                                                               "", 1),
+                    "participaciones de un anyo": lambda: operaciones.participaciones_anyo_aleatorias(anyo, 4),
+                    "rango de anyos": lambda: operaciones.rango_anyos_aleatorio(),
+                    "medias de un rango": lambda: operaciones.medias_puntuacion(anyo - 5, anyo, 3),
+                    "medias sin empate": lambda: operaciones.medias_sin_empate(3),
+                }
+                for nombre, seleccion in selecciones.items():
+                    with registro.forma(f"trivia: {nombre} {sufijo}", recorre_coleccion=sin_indice):
+                        seleccion()
+
+                # Sin filtros por diseno: recorren todos los paises participantes
+                with registro.forma(f"trivia: otros paises {sufijo}", recorre_coleccion=True):
+                    operaciones.otros_paises_aleatorios(pais, 3)
+
+                lote = OperacionesLote(festivales, anyos, paises, aleatorio=aleatorio,
+                                       actuaciones=coleccion_actuaciones)
+                # La precarga sin filtros muestrea todas las participaciones en un "$facet", sin "$match" previo
+                with registro.forma(f"trivia: precarga en lote {sufijo}", recorre_coleccion=not anyos and not paises):
+                    lote.precargar(list(TIPOS_PREGUNTA.values()))
+
+
+def formas_consulta(db) -> List[Tuple[str, Dict[str, Any], bool]]:
+    """
+    Ejecuta cada forma de consulta de la aplicacion, con valores de ejemplo sacados de la base de datos,
+    y devuelve los comandos registrados como (nombre, comando, recorre_coleccion)
+    """
+    asegurar_actuaciones(db)
+    festival = db["festivales"].find_one({}, {"anyo": 1, "pais": 1, "concursantes": {"$slice": 1}},
+                                         sort=[("anyo", DESCENDING)]) or {}
+    anyo = festival.get("anyo", 2000)
+    concursante = (festival.get("concursantes") or [{}])[0]
+    id_pais = concursante.get("id_pais", "es")
+    pais = concursante.get("pais", "España")
+    quiz = db["quizzes"].find_one({}, {"creacion": 1}) or {}
+    creacion = quiz.get("creacion", datetime.now())
+
+    registro = RegistroConsultas(db)
+    festivales = registro.coleccion("festivales")
+    actuaciones = registro.coleccion(COLECCION_ACTUACIONES)
+    quizzes = registro.coleccion("quizzes")
+
+    # Rutas
+    with registro.forma("ediciones: primera pagina"):
+        paginacion_ediciones(festivales).pagina(None, 1, 0)
+    with registro.forma("ediciones: pagina con cursor"):
+        paginacion_ediciones(festivales).pagina(codificar_cursor([anyo]), 2, 0)
+    with registro.forma("edicion"):
+        buscar_edicion(festivales, anyo)
+    with registro.forma("pais: primera pagina"):
+        paginacion_actuaciones_pais(actuaciones, id_pais).pagina_facet(None, 1, FACETAS_PAIS)
+    with registro.forma("pais: pagina con cursor"):
+        paginacion_actuaciones_pais(actuaciones, id_pais).pagina_facet(codificar_cursor([anyo, id_pais]), 2,
+                                                                       FACETAS_PAIS)
+    with registro.forma("quizzes: primera pagina"):
+        paginacion_quizzes(quizzes).pagina(None, 1, 0)
+    with registro.forma("quizzes: pagina con cursor"):
+        paginacion_quizzes(quizzes).pagina(codificar_cursor([creacion, ""]), 2, 0)
+    with registro.forma("quizzes: estadisticas"):
+        estadisticas_quizzes(registro, [quiz.get("_id", "")])
+    with registro.forma("quiz: actuaciones de las preguntas"):
+        expandir_preguntas([{"ref": {"tipo": PaisActuacion.__name__, "semilla": 0,
+                                     "claves": {"actuacion": id_actuacion(anyo, id_pais), "opciones": []}}}],
+                           actuaciones)
+    cache = CacheDistinct()
+    for campo, nombre in (("anyo", "anyos"), ("pais", "paises")):
+        with registro.forma(f"quiz: {nombre}"):
+            cache.obtener(festivales, campo, 0)
+
+    # Trivia
+    _formas_trivia(registro, anyo, pais)
+    with registro.forma("trivia: carga del indice"):
+        datos_coleccion(festivales)
+
+    return registro.comandos
+
+
+def _recorre_coleccion(plan: Any) -> bool:
+    """
+    Indica si un plan (o cualquier parte de la salida de "explain") contiene una fase COLLSCAN
+    """
+    if isinstance(plan, dict):
+        return plan.get("stage") == "COLLSCAN" or any(_recorre_coleccion(valor) for valor in plan.values())
+    if isinstance(plan, list):
+        return any(_recorre_coleccion(valor) for valor in plan)
+    return False
+
+
+def _planes_ganadores(explicacion: Any) -> List[Any]:
+    """
+    Extrae todos los planes ganadores de la salida de "explain" (las agregaciones pueden tener varios)
+    """
+    planes = []
+    if isinstance(explicacion, dict):
+        for clave, valor in explicacion.items():
+            if clave == "winningPlan":
+                planes.append(valor)
+            else:
+                planes.extend(_planes_ganadores(valor))
+    elif isinstance(explicacion, list):
+        for valor in explicacion:
+            planes.extend(_planes_ganadores(valor))
+    return planes
+
+
+def comprobar_planes(db) -> List[str]:
+    """
+    Ejecuta "explain" sobre cada forma de consulta y devuelve los nombres de las que tienen un plan
+    ganador con COLLSCAN (sin contar las que recorren la coleccion por diseno). Si la lista esta vacia,
+    todas las consultas usan algun indice.
+    """
+    fallos = []
+    for nombre, comando, recorre_coleccion in formas_consulta(db):
+        if recorre_coleccion:
+            continue
+        explicacion = db.command("explain", comando, verbosity="queryPlanner")
+        if any(_recorre_coleccion(plan) for plan in _planes_ganadores(explicacion)):
+            fallos.append(nombre)
+    return fallos
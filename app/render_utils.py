@@ -1,21 +1,72 @@
 """
 Modulo que contiene funciones auxiliares para renderizar
 """
-from flask import request, url_for
+from flask import request, url_for, g, get_template_attribute
 from wtforms import SelectMultipleField
-from wtforms.widgets import CheckboxInput
-from markupsafe import Markup
+from wtforms.widgets import CheckboxInput, html_params
+from markupsafe import Markup, escape
+from .cache import cache_fragmentos
+
+
+def _congelar(valor):
+    """
+    Convierte un valor (con diccionarios y listas anidados) en otro equivalente que se puede usar como clave
+    """
+    if isinstance(valor, dict):
+        return tuple(sorted((clave, _congelar(v)) for clave, v in valor.items()))
+    if isinstance(valor, (list, tuple)):
+        return tuple(_congelar(v) for v in valor)
+    return valor
+
+
+def fragmento_cacheado(plantilla: str, macro: str, *args):
+    """
+    Renderiza una macro de una plantilla, guardando el HTML en la cache de fragmentos. La clave son la
+    plantilla, la macro, sus argumentos y la version de los datos de la peticion (si se conoce, ver "cache_http").
+    Se registra como funcion global de las plantillas.
+    """
+    clave = (plantilla, macro, g.get("version_datos"), _congelar(args))
+    html = cache_fragmentos.obtener(clave)
+    if html is None:
+        html = Markup(get_template_attribute(plantilla, macro)(*args))
+        cache_fragmentos.guardar(clave, html)
+    return html
+
 
 ### Funciones auxilares para el formulario de CrearQuiz
 
 class BootstrapListOptions:
     """
-    Widged modificado para agrupar las opciones en listas de n elementos
+    Widged modificado para agrupar las opciones en listas de n elementos. La cuadricula se guarda en la cache
+    de fragmentos sin ninguna casilla marcada, partida en trozos por el final de cada casilla: en cada
+    peticion solo se anyade el atributo "checked" a las casillas seleccionadas.
     """
     def __call__(self, field, **kwargs):
         # Numero de elementos por columna
         n = getattr(field, 'elementos_por_fila', 4)
+
+        clave = ("BootstrapListOptions", field.id, field.name, n, _congelar(field.choices), g.get("version_datos"))
+        trozos = cache_fragmentos.obtener(clave)
+        if trozos is None:
+            trozos = self._trozos(field, n)
+            cache_fragmentos.guardar(clave, trozos)
+
+        # Intercalamos el estado de cada casilla (lo unico que depende de la peticion)
+        html = [trozos[0]]
+        for subfield, trozo in zip(field, trozos[1:]):
+            if subfield.checked:
+                html.append(' checked')
+            html.append(trozo)
+        return Markup(''.join(html))
+
+    @staticmethod
+    def _trozos(field, n):
+        """
+        Renderiza la cuadricula sin casillas marcadas. Devuelve una lista de trozos de HTML: entre cada
+        dos trozos consecutivos va el estado de una casilla.
+        """
         html = ['<div class="container-fluid">']
+        trozos = []
 
         # Iteramos sobre todos los elementos
         for i, subfield in enumerate(field):
@@ -23,17 +74,21 @@ class BootstrapListOptions:
                 html.append('<div class="row my-3">')
 
             num_cols = 12 // n
-            # Renderizamos un elemento
+            # Renderizamos un elemento. La etiqueta "input" se deja abierta para poder marcarla
+            parametros = html_params(class_="form-check-input", id=subfield.id, name=field.name,
+                                     type="checkbox", value=subfield._value())
             html.append(f'''
                 <div class="col-md-{num_cols}">
                     <div class="form-check">
-                        {subfield(class_="form-check-input")}
+                        <input {parametros}''')
+            trozos.append(''.join(html))
+            html = [f'''>
                         <label class="form-check-label" for="{subfield.id}">
-                            {subfield.label.text}
+                            {escape(subfield.label.text)}
                         </label>
                     </div>
                 </div>
-            ''')
+            ''']
 
             # Cerramos el grupo correspondiente
             if i % n == n - 1:
@@ -44,7 +99,8 @@ class BootstrapListOptions:
             html.append('</div>')
 
         html.append('</div>')  # close container-fluid
-        return Markup(''.join(html))
+        trozos.append(''.join(html))
+        return trozos
 
 
 class MultiCheckboxField(SelectMultipleField):
@@ -70,49 +126,64 @@ class MultiCheckboxField(SelectMultipleField):
 
 ### Funciones auxiliares para renderizar una paginacion desde mongo (no tenemos la de flask)
 
-def render_pagination(page, per_page, total_items, endpoint, **kwargs):
-    total_pages = max(1, (total_items + per_page - 1) // per_page)
-
-    if total_pages <= 1:
+def render_pagination(pagina, endpoint, **kwargs):
+    """
+    Renderiza la barra de paginacion de una "Pagina" (ver el modulo "paginacion"). Solo se enlazan
+    las paginas de la ventana alrededor de la actual, ademas de la primera y la ultima.
+    """
+    if pagina.total_paginas <= 1:
         return ""
 
-    def page_link(p):
+    def page_link(p, cursor):
         query_args = dict(request.args)
         query_args.update(kwargs)
         query_args['page'] = p
+        query_args.pop('cursor', None)
+        if cursor:
+            query_args['cursor'] = cursor
         return url_for(endpoint, **query_args)
 
+    def page_item(p, cursor, texto, clase='', etiqueta=''):
+        aria = f' aria-label="{etiqueta}"' if etiqueta else ''
+        return f'''
+            <li class="page-item {clase}">
+                <a class="page-link" href="{page_link(p, cursor)}"{aria}>{texto}</a>
+            </li>
+        '''
+
+    puntos = '''
+        <li class="page-item disabled"><span class="page-link">&hellip;</span></li>
+    '''
+
     html = ['<nav aria-label="Page navigation">']
     html.append('<ul class="pagination justify-content-center">')
 
     # Boton anterior
-    prev_disabled = 'disabled' if page <= 1 else ''
-    html.append(f'''
-        <li class="page-item {prev_disabled}">
-            <a class="page-link" href="{page_link(page - 1)}" aria-label="Previous">
-                <span aria-hidden="true">&laquo;</span>
-            </a>
-        </li>
-    ''')
-
-    #
-    for p in range(1, total_pages + 1):
-        active = 'active' if p == page else ''
-        html.append(f'''
-            <li class="page-item {active}">
-                <a class="page-link" href="{page_link(p)}">{p}</a>
-            </li>
-        ''')
+    existe, cursor = pagina.anterior
+    html.append(page_item(pagina.numero - 1, cursor, '<span aria-hidden="true">&laquo;</span>',
+                          '' if existe else 'disabled', 'Previous'))
+
+    # Primera pagina, si no esta en la ventana
+    primera_ventana = pagina.ventana[0][0]
+    if primera_ventana > 1:
+        html.append(page_item(1, None, 1))
+        if primera_ventana > 2:
+            html.append(puntos)
+
+    # Ventana de paginas alrededor de la actual
+    for p, cursor in pagina.ventana:
+        html.append(page_item(p, cursor, p, 'active' if p == pagina.numero else ''))
+
+    # Ultima pagina, si no esta en la ventana
+    if pagina.ultima is not None:
+        if pagina.ultima[0] > pagina.ventana[-1][0] + 1:
+            html.append(puntos)
+        html.append(page_item(pagina.ultima[0], pagina.ultima[1], pagina.ultima[0]))
 
     # Siguiente boton
-    next_disabled = 'disabled' if page >= total_pages else ''
-    html.append(f'''
-        <li class="page-item {next_disabled}">
-            <a class="page-link" href="{page_link(page + 1)}" aria-label="Next">
-                <span aria-hidden="true">&raquo;</span>
-            </a>
-        </li>
-    ''')
+    existe, cursor = pagina.siguiente
+    html.append(page_item(pagina.numero + 1, cursor, '<span aria-hidden="true">&raquo;</span>',
+                          '' if existe else 'disabled', 'Next'))
 
     html.append('</ul></nav>')
     return Markup(''.join(html))
@@ -1,52 +1,194 @@
 """
 Módulo de Python que contiene las rutas
 """
+import atexit
 import datetime
-from flask import current_app as app, render_template, redirect, url_for, flash, abort, request
+import random
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from jinja2.utils import htmlsafe_json_dumps
+from flask import current_app as app, render_template, redirect, url_for, flash, abort, request, Response, g
 from .formularios import GenerarQuizForm
 from . import mongo
-from .trivia import generar_n_preguntas_aleatoriamente
+from .cache import cache_distinct, CacheLRU, CacheLRUMemoria, tamanyo_en_memoria
+from .cache_http import pagina_cacheada
+from .version_datos import version_datos, VersionReciente
+from .actuaciones import COLECCION_ACTUACIONES, asegurar_actuaciones
+from .trivia import (generar_n_preguntas_aleatoriamente, obtener_indice, obtener_instantanea, ReservaPreguntas,
+                     normalizar_filtros, registro_metricas, exportar_contadores, CONTADORES_RESERVA,
+                     compactar_preguntas, expandir_preguntas, PreguntaNoDisponible)
 from .render_utils import render_pagination
+from .paginacion import PaginacionKeyset
+from .consultas import (paginacion_ediciones, buscar_edicion, paginacion_actuaciones_pais, FACETAS_PAIS,
+                        paginacion_quizzes)
+from .escritura import ColaEscritura, DocumentoDuplicado, ColaLlena, EscrituraParcial
+from .bloom import nombres_quizzes
+from .estadisticas import registrar_partida, estadisticas_quiz, estadisticas_quizzes
+
+# Guardamos la instancia real de la app, para poder generar preguntas desde el hilo de la reserva
+_app = app._get_current_object()
+
+
+# Longitud maxima de la semilla de un quiz
+LONGITUD_MAXIMA_SEMILLA = 64
+
+
+def _generar_preguntas(anyos, paises, n, semilla=None, version=None):
+    """
+    Genera n preguntas (ya convertidas a diccionario) con la configuracion de la app. Si se
+    proporciona una semilla, el resultado es siempre el mismo para los mismos parametros y datos.
+    Si se proporciona la version de los festivales, se usa en lugar de volver a leerla.
+    """
+    aleatorio = random.Random(semilla) if semilla is not None else None
+    with _app.app_context():
+        coleccion_festivales = mongo.db["festivales"]
+        if version is None:
+            version = version_datos(mongo.db, "festivales")
+        indice = None
+        if app.config["TRIVIA_INSTANTANEA"]:
+            indice = obtener_instantanea(app.config["TRIVIA_INSTANTANEA"], version)
+        if indice is None and app.config["TRIVIA_USAR_INDICE"]:
+            indice = obtener_indice(coleccion_festivales, version)
+        coleccion_actuaciones = None
+        if app.config["TRIVIA_USAR_ACTUACIONES"]:
+            asegurar_actuaciones(mongo.db, version)
+            coleccion_actuaciones = mongo.db[COLECCION_ACTUACIONES]
+        preguntas = generar_n_preguntas_aleatoriamente(n, anyos, paises, coleccion_festivales,
+                                                       indice, app.config["TRIVIA_GENERACION_LOTE"],
+                                                       app.config["TRIVIA_MAX_CONCURRENCIA"],
+                                                       app.config["TRIVIA_TIMEOUT_QUIZ"], aleatorio,
+                                                       coleccion_actuaciones)
+        return [pregunta.to_dict(aleatorio) for pregunta in preguntas]
+
+
+# Version de los festivales con la que se valida la reserva de preguntas (se lee como mucho cada
+# CACHE_QUIZZES_VERSION_TTL segundos)
+version_reserva = VersionReciente("festivales", app.config["CACHE_QUIZZES_VERSION_TTL"])
+
+
+def _version_reserva():
+    with _app.app_context():
+        return version_reserva.obtener(mongo.db)
+
+
+reserva_preguntas = ReservaPreguntas(
+    _generar_preguntas,
+    nivel_minimo=app.config["TRIVIA_RESERVA_NIVEL_MINIMO"],
+    nivel_maximo=app.config["TRIVIA_RESERVA_NIVEL_MAXIMO"],
+    max_filtros=app.config["TRIVIA_RESERVA_MAX_FILTROS"],
+    version=_version_reserva
+)
+
+
+def _escribir_quizzes(quizzes):
+    """
+    Escribe un lote de quizzes de la cola de escritura diferida. Devuelve los nombres de los quizzes que
+    ya existian. Si falla la escritura de algun quiz, lanza EscrituraParcial solo con esos quizzes
+    """
+    with _app.app_context():
+        try:
+            mongo.db["quizzes"].insert_many(quizzes, ordered=False)
+        except BulkWriteError as error:
+            # Los duplicados que no se detectan al encolar (dos procesos que guardan el mismo nombre a la vez)
+            # no se pueden escribir. El resto del lote ya esta escrito, asi que solo se reintentan los
+            # quizzes con otros errores
+            errores = error.details.get("writeErrors", [])
+            duplicados = [quizzes[fallo["index"]]["_id"] for fallo in errores if fallo.get("code") == 11000]
+            if duplicados:
+                _app.logger.warning("Quizzes duplicados descartados: %s", duplicados)
+            fallidos = [quizzes[fallo["index"]] for fallo in errores if fallo.get("code") != 11000]
+            if fallidos:
+                raise EscrituraParcial(fallidos, duplicados) from error
+            return duplicados
+    return None
+
+
+# Cola de escritura diferida de los quizzes guardados. Se vacia al cerrar la aplicacion
+escritura_quizzes = ColaEscritura(
+    _escribir_quizzes,
+    tam_lote=app.config["QUIZZES_LOTE_ESCRITURA"],
+    intervalo=app.config["QUIZZES_INTERVALO_ESCRITURA"],
+    max_pendientes=app.config["QUIZZES_MAX_PENDIENTES"],
+    espera_maxima=app.config["QUIZZES_ESPERA_COLA"],
+    max_intentos=app.config["QUIZZES_INTENTOS_ESCRITURA"]
+)
+atexit.register(escritura_quizzes.detener)
+
+# Nombres de quizzes en uso (los pendientes de escribir tambien cuentan)
+nombres_quizzes.capacidad = app.config["QUIZZES_BLOOM_CAPACIDAD"]
+nombres_quizzes.tasa_falsos_positivos = app.config["QUIZZES_BLOOM_FALSOS_POSITIVOS"]
+nombres_quizzes.recarga = app.config["QUIZZES_BLOOM_RECARGA"]
+nombres_quizzes.pendiente = escritura_quizzes.pendiente
+
+# Quizzes generados con semilla. Como son reproducibles, se pueden servir sin volver a generarlos
+cache_quizzes_semilla = CacheLRU(app.config["CACHE_QUIZZES_SEMILLA"])
+
+# Quizzes guardados listos para jugar (preguntas reconstruidas y serializadas), por nombre y version de los
+# festivales. Esta acotada por memoria, porque el tamanyo de cada quiz depende de su numero de preguntas
+cache_quizzes_guardados = CacheLRUMemoria(app.config["CACHE_QUIZZES_GUARDADOS_BYTES"])
+version_quizzes_guardados = VersionReciente("festivales", app.config["CACHE_QUIZZES_VERSION_TTL"])
+
+# HTML de las paginas de solo lectura de los festivales, por URL y version de los datos
+cache_paginas = CacheLRU(app.config["CACHE_PAGINAS"])
+
+# Totales de las paginaciones de festivales. La clave incluye la version de los datos
+cache_totales = CacheLRU(app.config["CACHE_TOTALES_PAGINACION"])
+
+# Metricas de construccion de las preguntas de trivia
+registro_metricas.activo = app.config["TRIVIA_METRICAS"]
+
+
+def _total_documentos(coleccion: str, consulta: dict, version: int) -> int:
+    """
+    Numero de documentos de la coleccion (festivales o derivada de ellos) que cumplen la consulta.
+    Se guarda en cache hasta que cambia la version de los datos de los festivales
+    """
+    clave = (coleccion, tuple(sorted(consulta.items())), version)
+    total = cache_totales.obtener(clave)
+    if total is None:
+        total = mongo.db[coleccion].count_documents(consulta)
+        cache_totales.guardar(clave, total)
+    return total
+
+
+def _pagina_keyset(paginacion: PaginacionKeyset, total: int):
+    """
+    Devuelve la pagina indicada por los parametros "cursor" y "page" de la peticion
+    """
+    try:
+        return paginacion.pagina(request.args.get('cursor'), request.args.get('page', 1, type=int), total)
+    except ValueError:
+        abort(400)
+
 
 @app.route("/")
 @app.route("/ediciones")
+@pagina_cacheada(cache_paginas)
 def mostrar_ediciones():
-    # Pagina actual de resultados
-    pagina = int(request.args.get('page', 1))
-
-    # Numero de elementos por pagina
-    elementos_por_pagina = 5
-
-    # Conexión y conteo de elementos
+    # Conexión y conteo de elementos (en cache)
     coleccion_festivales = mongo.db["festivales"]
-    total_elementos = coleccion_festivales.count_documents({})
-
-    # Cargar solo los festivales de la página actual
-    festivales = list(
-        coleccion_festivales.find({}, {"_id": 0})
-        .sort("anyo", -1)
-        .skip((pagina - 1) * elementos_por_pagina)
-        .limit(elementos_por_pagina)
-    )
+    total_elementos = _total_documentos("festivales", {}, version_datos(mongo.db, "festivales"))
 
-    # Cargamos la informacion
-    paginacion = render_pagination(pagina, elementos_por_pagina, total_elementos, 'mostrar_ediciones')
+    # Cargar solo el resumen de los festivales de la página actual, a partir del cursor de la URL.
+    # Los concursantes se cargan bajo demanda desde "concursantes_edicion"
+    pagina = _pagina_keyset(paginacion_ediciones(coleccion_festivales), total_elementos)
 
     return render_template(
         "mostrar_ediciones.html",
-        festivales=festivales,
-        pagination=paginacion,
-        pagina=pagina
+        festivales=pagina.elementos,
+        pagination=render_pagination(pagina, 'mostrar_ediciones'),
+        pagina=pagina.numero
     )
 
 
 @app.route("/edicion/<int:anyo>")
+@pagina_cacheada(cache_paginas)
 def mostrar_festival(anyo: int):
     # Conexión
     coleccion_festivales = mongo.db["festivales"]
 
     # Buscar el festival por año
-    festival = coleccion_festivales.find_one({"anyo": anyo})
+    festival = buscar_edicion(coleccion_festivales, anyo)
 
     if not festival:
         # Si no se encuentra el festival, lanzar 404
@@ -67,6 +209,19 @@ def mostrar_festival(anyo: int):
     )
 
 
+@app.route("/edicion/<int:anyo>/concursantes")
+@pagina_cacheada(cache_paginas)
+def concursantes_edicion(anyo: int):
+    # Fragmento HTML (dentro de un JSON) con la cuadricula de concursantes de una edicion
+    festival = buscar_edicion(mongo.db["festivales"], anyo, {"_id": 0, "concursantes.url_youtube": 0})
+
+    if not festival:
+        abort(404)
+
+    return {"anyo": anyo, "html": render_template("fragmento_concursantes.html",
+                                                  concursantes=festival["concursantes"])}
+
+
 @app.route('/jugar')
 def jugar_quiz():
     # Jugar a un quiz. Esta funcion NO la teneis que modificar
@@ -80,11 +235,31 @@ def jugar_quiz():
     anyos = request.args.getlist("anyos", type=int)
     paises = request.args.getlist("paises")
     nombre = request.args.get("nombre", None)
+    semilla = request.args.get("semilla", None)
     num_preguntas = 1
 
-    preguntas_aleatorias = generar_n_preguntas_aleatoriamente(num_preguntas, anyos, paises, mongo.db["festivales"])
-
-    preguntas = {"preguntas": [pregunta.to_dict() for pregunta in preguntas_aleatorias]}
+    # Si no se generan todas las preguntas a tiempo (ver TRIVIA_TIMEOUT_QUIZ), se pide volver a intentarlo
+    try:
+        # Con semilla, el quiz es reproducible: se guarda en cache con la semilla, los filtros normalizados
+        # y la version de los festivales (con otros datos, la misma semilla da otro quiz)
+        if semilla:
+            semilla = semilla[:LONGITUD_MAXIMA_SEMILLA]
+            anyos_normalizados, paises_normalizados = normalizar_filtros(anyos, paises)
+            version = version_datos(mongo.db, "festivales")
+            clave = (semilla, anyos_normalizados, paises_normalizados, num_preguntas, version)
+            lista_preguntas = cache_quizzes_semilla.obtener(clave)
+            if lista_preguntas is None:
+                lista_preguntas = _generar_preguntas(list(anyos_normalizados), list(paises_normalizados),
+                                                     num_preguntas, semilla, version)
+                cache_quizzes_semilla.guardar(clave, lista_preguntas)
+            preguntas = {"preguntas": lista_preguntas}
+        # Si la reserva esta activada, las preguntas se cogen de ella (y solo se generan si esta vacia)
+        elif app.config["TRIVIA_RESERVA"]:
+            preguntas = {"preguntas": reserva_preguntas.obtener(anyos, paises, num_preguntas)}
+        else:
+            preguntas = {"preguntas": _generar_preguntas(anyos, paises, num_preguntas)}
+    except TimeoutError:
+        abort(503)
 
     # Solo guardamos un nombre si no es nulo ni vacio
     if nombre:
@@ -98,14 +273,16 @@ def generar_quiz():
     # Conexión
     coleccion_festivales = mongo.db["festivales"]
 
-    # Obtener lista de años y países desde la base de datos
-    anyos = coleccion_festivales.distinct("anyo")
-    anyos.sort(reverse=True)  # Ordenar los años de manera descendente
-    paises = coleccion_festivales.distinct("pais")
-    paises.sort()  # Ordenar los países de manera ascendente
+    # Obtener lista de años (descendente) y países (ascendente). Se guardan en cache
+    # y solo se vuelven a consultar cuando cambia la version de los datos
+    version = g.version_datos = version_datos(mongo.db, "festivales")
+    anyos = cache_distinct.obtener(coleccion_festivales, "anyo", version, descendente=True)
+    paises = cache_distinct.obtener(coleccion_festivales, "pais", version)
 
     # Crear el formulario y pasar las listas de años y países
     form = GenerarQuizForm(anyos=anyos, paises=paises)
+    # Ruta con la que se comprueba el nombre mientras se escribe
+    form.nombre.render_kw = {"data-url": url_for('nombre_quiz_disponible')}
 
     # Si el formulario es válido
     if form.validate_on_submit():
@@ -117,54 +294,40 @@ def generar_quiz():
 
 
 @app.route("/pais/<id_pais>")
+@pagina_cacheada(cache_paginas)
 def mostrar_actuaciones_pais(id_pais: str):
-    # Pagina actual de resultados
-    pagina = int(request.args.get('page', 1))
-
-    # Numero de elementos por pagina
-    elementos_por_pagina = 10
-
-    # Conexión y conteo de elementos
-    coleccion_festivales = mongo.db["festivales"]
-    total_elementos = coleccion_festivales.count_documents({"concursantes.id_pais": id_pais})
-
-    # Comprobamos si el país existe (al menos un concursante con ese id_pais)
-    existe_pais = coleccion_festivales.find_one({"concursantes.id_pais": id_pais})
-
-    if not existe_pais:
+    # Conexión. Las actuaciones se leen de la coleccion derivada "actuaciones", que se
+    # reconstruye si ha cambiado la version de los festivales ("pagina_cacheada" ya la ha leido)
+    asegurar_actuaciones(mongo.db, g.version_datos)
+    coleccion_actuaciones = mongo.db[COLECCION_ACTUACIONES]
+
+    # Paginación por la clave (anyo, id_pais). Una sola agregacion devuelve la pagina, el total
+    # de actuaciones (que tambien sirve para saber si el pais existe) y el nombre del pais
+    paginacion = paginacion_actuaciones_pais(coleccion_actuaciones, id_pais)
+    try:
+        pagina, resultado = paginacion.pagina_facet(
+            request.args.get('cursor'), request.args.get('page', 1, type=int), FACETAS_PAIS
+        )
+    except ValueError:
+        abort(400)
+
+    # Comprobamos si el país existe (al menos una actuacion con ese id_pais)
+    if not resultado.get("nombre"):
         # Si no existe el país, lanzamos un error 404
         abort(404)
 
-    # Paginación con datos reales de cada concursante
-    pipeline = [
-        {"$unwind": "$concursantes"},
-        {"$match": {"concursantes.id_pais": id_pais}},
-        {"$sort": {"anyo": -1}},
-        {"$skip": (pagina - 1) * elementos_por_pagina},
-        {"$limit": elementos_por_pagina},
-        {"$project": {
-            "_id": 0,
-            "anyo": 1,
-            "ciudad": 1,
-            "pais_organizador": "$pais",
-            "artista": "$concursantes.artista",
-            "cancion": "$concursantes.cancion",
-            "resultado": "$concursantes.resultado",
-            "puntuacion": "$concursantes.puntuacion",
-            "url_youtube": "$concursantes.url_youtube",
-            "pais": "$concursantes.pais"
-        }}
-    ]
-
-    participantes = list(coleccion_festivales.aggregate(pipeline))
-
-    nombre_pais = participantes[0]["pais"]
+    # Si el cursor apunta mas alla del final (por ejemplo, porque han cambiado los datos),
+    # volvemos a la primera pagina
+    if not pagina.elementos:
+        return redirect(url_for('mostrar_actuaciones_pais', id_pais=id_pais))
+
+    nombre_pais = resultado["nombre"][0]["pais"]
 
     # Cargamos la informacion
-    paginacion = render_pagination(pagina, elementos_por_pagina, total_elementos, 'mostrar_actuaciones_pais', id_pais=id_pais)
+    paginacion_html = render_pagination(pagina, 'mostrar_actuaciones_pais', id_pais=id_pais)
 
-    return render_template("mostrar_actuaciones_pais.html", pagina=pagina, pagination=paginacion,
-                           pais=nombre_pais, participaciones=participantes)
+    return render_template("mostrar_actuaciones_pais.html", pagina=pagina.numero, pagination=paginacion_html,
+                           pais=nombre_pais, participaciones=pagina.elementos)
 
 
 @app.route("/upload_contest", methods=["POST"])
@@ -172,9 +335,13 @@ def guardar_concurso():
     # data es el diccionario con la informacion
     data = request.get_json()
 
-    # Eliminar el campo "seleccionado" de cada pregunta
-    for pregunta in data.get("preguntas", []):
-        pregunta.pop("seleccionado", None)
+    # Eliminar el campo "seleccionado" de cada pregunta (las respuestas de la partida solo se usan
+    # para las estadisticas del quiz)
+    preguntas_jugadas = data.get("preguntas", [])
+    seleccionadas = [pregunta.pop("seleccionado", None) for pregunta in preguntas_jugadas]
+
+    # Guardar cada pregunta como una referencia (tipo, actuaciones y semilla), en lugar de su texto
+    data["preguntas"] = compactar_preguntas(data.get("preguntas", []))
 
     # Añadir la fecha de creación
     data["creacion"] = datetime.datetime.now()
@@ -182,57 +349,158 @@ def guardar_concurso():
     # Acceder a la colección 'quizzes'
     coleccion_quizzes = mongo.db["quizzes"]
 
-    # Insertar el documento en la colección
-    coleccion_quizzes.insert_one(data)
+    # La partida con la que se ha creado el quiz es la primera de sus estadisticas. Solo se registra cuando
+    # el quiz ya esta escrito: si resulta duplicado o no se llega a escribir, no se suma a ningun quiz
+    db = mongo.db
+    data.setdefault("_id", ObjectId())
+
+    def primera_partida():
+        registrar_partida(db, data["_id"], preguntas_jugadas, seleccionadas)
+
+    # Insertar el documento en la colección (o encolarlo, si la escritura es diferida). Si ya existe
+    # un quiz con el mismo nombre, se avisa al jugador
+    try:
+        if app.config["QUIZZES_ESCRITURA_DIFERIDA"]:
+            escritura_quizzes.encolar(
+                data, lambda nombre: coleccion_quizzes.find_one({"_id": nombre}, {"_id": 1}) is not None,
+                al_escribir=primera_partida)
+        else:
+            coleccion_quizzes.insert_one(data)
+            primera_partida()
+    except (DocumentoDuplicado, DuplicateKeyError):
+        return {'error': 'Ya existe un quiz con ese nombre'}, 409
+    except ColaLlena:
+        return {'error': 'No se ha podido guardar el quiz, vuelve a intentarlo en unos segundos'}, 503
+
+    nombres_quizzes.anyadir(data["_id"])
 
     # Devolver respuesta con la URL a la que se debe redirigir
     return {'redirect': url_for('mostrar_quizzes')}
 
 
-@app.route("/quizzes")
-def mostrar_quizzes():
-    # Pagina actual de resultados
-    pagina = int(request.args.get('page', 1))
+@app.route("/quiz/nombre_disponible")
+def nombre_quiz_disponible():
+    # Comprobacion en vivo de un nombre de quiz. Si el filtro de Bloom lo descarta, no se consulta a Mongo.
+    # Es orientativa: el indice unico del "_id" es el que impide guardar dos quizzes con el mismo nombre
+    nombre = request.args.get("nombre", "")
+    if not nombre:
+        return {'error': 'Falta el nombre'}, 400
+    return {'nombre': nombre, 'disponible': nombres_quizzes.disponible(mongo.db["quizzes"], nombre)}
 
-    # Numero de elementos por pagina
-    elementos_por_pagina = 20
 
-    # Conexion
-    coleccion_quizzes = mongo.db["quizzes"]
+@app.route("/quiz/<nombre_quiz>/resultado", methods=["POST"])
+def registrar_resultado(nombre_quiz: str):
+    # Respuestas elegidas en una partida de un quiz guardado. Los aciertos se calculan con las preguntas
+    # guardadas, no con las que envia el navegador
+    quiz = _quiz_guardado(nombre_quiz)
+    if quiz is None:
+        abort(404)
 
-    # Total de elementos
-    total_elementos = coleccion_quizzes.count_documents({})
+    seleccionadas = (request.get_json(silent=True) or {}).get("seleccionadas")
+    preguntas = [{"correcta": correcta, "puntuacion": puntuacion} for correcta, puntuacion in quiz["respuestas"]]
+    if not isinstance(seleccionadas, list) or len(seleccionadas) != len(preguntas):
+        return {'error': 'Resultado no valido'}, 400
 
-    # Cargar los quizzes ordenados por fecha de creación (descendente) con paginación
-    quizzes = list(
-        coleccion_quizzes.find()
-        .sort("creacion", -1)  # Ordenar por la fecha de creación de manera descendente
-        .skip((pagina - 1) * elementos_por_pagina)  # Saltar los elementos previos
-        .limit(elementos_por_pagina)  # Limitar el número de elementos a mostrar
-    )
+    registrar_partida(mongo.db, nombre_quiz, preguntas, seleccionadas)
+    return {'estadisticas': estadisticas_quiz(mongo.db, nombre_quiz)}
 
-    # Cargamos la informacion
-    paginacion = render_pagination(pagina, elementos_por_pagina, total_elementos, 'mostrar_quizzes')
 
-    return render_template("listar_quizzes.html", quizzes=quizzes,
-                           pagination=paginacion, pagina=pagina)
+@app.route("/quiz/<nombre_quiz>/estadisticas")
+def mostrar_estadisticas_quiz(nombre_quiz: str):
+    # Estadisticas de las partidas de un quiz (una sola busqueda por "_id")
+    # Si no existe el quiz (ni esta pendiente de escribir), lanzar error 404
+    if (escritura_quizzes.pendiente(nombre_quiz) is None
+            and mongo.db["quizzes"].find_one({"_id": nombre_quiz}, {"_id": 1}) is None):
+        abort(404)
 
+    return estadisticas_quiz(mongo.db, nombre_quiz)
 
-@app.route("/jugar/<nombre_quiz>")
-def jugar_quiz_personalizado(nombre_quiz: str):
+
+@app.route("/quizzes")
+def mostrar_quizzes():
     # Conexion
     coleccion_quizzes = mongo.db["quizzes"]
 
-    # Buscar el quiz por nombre
-    quiz = coleccion_quizzes.find_one({"_id": nombre_quiz})
+    # Total de elementos (estimado a partir de los metadatos de la coleccion)
+    total_elementos = coleccion_quizzes.estimated_document_count()
+
+    # Cargar los quizzes ordenados por fecha de creación (descendente) con paginación por cursor.
+    # El "_id" (nombre del quiz) desempata los quizzes creados a la vez. Solo se leen los campos de la lista
+    pagina = _pagina_keyset(paginacion_quizzes(coleccion_quizzes), total_elementos)
+
+    # Estadisticas de los quizzes de la pagina (una sola consulta por "_id")
+    estadisticas = estadisticas_quizzes(mongo.db, [quiz["_id"] for quiz in pagina.elementos])
+
+    return render_template("listar_quizzes.html", quizzes=pagina.elementos, estadisticas=estadisticas,
+                           pagination=render_pagination(pagina, 'mostrar_quizzes'), pagina=pagina.numero)
+
+
+def _quiz_guardado(nombre_quiz: str):
+    """
+    Devuelve un quiz guardado preparado para jugarlo, o None si no existe. Es un diccionario con:
+        * "json": las preguntas ({"preguntas": [...]}) reconstruidas a partir de sus referencias y ya
+          serializadas para "juego.html".
+        * "respuestas": tupla con la respuesta correcta y la puntuacion de cada pregunta, para las
+          estadisticas.
+    Si alguna pregunta ya no se puede reconstruir (ha desaparecido una de sus actuaciones), lanza un
+    error 410.
+    Los quizzes guardados no cambian, asi que se guardan en cache por nombre y version de los festivales.
+    La version se lee como mucho una vez cada CACHE_QUIZZES_VERSION_TTL segundos, de manera que un
+    acierto no consulta a Mongo ni vuelve a serializar las preguntas.
+    """
+    version = version_quizzes_guardados.obtener(mongo.db)
+    clave = (nombre_quiz, version)
+    quiz = cache_quizzes_guardados.obtener(clave)
+
+    if quiz is None:
+        # Conexion
+        coleccion_quizzes = mongo.db["quizzes"]
+
+        # Buscar el quiz por nombre (si se acaba de guardar, puede estar todavia en la cola de escritura)
+        documento = escritura_quizzes.pendiente(nombre_quiz) or coleccion_quizzes.find_one({"_id": nombre_quiz})
+        if documento is None:
+            return None
+
+        # Preparar las preguntas del quiz, reconstruyendo las que estan guardadas como referencia
+        asegurar_actuaciones(mongo.db, version)
+        try:
+            preguntas = expandir_preguntas(documento.get("preguntas", []), mongo.db[COLECCION_ACTUACIONES])
+            quiz = {
+                # Mismo resultado que el filtro "tojson" de la plantilla
+                "json": htmlsafe_json_dumps({"preguntas": preguntas}, dumps=_app.json.dumps),
+                "respuestas": tuple((pregunta.get("correcta"), pregunta.get("puntuacion", 0))
+                                    for pregunta in preguntas),
+            }
+        except PreguntaNoDisponible:
+            # Tambien se guarda en cache, para no volver a consultar el quiz hasta que cambien los datos
+            quiz = {"json": None, "respuestas": None}
+        # Cuenta la entrada entera (el JSON y las respuestas), no solo el JSON
+        cache_quizzes_guardados.guardar(clave, quiz, tamanyo_en_memoria(quiz))
+
+    if quiz["json"] is None:
+        abort(410)
+    return quiz
+
+
+@app.route("/jugar/<nombre_quiz>")
+def jugar_quiz_personalizado(nombre_quiz: str):
+    quiz = _quiz_guardado(nombre_quiz)
 
     # Si no existe, lanzar error 404
     if quiz is None:
         abort(404)
 
-    # Preparar las preguntas del quiz
-    preguntas = {
-        "preguntas": quiz.get("preguntas", [])
-    }
+    # Al terminar, el juego envia las respuestas para las estadisticas del quiz
+    return render_template("juego.html", preguntas_json=quiz["json"], guardable=False,
+                           url_resultado=url_for('registrar_resultado', nombre_quiz=nombre_quiz))
 
-    return render_template("juego.html", preguntas=preguntas, guardable=False)
+
+@app.route("/metricas")
+def metricas():
+    # Metricas de las preguntas de trivia y de la reserva de preguntas, en el formato de texto de Prometheus
+    if not app.config["TRIVIA_METRICAS"] and not app.config["TRIVIA_RESERVA"]:
+        abort(404)
+    texto = registro_metricas.exportar() if app.config["TRIVIA_METRICAS"] else ""
+    if app.config["TRIVIA_RESERVA"]:
+        texto += exportar_contadores("trivia_reserva", reserva_preguntas.estadisticas(), CONTADORES_RESERVA)
+    return Response(texto, mimetype="text/plain; version=0.0.4")
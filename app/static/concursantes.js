@@ -0,0 +1,33 @@
+// Carga bajo demanda de los concursantes de cada edicion en la lista de ediciones.
+// Cada contenedor "concursantes-edicion" tiene en "data-url" la ruta que devuelve el fragmento
+// HTML con los concursantes (dentro de un JSON). Si falla la carga, se deja el enlace a la edicion.
+
+function cargarConcursantes(contenedor) {
+    fetch(contenedor.dataset.url)
+        .then(respuesta => {
+            if (!respuesta.ok) throw new Error("Error " + respuesta.status);
+            return respuesta.json();
+        })
+        .then(datos => {
+            contenedor.classList.remove("text-center", "my-4");
+            contenedor.innerHTML = datos.html;
+        })
+        .catch(error => console.error("No se han podido cargar los concursantes", error));
+}
+
+const contenedores = document.querySelectorAll(".concursantes-edicion");
+
+if ("IntersectionObserver" in window) {
+    // Solo se cargan las ediciones que llegan a verse (o estan a punto de hacerlo)
+    const observador = new IntersectionObserver((entradas, observador) => {
+        entradas.forEach(entrada => {
+            if (entrada.isIntersecting) {
+                observador.unobserve(entrada.target);
+                cargarConcursantes(entrada.target);
+            }
+        });
+    }, { rootMargin: "200px" });
+    contenedores.forEach(contenedor => observador.observe(contenedor));
+} else {
+    contenedores.forEach(cargarConcursantes);
+}
@@ -0,0 +1,46 @@
+// Comprobacion en vivo del nombre del quiz en el formulario de creacion. El campo "nombre" tiene en
+// "data-url" la ruta que indica si el nombre esta libre. Es solo un aviso: al guardar el quiz se vuelve
+// a comprobar.
+
+const campoNombre = document.getElementById("nombre");
+let temporizadorNombre = null;
+
+function mostrarDisponibilidad(disponible) {
+    campoNombre.classList.toggle("is-invalid", disponible === false);
+    campoNombre.classList.toggle("is-valid", disponible === true);
+
+    let aviso = document.getElementById("aviso-nombre");
+    if (aviso === null) {
+        aviso = document.createElement("div");
+        aviso.id = "aviso-nombre";
+        aviso.className = "invalid-feedback";
+        aviso.innerText = "Ya existe un quiz con ese nombre";
+        campoNombre.insertAdjacentElement("afterend", aviso);
+    }
+}
+
+function comprobarNombre() {
+    const nombre = campoNombre.value;
+    if (!nombre) {
+        mostrarDisponibilidad(null);
+        return;
+    }
+    fetch(campoNombre.dataset.url + "?" + new URLSearchParams({nombre: nombre}))
+        .then(respuesta => {
+            if (!respuesta.ok) throw new Error("Error " + respuesta.status);
+            return respuesta.json();
+        })
+        .then(datos => {
+            // Solo se muestra si el nombre no ha cambiado mientras tanto
+            if (datos.nombre === campoNombre.value) mostrarDisponibilidad(datos.disponible);
+        })
+        .catch(error => console.error("No se ha podido comprobar el nombre", error));
+}
+
+if (campoNombre !== null) {
+    // Se espera a que el jugador deje de escribir para no hacer una peticion por tecla
+    campoNombre.addEventListener("input", () => {
+        clearTimeout(temporizadorNombre);
+        temporizadorNombre = setTimeout(comprobarNombre, 300);
+    });
+}
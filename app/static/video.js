@@ -160,11 +160,29 @@ function nextRound() {
         changeElementsInCategory("pregunta", "none");
         changeElementsInCategory("video", "none");
 
+        // Enviamos las respuestas para las estadisticas del quiz (solo en los quizzes guardados)
+        mandarResultado();
+
         // Disparamos el modal
         myModal.show();
     }
 }
 
+function mandarResultado() {
+    if (!urlResultado) {
+        return;
+    }
+    fetch(urlResultado, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'X-CSRFToken': csrfToken
+      },
+      body: JSON.stringify({seleccionadas: questions.map(q => q.seleccionado ?? null)})
+    })
+    .catch(error => console.error('Error:', error));
+}
+
 function changeElementsInCategory(category, newDisplay) {
     if (category === "video") {
         document.getElementById("audio-cover").style.display = newDisplay;
@@ -255,6 +273,8 @@ function mandarRespuestas(){
     .then(data => {
       if (data.redirect) {
         window.location.href = data.redirect;  // Redirigimos la informacion una vez hemos terminado
+      } else if (data.error) {
+        alert(data.error);  // Por ejemplo, si otro jugador ha guardado antes un quiz con el mismo nombre
       } else {
         console.log('Server response:', data);
       }
@@ -1,11 +1,20 @@
 """
 Solo se "exponen" aquellos metodos que queremos que se utilicen.
 """
+import functools
 import random
-from typing import List
+from typing import List, Optional
 from .operaciones_coleccion import OperacionesEurovision
+from .indice import IndiceParticipaciones, obtener_indice, recargar_indice
+from .instantanea import exportar_instantanea, obtener_instantanea
+from .lote import OperacionesLote
+from .concurrencia import construir_concurrentemente
+from .reserva import ReservaPreguntas, normalizar_filtros, CONTADORES_RESERVA
+from .metricas import registro_metricas, exportar_contadores
 from .videos import PaisActuacion, NombreCancion, InterpreteCancion
-from .preguntas import CancionPais, Trivia, PrimerAnyoParticipacion, MejorClasificacion, MejorMediaPuntos
+from .preguntas import (CancionPais, Trivia, PrimerAnyoParticipacion, MejorClasificacion, MejorMediaPuntos,
+                        PreguntaSinSolucionUnica)
+from .referencias import compactar_preguntas, expandir_preguntas, PreguntaNoDisponible
 
 # Esta es la lista de preguntas posibles de trivia. Segun vayais resolviendolas,
 # id incluyendolas en esta lista.
@@ -13,10 +22,48 @@ _preguntas_posibles = [PrimerAnyoParticipacion, CancionPais, MejorClasificacion,
                         PaisActuacion, NombreCancion, InterpreteCancion ]
 
 
-def generar_n_preguntas_aleatoriamente(n: int, anyos: List[int],
-                                       paises: List[str], coleccion_eurovision) -> List[Trivia]:
+def _construir_pregunta(tipo: type, operaciones: OperacionesEurovision, aleatorio=random) -> Trivia:
     """
-    Genera n preguntas aleatoriamente entre la lista de preguntas posibles.
+    Construye una pregunta del tipo indicado. Si con los filtros no tiene una unica respuesta correcta,
+    se prueba con los demas tipos de pregunta (en orden aleatorio)
     """
-    operaciones = OperacionesEurovision(coleccion_eurovision, anyos, paises)
-    return [random.choice(_preguntas_posibles)(operaciones) for _ in range(n)]
+    alternativas = [otro for otro in _preguntas_posibles if otro is not tipo]
+    aleatorio.shuffle(alternativas)
+    for candidato in [tipo, *alternativas]:
+        try:
+            return candidato(operaciones)
+        except PreguntaSinSolucionUnica:
+            continue
+    raise PreguntaSinSolucionUnica(tipo.__name__)
+
+
+def generar_n_preguntas_aleatoriamente(n: int, anyos: List[int], paises: List[str], coleccion_eurovision,
+                                       indice: Optional[IndiceParticipaciones] = None,
+                                       lote: bool = False, max_concurrencia: int = 1,
+                                       timeout: Optional[float] = None,
+                                       aleatorio: Optional[random.Random] = None,
+                                       coleccion_actuaciones=None) -> List[Trivia]:
+    """
+    Genera n preguntas aleatoriamente entre la lista de preguntas posibles. Si se proporciona
+    un indice en memoria, los datos aleatorios se seleccionan desde el indice. Si "lote" es True,
+    los datos de todas las preguntas se precargan con una o dos consultas (ver "OperacionesLote").
+    Si "max_concurrencia" es mayor que 1, las preguntas se construyen en paralelo y, si no terminan
+    todas en "timeout" segundos, se lanza TimeoutError (ver "construir_concurrentemente").
+    Si se proporciona un generador "aleatorio" con semilla, el quiz es reproducible: todas las selecciones
+    siguen a ese generador y las preguntas se construyen en orden (sin concurrencia).
+    Si se proporciona la coleccion de actuaciones, las selecciones de actuaciones la consultan a ella.
+    """
+    tipos = [(aleatorio if aleatorio is not None else random).choice(_preguntas_posibles) for _ in range(n)]
+
+    if lote:
+        operaciones = OperacionesLote(coleccion_eurovision, anyos, paises, indice, aleatorio, coleccion_actuaciones)
+        operaciones.precargar(tipos)
+    else:
+        operaciones = OperacionesEurovision(coleccion_eurovision, anyos, paises, indice, aleatorio,
+                                            coleccion_actuaciones)
+
+    if max_concurrencia > 1 and n > 1 and aleatorio is None:
+        return construir_concurrentemente([functools.partial(_construir_pregunta, tipo) for tipo in tipos],
+                                          operaciones, max_concurrencia, timeout)
+    return [_construir_pregunta(tipo, operaciones, aleatorio if aleatorio is not None else random)
+            for tipo in tipos]
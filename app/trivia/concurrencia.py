@@ -0,0 +1,56 @@
+"""
+Modulo para construir varias preguntas de trivia a la vez. Cada pregunta hace sus propias consultas
+a Mongo, asi que se pueden construir en paralelo con un conjunto acotado de hilos (PyMongo reparte
+las consultas entre las conexiones de su pool).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Any, Callable, Optional
+
+from .operaciones_coleccion import OperacionesEurovision
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_ejecutor: Optional[ThreadPoolExecutor] = None
+_max_hilos = 0
+
+
+def _obtener_ejecutor(max_concurrencia: int) -> ThreadPoolExecutor:
+    """
+    Devuelve el conjunto de hilos compartido. Si cambia la concurrencia maxima, se crea uno nuevo.
+    """
+    global _ejecutor, _max_hilos
+    with _lock:
+        if _ejecutor is None or _max_hilos != max_concurrencia:
+            if _ejecutor is not None:
+                _ejecutor.shutdown(wait=False)
+            _ejecutor = ThreadPoolExecutor(max_workers=max_concurrencia, thread_name_prefix="trivia")
+            _max_hilos = max_concurrencia
+        return _ejecutor
+
+
+def construir_concurrentemente(constructores: List[Callable[[OperacionesEurovision], Any]],
+                               operaciones: OperacionesEurovision, max_concurrencia: int,
+                               timeout: Optional[float] = None) -> list:
+    """
+    Construye una pregunta con cada constructor de la lista (un tipo de pregunta o una funcion que recibe
+    las operaciones), como mucho "max_concurrencia" a la vez, y las devuelve en el mismo orden. Si pasado
+    "timeout" segundos quedan preguntas sin terminar, se cancelan (las que estan en marcha dejan de
+    consultar a Mongo y liberan su hilo) y se lanza TimeoutError, en lugar de devolver menos preguntas.
+    """
+    ejecutor = _obtener_ejecutor(max_concurrencia)
+    futuros = [ejecutor.submit(constructor, operaciones) for constructor in constructores]
+    terminados, pendientes = wait(futuros, timeout=timeout)
+
+    if pendientes:
+        for futuro in pendientes:
+            futuro.cancel()
+        operaciones.cancelar()
+        logger.warning("Se han cancelado %d de %d preguntas por superar el tiempo maximo (%s s)",
+                       len(pendientes), len(futuros), timeout)
+        raise TimeoutError(f"No se han podido generar {len(futuros)} preguntas en {timeout} s")
+
+    # Si alguna pregunta ha fallado, se propaga la excepcion (igual que en la version secuencial)
+    return [futuro.result() for futuro in futuros]
@@ -0,0 +1,410 @@
+"""
+Modulo que define un indice en memoria de las participaciones de la coleccion de festivales. Permite
+seleccionar datos aleatoriamente sin tener que lanzar una agregacion a Mongo por cada pregunta.
+"""
+import random
+import threading
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import List, Dict, Any, Tuple, Optional, Sequence
+
+# NumPy es opcional: si no esta instalado, las medias de puntuacion se siguen calculando en Mongo
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Campos de cada concursante que se guardan en el indice. Se devuelven con la misma forma
+# que los documentos de "concursantes" de la coleccion
+CAMPOS_CONCURSANTE = ("id_pais", "pais", "artista", "cancion", "resultado", "puntuacion", "url_youtube")
+
+# Numero maximo de combinaciones de filtros (anyos, paises) cuyos candidatos se guardan
+MAX_COMBINACIONES_FILTROS = 256
+
+# Numero maximo de rangos de anyos que se comprueban a la vez al buscar uno sin empate en la mejor media.
+# Si hay mas rangos posibles, se comprueban solo estos, elegidos aleatoriamente
+MAX_RANGOS_CANDIDATOS = 4096
+
+
+class _DatosIndice:
+    """
+    Contenido del indice. Se construye entero antes de publicarlo, de manera que los hilos que
+    estan generando preguntas nunca ven un indice a medio construir.
+    """
+
+    def __init__(self, festivales):
+        # Columnas de las actuaciones (ordenadas por anyo)
+        self.anyo: List[int] = []
+        self.columnas: Dict[str, List[Any]] = {campo: [] for campo in CAMPOS_CONCURSANTE}
+
+        # Anyos ordenados y sus desplazamientos [inicio, fin) dentro de las columnas
+        self.anyos: List[int] = []
+        self.rango_anyo: Dict[int, Tuple[int, int]] = {}
+        self.organizador_anyo: Dict[int, str] = {}
+        self.paises_anyo: Dict[int, List[str]] = {}
+
+        for festival in festivales:
+            anyo = festival["anyo"]
+            inicio = len(self.anyo)
+            for concursante in festival.get("concursantes", []):
+                self.anyo.append(anyo)
+                for campo in CAMPOS_CONCURSANTE:
+                    self.columnas[campo].append(concursante.get(campo))
+
+            self.anyos.append(anyo)
+            self.rango_anyo[anyo] = (inicio, len(self.anyo))
+            self.organizador_anyo[anyo] = festival["pais"]
+            self.paises_anyo[anyo] = sorted(set(self.columnas["pais"][inicio:]))
+
+        # Permutacion de las actuaciones ordenada por pais. La ordenacion es estable,
+        # asi que dentro de cada pais las actuaciones siguen ordenadas por anyo
+        paises = self.columnas["pais"]
+        self.por_pais: List[int] = sorted(range(len(self.anyo)), key=lambda i: paises[i])
+        self.rango_pais: Dict[str, Tuple[int, int]] = {}
+        inicio = 0
+        for posicion in range(1, len(self.por_pais) + 1):
+            if posicion == len(self.por_pais) or paises[self.por_pais[posicion]] != paises[self.por_pais[inicio]]:
+                self.rango_pais[paises[self.por_pais[inicio]]] = (inicio, posicion)
+                inicio = posicion
+
+        # Anyos ordenados en los que ha participado cada pais. El primero es el de su primera participacion
+        self.anyos_pais: Dict[str, List[int]] = {
+            pais: sorted({self.anyo[i] for i in self.por_pais[inicio:fin]})
+            for pais, (inicio, fin) in self.rango_pais.items()
+        }
+
+        # Sumas acumuladas por pais (filas) y anyo (columnas) de la puntuacion y del numero de
+        # participaciones. La columna j contiene la suma de los anyos anteriores al anyo j, de manera
+        # que la suma entre los anyos i y j (sin incluir) es acumulado[:, j] - acumulado[:, i]
+        self.paises: List[str] = sorted(self.rango_pais)
+        self.puntos_acumulados = None
+        self.participaciones_acumuladas = None
+        if np is not None:
+            fila_pais = {pais: fila for fila, pais in enumerate(self.paises)}
+            columna_anyo = {anyo: columna for columna, anyo in enumerate(self.anyos)}
+            puntos = np.zeros((len(self.paises), len(self.anyos) + 1))
+            participaciones = np.zeros((len(self.paises), len(self.anyos) + 1))
+            for i, anyo in enumerate(self.anyo):
+                puntuacion = self.columnas["puntuacion"][i]
+                if puntuacion is not None:
+                    fila, columna = fila_pais[paises[i]], columna_anyo[anyo] + 1
+                    puntos[fila, columna] += puntuacion
+                    participaciones[fila, columna] += 1
+            self.puntos_acumulados = np.cumsum(puntos, axis=1)
+            self.participaciones_acumuladas = np.cumsum(participaciones, axis=1)
+
+        # Candidatos ya calculados para cada combinacion de filtros
+        self.candidatos: Dict[Tuple[frozenset, frozenset], List[Tuple[int, int]]] = {}
+
+
+def datos_coleccion(coleccion) -> _DatosIndice:
+    """
+    Construye el contenido del indice a partir de la coleccion de festivales. Solo se descarga la
+    informacion necesaria de cada edicion.
+    """
+    festivales = coleccion.find({}, {"_id": 0, "anyo": 1, "pais": 1, "concursantes": 1}).sort("anyo", 1)
+    return _DatosIndice(festivales)
+
+
+class IndiceParticipaciones:
+    """
+    Indice en memoria de todas las participaciones. Las actuaciones se guardan en listas planas
+    (una por campo) ordenadas por anyo, junto con los desplazamientos de cada anyo dentro de esas listas.
+    Para los paises se guarda una permutacion ordenada por pais y los desplazamientos de cada pais
+    dentro de esa permutacion.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datos: Optional[_DatosIndice] = None
+        # Version de los datos de la coleccion con la que se ha cargado el indice (si se conoce)
+        self.version: Optional[int] = None
+
+    @property
+    def cargado(self) -> bool:
+        return self._datos is not None
+
+    @property
+    def medias_disponibles(self) -> bool:
+        """
+        Indica si se pueden calcular las medias de puntuacion desde el indice (requiere NumPy)
+        """
+        return self._datos is not None and self._datos.puntos_acumulados is not None
+
+    def cargar(self, coleccion, version: Optional[int] = None):
+        """
+        Construye el indice a partir de la coleccion de festivales
+        """
+        with self._lock:
+            self.publicar(datos_coleccion(coleccion), version)
+
+    def _obsoleto(self, version: Optional[int]) -> bool:
+        return not self.cargado or (version is not None and version != self.version)
+
+    def cargar_si_obsoleto(self, coleccion, version: Optional[int] = None):
+        """
+        Construye el indice si no esta cargado o se cargo con otra version de los datos. La comprobacion
+        se repite dentro del lock para que, si varios hilos lo encuentran obsoleto a la vez, solo uno lo
+        reconstruya y el resto use el resultado.
+        """
+        if not self._obsoleto(version):
+            return
+        with self._lock:
+            if self._obsoleto(version):
+                self.publicar(datos_coleccion(coleccion), version)
+
+    def publicar(self, datos, version: Optional[int] = None):
+        """
+        Sustituye el contenido del indice por unos datos ya construidos (un "_DatosIndice" o cualquier objeto
+        con los mismos atributos, como los de una instantanea, ver el modulo "instantanea")
+        """
+        self._datos = datos
+        self.version = version
+
+    def recargar(self, coleccion, version: Optional[int] = None):
+        """
+        Vuelve a construir el indice. Hay que llamarlo cuando cambian los datos de la coleccion.
+        """
+        self.cargar(coleccion, version)
+
+    def invalidar(self):
+        """
+        Marca el indice como no cargado, para que se reconstruya la proxima vez que se use.
+        """
+        self._datos = None
+
+    ### Funciones auxiliares para aplicar los filtros
+
+    @staticmethod
+    def _anyos_filtrados(datos: _DatosIndice, anyos: Sequence[int]) -> List[int]:
+        if not anyos:
+            return datos.anyos
+        seleccionados = set(anyos)
+        return [anyo for anyo in datos.anyos if anyo in seleccionados]
+
+    def _rangos(self, datos: _DatosIndice, anyos: Sequence[int], paises: Sequence[str]) -> List[Tuple[int, int]]:
+        """
+        Devuelve una lista de rangos [inicio, fin) con las actuaciones que cumplen los filtros. Si hay
+        filtro de paises, los rangos se refieren a la permutacion "por_pais".
+        """
+        clave = (frozenset(anyos), frozenset(paises))
+        rangos = datos.candidatos.get(clave)
+        if rangos is not None:
+            return rangos
+
+        if not paises:
+            rangos = [datos.rango_anyo[anyo] for anyo in self._anyos_filtrados(datos, anyos)]
+        elif not anyos:
+            rangos = [datos.rango_pais[pais] for pais in sorted(set(paises)) if pais in datos.rango_pais]
+        else:
+            # Con los dos filtros, nos quedamos con las actuaciones de cada pais en los anyos seleccionados.
+            # Cada posicion se guarda como un rango de longitud 1
+            seleccionados = set(anyos)
+            rangos = []
+            for pais in sorted(set(paises)):
+                inicio, fin = datos.rango_pais.get(pais, (0, 0))
+                rangos.extend((p, p + 1) for p in range(inicio, fin)
+                              if datos.anyo[datos.por_pais[p]] in seleccionados)
+
+        # Limitamos el numero de combinaciones guardadas para que no crezca indefinidamente
+        if len(datos.candidatos) >= MAX_COMBINACIONES_FILTROS:
+            datos.candidatos.clear()
+        datos.candidatos[clave] = rangos
+        return rangos
+
+    @staticmethod
+    def _muestrear_rangos(rangos: List[Tuple[int, int]], n: int, aleatorio=random) -> List[int]:
+        """
+        Selecciona n posiciones distintas de la union de los rangos, sin construir la lista completa
+        """
+        acumulados = list(accumulate(fin - inicio for inicio, fin in rangos))
+        total = acumulados[-1] if acumulados else 0
+
+        posiciones = []
+        for k in aleatorio.sample(range(total), min(n, total)):
+            r = bisect_right(acumulados, k)
+            posiciones.append(rangos[r][0] + k - (acumulados[r - 1] if r > 0 else 0))
+        return posiciones
+
+    ### Metodos de seleccion aleatoria (equivalentes a los de OperacionesEurovision). Reciben el
+    ### generador aleatorio que se debe usar, para que las selecciones se puedan reproducir con una semilla
+
+    def anyos_aleatorios(self, n: int, anyos: Sequence[int], aleatorio=random) -> List[int]:
+        disponibles = self._anyos_filtrados(self._datos, anyos)
+        return aleatorio.sample(disponibles, min(n, len(disponibles)))
+
+    def paises_organizadores_aleatorios(self, n: int, anyos: Sequence[int], paises: Sequence[str],
+                                        aleatorio=random) -> List[str]:
+        datos = self._datos
+        organizadores = {datos.organizador_anyo[anyo] for anyo in self._anyos_filtrados(datos, anyos)}
+        if paises:
+            organizadores &= set(paises)
+        organizadores = sorted(organizadores)
+        return aleatorio.sample(organizadores, min(n, len(organizadores)))
+
+    def paises_participantes_aleatorios(self, n: int, anyos: Sequence[int], paises: Sequence[str],
+                                        aleatorio=random) -> List[str]:
+        datos = self._datos
+        if anyos:
+            participantes = set()
+            for anyo in self._anyos_filtrados(datos, anyos):
+                participantes.update(datos.paises_anyo[anyo])
+        else:
+            participantes = set(datos.rango_pais)
+
+        if paises:
+            participantes &= set(paises)
+        participantes = sorted(participantes)
+        return aleatorio.sample(participantes, min(n, len(participantes)))
+
+    def participaciones_aleatorias(self, n: int, anyos: Sequence[int], paises: Sequence[str],
+                                   aleatorio=random) -> List[Dict[str, Any]]:
+        datos = self._datos
+        posiciones = self._muestrear_rangos(self._rangos(datos, anyos, paises), n, aleatorio)
+
+        # Si hay filtro de paises, las posiciones se refieren a la permutacion por pais
+        if paises:
+            posiciones = [datos.por_pais[p] for p in posiciones]
+        return [{"anyo": datos.anyo[i], **{campo: datos.columnas[campo][i] for campo in CAMPOS_CONCURSANTE}}
+                for i in posiciones]
+
+    def paises_participantes(self) -> List[str]:
+        return list(self._datos.paises)
+
+    def otros_paises_aleatorios(self, pais_excluido: str, n: int, aleatorio=random) -> List[str]:
+        otros = [pais for pais in self._datos.paises if pais != pais_excluido]
+        return aleatorio.sample(otros, min(n, len(otros)))
+
+    def valores_mismo_pais_aleatorios(self, pais: str, campo: str, valor_excluido: Any, n: int,
+                                      aleatorio=random) -> List[Any]:
+        datos = self._datos
+        inicio, fin = datos.rango_pais.get(pais, (0, 0))
+        columna = datos.columnas[campo]
+        valores = sorted({columna[datos.por_pais[p]] for p in range(inicio, fin)} - {valor_excluido, None})
+        return aleatorio.sample(valores, min(n, len(valores)))
+
+    def participaciones_anyo_aleatorias(self, anyo: int, n: int, aleatorio=random) -> List[Dict[str, Any]]:
+        datos = self._datos
+        inicio, fin = datos.rango_anyo.get(anyo, (0, 0))
+        participaciones = [{campo: datos.columnas[campo][i] for campo in ("cancion", "pais", "id_pais", "resultado")}
+                           for i in aleatorio.sample(range(inicio, fin), min(n, fin - inicio))]
+        return sorted(participaciones, key=lambda participacion: participacion["resultado"])
+
+    def anyos_participacion(self, pais: str) -> List[int]:
+        """
+        Devuelve los anyos (ordenados) en los que ha participado un pais
+        """
+        return list(self._datos.anyos_pais.get(pais, []))
+
+    def primer_anyo_participacion(self, pais: str) -> Optional[int]:
+        anyos_pais = self._datos.anyos_pais.get(pais)
+        return anyos_pais[0] if anyos_pais else None
+
+    def anyos_cercanos_aleatorios(self, anyo: int, n: int, anyos: Sequence[int], aleatorio=random) -> List[int]:
+        return anyos_cercanos_aleatorios(anyo, n, self._anyos_filtrados(self._datos, anyos), aleatorio)
+
+    def rango_anyos_aleatorio(self, anyos: Sequence[int], aleatorio=random) -> Tuple[int, int]:
+        disponibles = self._anyos_filtrados(self._datos, anyos)
+        anyo_inicial = aleatorio.choice(disponibles)
+        anyo_final = aleatorio.choice(disponibles[bisect_left(disponibles, anyo_inicial):])
+        return anyo_inicial, anyo_final
+
+    def medias_puntuacion(self, anyo_inicial: int, anyo_final: int, n: int) -> List[Dict[str, Any]]:
+        """
+        Devuelve los n paises con mejor media de puntuacion entre dos anyos (incluidos), con el mismo
+        formato que "OperacionesEurovision.medias_puntuacion". Se calcula para todos los paises a la vez
+        con las sumas acumuladas, sin recorrer las participaciones.
+        """
+        datos = self._datos
+        inicio = bisect_left(datos.anyos, anyo_inicial)
+        fin = bisect_right(datos.anyos, anyo_final)
+
+        puntos = datos.puntos_acumulados[:, fin] - datos.puntos_acumulados[:, inicio]
+        participaciones = datos.participaciones_acumuladas[:, fin] - datos.participaciones_acumuladas[:, inicio]
+        medias = np.divide(puntos, participaciones, out=np.full(len(datos.paises), -np.inf),
+                           where=participaciones > 0)
+
+        # Ordenamos de mayor a menor media (los paises sin participaciones quedan al final)
+        mejores = np.argsort(-medias, kind="stable")[:n]
+        return [{"_id": datos.paises[fila], "media_puntuacion": float(medias[fila])}
+                for fila in mejores if participaciones[fila] > 0]
+
+    def medias_sin_empate(self, anyos: Sequence[int], n: int,
+                          aleatorio=random) -> Optional[Tuple[int, int, List[Dict[str, Any]]]]:
+        """
+        Elige aleatoriamente un rango de anyos (entre los filtrados) en el que el pais con mejor media de
+        puntuacion no empata con el segundo. Devuelve (anyo inicial, anyo final, n mejores medias), o None
+        si no hay ningun rango sin empate. Las medias de todos los rangos candidatos y todos los paises se
+        calculan de una vez con las sumas acumuladas.
+        """
+        datos = self._datos
+        disponibles = self._anyos_filtrados(datos, anyos)
+        m = len(disponibles)
+        if m * (m + 1) // 2 <= MAX_RANGOS_CANDIDATOS:
+            pares = [(i, j) for i in range(m) for j in range(i, m)]
+        else:
+            pares = []
+            for _ in range(MAX_RANGOS_CANDIDATOS):
+                i = aleatorio.randrange(m)
+                pares.append((i, aleatorio.randrange(i, m)))
+        if not pares:
+            return None
+
+        iniciales = np.array([disponibles[i] for i, _ in pares])
+        finales = np.array([disponibles[j] for _, j in pares])
+        inicio = np.searchsorted(datos.anyos, iniciales, side="left")
+        fin = np.searchsorted(datos.anyos, finales, side="right")
+
+        # Una columna por rango candidato y una fila por pais
+        puntos = datos.puntos_acumulados[:, fin] - datos.puntos_acumulados[:, inicio]
+        participaciones = datos.participaciones_acumuladas[:, fin] - datos.participaciones_acumuladas[:, inicio]
+        medias = np.divide(puntos, participaciones, out=np.full(puntos.shape, -np.inf), where=participaciones > 0)
+
+        # Un rango es valido si la mejor media es estrictamente mayor que la segunda
+        if len(medias) > 1:
+            segunda, primera = np.partition(medias, -2, axis=0)[-2:]
+        else:
+            primera, segunda = medias[0], np.full(medias.shape[1], -np.inf)
+        validos = np.flatnonzero((primera > segunda) & (primera > -np.inf))
+        if not len(validos):
+            return None
+
+        elegido = validos[aleatorio.randrange(len(validos))]
+        anyo_inicial, anyo_final = int(iniciales[elegido]), int(finales[elegido])
+        return anyo_inicial, anyo_final, self.medias_puntuacion(anyo_inicial, anyo_final, n)
+
+
+def anyos_cercanos_aleatorios(anyo: int, n: int, candidatos: Sequence[int], aleatorio=random) -> List[int]:
+    """
+    Selecciona aleatoriamente n anyos distintos de "anyo" entre los 2n candidatos mas cercanos a el.
+    Se utiliza para generar opciones invalidas que no sean demasiado faciles de descartar.
+    """
+    cercanos = sorted((candidato for candidato in set(candidatos) if candidato != anyo),
+                      key=lambda candidato: (abs(candidato - anyo), candidato))[:2 * n]
+    return aleatorio.sample(cercanos, min(n, len(cercanos)))
+
+
+# Instancia compartida por toda la aplicacion. Se carga de forma perezosa la primera vez que se necesita
+indice_participaciones = IndiceParticipaciones()
+
+
+def obtener_indice(coleccion, version: Optional[int] = None) -> IndiceParticipaciones:
+    """
+    Devuelve el indice compartido, cargandolo desde la coleccion si todavia no se ha hecho. Si se
+    proporciona la version de los datos y el indice se cargo con otra, se vuelve a cargar (los datos se
+    pueden haber modificado desde otro proceso, por ejemplo con "flask cargar-festivales").
+    """
+    indice_participaciones.cargar_si_obsoleto(coleccion, version)
+    return indice_participaciones
+
+
+def recargar_indice(coleccion: Optional[Any] = None):
+    """
+    Hook para cuando cambian los datos de la coleccion. Si se proporciona la coleccion, el indice
+    se reconstruye inmediatamente. Si no, se invalida y se reconstruye la proxima vez que se use.
+    """
+    if coleccion is None:
+        indice_participaciones.invalidar()
+    else:
+        indice_participaciones.recargar(coleccion)
@@ -0,0 +1,302 @@
+"""
+Modulo que exporta el indice de participaciones (ver el modulo "indice") a una instantanea en disco con
+formato de columnas, y la abre con "mmap" de solo lectura. Asi, todos los procesos de la aplicacion que
+abren la misma instantanea comparten las mismas paginas de memoria, en lugar de construir cada uno su
+propia copia del indice (o de consultar a Mongo).
+
+La instantanea es un directorio con un fichero ".npy" de NumPy por cada columna (anyo, resultado,
+puntuacion...). Las cadenas (paises, artistas, canciones, URLs) se guardan una sola vez en una tabla
+de cadenas, y las columnas guardan su codigo en la tabla. Las tablas de cada anyo y de cada pais se
+guardan como desplazamientos dentro de esas columnas.
+
+Requiere NumPy.
+"""
+import json
+import os
+import shutil
+import threading
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from typing import List, Dict, Any, Optional, Callable
+from .indice import CAMPOS_CONCURSANTE, IndiceParticipaciones, datos_coleccion
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Version del formato de la instantanea. Si cambia, hay que volver a exportarla
+FORMATO_INSTANTANEA = 1
+
+# Fichero con los metadatos de la instantanea (formato, version de los datos y tamanyos)
+FICHERO_METADATOS = "instantanea.json"
+
+# Codigo de las cadenas nulas y valor de los enteros nulos en las columnas
+CODIGO_NULO = -1
+ENTERO_NULO = -2 ** 63
+
+
+### Exportacion
+
+class _TablaCadenasNueva:
+    """
+    Tabla de cadenas en construccion: cada cadena distinta recibe un codigo la primera vez que aparece
+    """
+
+    def __init__(self):
+        self.codigos: Dict[str, int] = {}
+
+    def codigo(self, cadena: Optional[str]) -> int:
+        if cadena is None:
+            return CODIGO_NULO
+        return self.codigos.setdefault(cadena, len(self.codigos))
+
+    def codigos_de(self, cadenas) -> "np.ndarray":
+        return np.array([self.codigo(cadena) for cadena in cadenas], dtype=np.int32)
+
+
+def _columna_numerica(valores: List[Any]) -> "np.ndarray":
+    """
+    Columna de enteros (con ENTERO_NULO para los valores nulos), o de reales (con NaN) si hay algun real
+    """
+    if all(valor is None or isinstance(valor, int) for valor in valores):
+        return np.array([ENTERO_NULO if valor is None else valor for valor in valores], dtype=np.int64)
+    return np.array([np.nan if valor is None else valor for valor in valores], dtype=np.float64)
+
+
+def _desplazamientos(longitudes: List[int]) -> "np.ndarray":
+    """
+    Desplazamientos [inicio, fin) de cada grupo: el grupo i ocupa las posiciones desplazamientos[i:i + 2]
+    """
+    return np.concatenate(([0], np.cumsum(longitudes, dtype=np.int64))).astype(np.int64)
+
+
+def exportar_instantanea(coleccion, ruta: str, version: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Exporta el indice de la coleccion de festivales al directorio "ruta". La instantanea se escribe en un
+    directorio temporal y se sustituye al final, de manera que los procesos que tienen abierta la anterior
+    pueden seguir usandola. Devuelve los metadatos de la instantanea.
+    """
+    if np is None:
+        raise RuntimeError("La exportacion de la instantanea requiere NumPy")
+
+    datos = datos_coleccion(coleccion)
+    cadenas = _TablaCadenasNueva()
+    columnas: Dict[str, "np.ndarray"] = {"anyo": np.array(datos.anyo, dtype=np.int32)}
+    for campo in CAMPOS_CONCURSANTE:
+        valores = datos.columnas[campo]
+        if all(valor is None or isinstance(valor, str) for valor in valores):
+            columnas[campo] = cadenas.codigos_de(valores)
+        else:
+            columnas[campo] = _columna_numerica(valores)
+
+    columnas.update({
+        # Ediciones
+        "anyos": np.array(datos.anyos, dtype=np.int32),
+        "inicio_anyo": _desplazamientos([fin - inicio for inicio, fin in
+                                         (datos.rango_anyo[anyo] for anyo in datos.anyos)]),
+        "organizador": cadenas.codigos_de(datos.organizador_anyo[anyo] for anyo in datos.anyos),
+        "paises_anyo": cadenas.codigos_de(pais for anyo in datos.anyos for pais in datos.paises_anyo[anyo]),
+        "inicio_paises_anyo": _desplazamientos([len(datos.paises_anyo[anyo]) for anyo in datos.anyos]),
+        # Paises participantes
+        "por_pais": np.array(datos.por_pais, dtype=np.int32),
+        "paises": cadenas.codigos_de(datos.paises),
+        "inicio_pais": _desplazamientos([fin - inicio for inicio, fin in
+                                         (datos.rango_pais[pais] for pais in datos.paises)]),
+        "anyos_pais": np.array([anyo for pais in datos.paises for anyo in datos.anyos_pais[pais]], dtype=np.int32),
+        "inicio_anyos_pais": _desplazamientos([len(datos.anyos_pais[pais]) for pais in datos.paises]),
+        # Medias de puntuacion
+        "puntos_acumulados": datos.puntos_acumulados,
+        "participaciones_acumuladas": datos.participaciones_acumuladas,
+    })
+
+    # Tabla de cadenas: todas las cadenas en UTF-8, una detras de otra
+    codificadas = [cadena.encode("utf-8") for cadena in cadenas.codigos]
+    columnas["cadenas"] = np.frombuffer(b"".join(codificadas), dtype=np.uint8)
+    columnas["inicio_cadenas"] = _desplazamientos([len(cadena) for cadena in codificadas])
+
+    metadatos = {"formato": FORMATO_INSTANTANEA, "version": version, "actuaciones": len(datos.anyo),
+                 "anyos": len(datos.anyos), "paises": len(datos.paises), "cadenas": len(codificadas)}
+
+    ruta = os.path.abspath(ruta)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+    for nombre, columna in columnas.items():
+        np.save(os.path.join(temporal, f"{nombre}.npy"), columna)
+    with open(os.path.join(temporal, FICHERO_METADATOS), "w", encoding="utf-8") as fichero:
+        json.dump(metadatos, fichero)
+
+    # Los ficheros de la instantanea anterior siguen existiendo mientras algun proceso los tenga abiertos
+    anterior = f"{ruta}.{os.getpid()}.old"
+    if os.path.exists(ruta):
+        os.replace(ruta, anterior)
+    os.replace(temporal, ruta)
+    shutil.rmtree(anterior, ignore_errors=True)
+    return metadatos
+
+
+### Lectura
+
+class _TablaCadenas(Sequence):
+    """
+    Tabla de cadenas de la instantanea. Las cadenas se decodifican al acceder a ellas
+    """
+
+    def __init__(self, cadenas: "np.ndarray", inicios: "np.ndarray"):
+        self._cadenas = cadenas
+        self._inicios = inicios
+
+    def __len__(self):
+        return len(self._inicios) - 1
+
+    def __getitem__(self, codigo):
+        if codigo == CODIGO_NULO:
+            return None
+        return self._cadenas[self._inicios[codigo]:self._inicios[codigo + 1]].tobytes().decode("utf-8")
+
+
+class _Columna(Sequence):
+    """
+    Columna de la instantanea que devuelve valores de Python: cadenas (si tiene tabla de cadenas),
+    enteros o reales, y None para los valores nulos
+    """
+
+    def __init__(self, valores: "np.ndarray", cadenas: Optional[_TablaCadenas] = None):
+        self._valores = valores
+        self._cadenas = cadenas
+
+    def __len__(self):
+        return len(self._valores)
+
+    def __getitem__(self, posicion):
+        if isinstance(posicion, slice):
+            return [self[i] for i in range(*posicion.indices(len(self)))]
+        valor = self._valores[posicion].item()
+        if self._cadenas is not None:
+            return self._cadenas[valor]
+        if valor == ENTERO_NULO or valor != valor:
+            return None
+        return valor
+
+
+class _Tabla(Mapping):
+    """
+    Diccionario de solo lectura con claves ordenadas. El valor de la clave de la posicion i es valor(i)
+    """
+
+    def __init__(self, claves: List[Any], valor: Callable[[int], Any]):
+        self._claves = claves
+        self._valor = valor
+
+    def __getitem__(self, clave):
+        posicion = bisect_left(self._claves, clave)
+        if posicion == len(self._claves) or self._claves[posicion] != clave:
+            raise KeyError(clave)
+        return self._valor(posicion)
+
+    def __iter__(self):
+        return iter(self._claves)
+
+    def __len__(self):
+        return len(self._claves)
+
+
+class _DatosInstantanea:
+    """
+    Contenido del indice leido de una instantanea. Tiene los mismos atributos que "_DatosIndice", pero las
+    columnas y las tablas se leen de los ficheros abiertos con "mmap". Solo los anyos y los paises (que
+    son pocos) se copian en la memoria del proceso.
+    """
+
+    def __init__(self, ruta: str):
+        with open(os.path.join(ruta, FICHERO_METADATOS), encoding="utf-8") as fichero:
+            self.metadatos = json.load(fichero)
+        if self.metadatos.get("formato") != FORMATO_INSTANTANEA:
+            raise ValueError(f"Formato de instantanea no soportado: {self.metadatos.get('formato')}")
+
+        def cargar(nombre):
+            return np.load(os.path.join(ruta, f"{nombre}.npy"), mmap_mode="r")
+
+        cadenas = _TablaCadenas(cargar("cadenas"), cargar("inicio_cadenas"))
+
+        def columna(nombre):
+            # Las columnas de cadenas son las de codigos (int32). Las numericas son de int64 o float64
+            valores = cargar(nombre)
+            return _Columna(valores, cadenas if valores.dtype == np.int32 else None)
+
+        def rangos(inicios):
+            return lambda i: (int(inicios[i]), int(inicios[i + 1]))
+
+        def listas(valores, inicios):
+            return lambda i: valores[inicios[i]:inicios[i + 1]]
+
+        # Actuaciones (ordenadas por anyo)
+        self.anyo = _Columna(cargar("anyo"))
+        self.columnas = {campo: columna(campo) for campo in CAMPOS_CONCURSANTE}
+
+        # Ediciones
+        self.anyos: List[int] = cargar("anyos").tolist()
+        self.rango_anyo = _Tabla(self.anyos, rangos(cargar("inicio_anyo")))
+        self.organizador_anyo = _Tabla(self.anyos, _Columna(cargar("organizador"), cadenas).__getitem__)
+        self.paises_anyo = _Tabla(self.anyos, listas(_Columna(cargar("paises_anyo"), cadenas),
+                                                     cargar("inicio_paises_anyo")))
+
+        # Paises participantes
+        self.por_pais = _Columna(cargar("por_pais"))
+        self.paises: List[str] = _Columna(cargar("paises"), cadenas)[:]
+        self.rango_pais = _Tabla(self.paises, rangos(cargar("inicio_pais")))
+        self.anyos_pais = _Tabla(self.paises, listas(_Columna(cargar("anyos_pais")),
+                                                     cargar("inicio_anyos_pais")))
+
+        # Medias de puntuacion
+        self.puntos_acumulados = cargar("puntos_acumulados")
+        self.participaciones_acumuladas = cargar("participaciones_acumuladas")
+
+        # Candidatos ya calculados para cada combinacion de filtros (en la memoria del proceso)
+        self.candidatos = {}
+
+
+# Instantanea abierta en este proceso: (ruta, fecha de modificacion de los metadatos, indice)
+_lock = threading.Lock()
+_abierta = None
+
+
+def abrir_instantanea(ruta: str) -> IndiceParticipaciones:
+    """
+    Abre la instantanea del directorio "ruta" y devuelve un indice que responde desde ella
+    """
+    if np is None:
+        raise RuntimeError("La lectura de la instantanea requiere NumPy")
+    datos = _DatosInstantanea(ruta)
+    indice = IndiceParticipaciones()
+    indice.publicar(datos, datos.metadatos.get("version"))
+    return indice
+
+
+def obtener_instantanea(ruta: str, version: Optional[int] = None) -> Optional[IndiceParticipaciones]:
+    """
+    Devuelve el indice de la instantanea de "ruta", abriendola solo la primera vez y cada vez que se
+    vuelve a exportar. Si no existe, o si se proporciona la version de los datos y la instantanea es de
+    otra version, devuelve None (y hay que usar otra fuente de datos).
+    """
+    global _abierta
+    try:
+        modificacion = os.stat(os.path.join(ruta, FICHERO_METADATOS)).st_mtime_ns
+    except OSError:
+        return None
+
+    abierta = _abierta
+    if abierta is None or abierta[:2] != (ruta, modificacion):
+        with _lock:
+            abierta = _abierta
+            if abierta is None or abierta[:2] != (ruta, modificacion):
+                try:
+                    abierta = _abierta = (ruta, modificacion, abrir_instantanea(ruta))
+                except (OSError, ValueError):
+                    return None
+
+    indice = abierta[2]
+    if version is not None and indice.version != version:
+        return None
+    return indice
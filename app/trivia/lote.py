@@ -0,0 +1,305 @@
+"""
+Modulo que define una version de OperacionesEurovision que precarga en lote los datos aleatorios
+de todas las preguntas de un quiz, en lugar de lanzar varias consultas por cada pregunta.
+"""
+import threading
+from collections import Counter, deque
+from typing import List, Dict, Any, Optional, Tuple
+from ..cache import cache_distinct
+from .operaciones_coleccion import OperacionesEurovision, mejor_media_unica
+from .metricas import medir
+
+# Recursos que necesitan un concursante aleatorio (ver el atributo "recursos" de Trivia)
+_RECURSOS_PARTICIPACION = "participacion"
+
+# Numero de concursantes por anyo y de medias por rango que se precargan
+_CONCURSANTES_ANYO = 4
+_LIMITE_MEDIAS = 10
+
+
+class OperacionesLote(OperacionesEurovision):
+    """
+    Extiende OperacionesEurovision para responder desde datos precargados. El metodo "precargar" recibe
+    la lista de tipos de pregunta del quiz, los agrupa por tipo y obtiene todos los datos aleatorios
+    con (como mucho) dos agregaciones "$facet" (mas un "$count" previo si la seleccion es reproducible).
+    Cada faceta devuelve solo los documentos que se van a usar. Los anyos y los paises salen de la cache de "distinct". Las selecciones se hacen sin
+    reemplazamiento, de manera que un quiz nunca repite una actuacion. Si algun dato no se ha precargado,
+    se recurre a la implementacion original. Con el indice en memoria cargado no se precarga nada.
+    """
+
+    def __init__(self, coleccion, anyos: List[int], paises: List[str], indice=None, aleatorio=None,
+                 actuaciones=None):
+        super().__init__(coleccion, anyos, paises, indice, aleatorio, actuaciones)
+        # Las preguntas se pueden construir concurrentemente con el mismo objeto (ver "concurrencia")
+        self._lock_extraer = threading.Lock()
+        self._participaciones = deque()
+        self._paises_seleccionados = deque()
+        self._anyos_seleccionados = deque()
+        self._rangos_anyos = deque()
+        self._paises_participantes: Optional[List[str]] = None
+        self._primer_anyo: Dict[str, int] = {}
+        self._participaciones_anyo: Dict[int, List[Dict[str, Any]]] = {}
+        self._medias: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+        self._valores_pais: Dict[str, Dict[str, List[Any]]] = {}
+
+    def precargar(self, tipos: List[type]):
+        """
+        Precarga los datos de todas las preguntas de la lista "tipos" (clases que extienden a Trivia)
+        """
+        with medir(type(self).__name__ + ".precargar"):
+            self._precargar(tipos)
+
+    def _precargar(self, tipos: List[type]):
+        # Con el indice en memoria (o la instantanea) cargado, todas las selecciones ya se hacen sin consultar
+        # a Mongo, asi que no hay nada que precargar
+        if self._usar_indice(None):
+            return
+
+        recursos = Counter()
+        for tipo, cantidad in Counter(tipos).items():
+            for recurso in tipo.recursos:
+                recursos[recurso] += cantidad
+
+        if not recursos:
+            return
+
+        # Los anyos y los paises participantes salen de la cache de "distinct", sin recorrer la coleccion
+        if recursos["paises_participantes"]:
+            self._paises_participantes = self.paises_participantes()
+        if recursos["pais_participante"] and not self.anyos:
+            candidatos = [pais for pais in self.paises_participantes() if not self.paises or pais in self.paises]
+            self._paises_seleccionados.extend(
+                self.aleatorio.sample(candidatos, min(recursos["pais_participante"], len(candidatos))))
+        if recursos["anyo"] or recursos["rango_anyos"]:
+            anyos = cache_distinct.obtener(self._coleccion, "anyo", self._version_datos())
+            self._seleccionar_anyos([anyo for anyo in anyos if not self.anyos or anyo in self.anyos], recursos)
+
+        # Primera consulta: selecciones aleatorias. Cada faceta devuelve como mucho los documentos que se
+        # van a elegir, para no superar el tamanyo maximo del documento de "$facet"
+        fases = {}
+        n_participaciones = recursos[_RECURSOS_PARTICIPACION]
+        if n_participaciones:
+            fases_participaciones = [
+                *self._restringir_anyo(),
+                *self._restringir_pais_participante(),
+                {"$unwind": "$concursantes"},
+                *self._restringir_pais_participante(),
+            ]
+            fin_participaciones = [
+                {"$addFields": {"concursantes.anyo": "$anyo"}},
+                {"$replaceRoot": {"newRoot": "$concursantes"}}
+            ]
+            orden = {"anyo": 1, "concursantes.id_pais": 1}
+            if self._determinista:
+                for i, posicion in enumerate(self._posiciones_aleatorias(fases_participaciones, n_participaciones)):
+                    fases[f"participacion_{i}"] = [*fases_participaciones, {"$sort": orden}, {"$skip": posicion},
+                                                   {"$limit": 1}, *fin_participaciones]
+            else:
+                fases["participaciones"] = [*fases_participaciones, {"$sample": {"size": n_participaciones}},
+                                            *fin_participaciones]
+        if recursos["pais_participante"] and self.anyos:
+            # Hay como mucho un documento por pais
+            fases["paises_seleccionados"] = [
+                *self._restringir_anyo(),
+                *self._restringir_pais_participante(),
+                {"$unwind": "$concursantes"},
+                *self._restringir_pais_participante(),
+                {"$group": {"_id": "$concursantes.pais"}},
+                *self._fases_muestra(recursos["pais_participante"], {"_id": 1})
+            ]
+
+        resultado = self._agregar_facetas(fases) if fases else {}
+
+        if self._determinista:
+            self._participaciones.extend(participacion for i in range(n_participaciones)
+                                         for participacion in resultado.get(f"participacion_{i}", []))
+        else:
+            self._participaciones.extend(resultado.get("participaciones", []))
+        self._paises_seleccionados.extend(d["_id"] for d in self._elegir(resultado.get("paises_seleccionados", []),
+                                                                         recursos["pais_participante"]))
+
+        self._precargar_dependientes(recursos)
+
+    def _agregar_facetas(self, facetas: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Ejecuta las facetas en una sola agregacion. Las facetas no pueden usar indices, asi que si todas
+        empiezan con un filtro, antes del "$facet" se filtra con la union de los filtros (y Mongo puede
+        usar los indices de cada uno).
+        """
+        filtros = [fases[0]["$match"] for fases in facetas.values() if fases and "$match" in fases[0]]
+        previas = []
+        if len(filtros) == len(facetas):
+            previas.append({"$match": filtros[0] if len(filtros) == 1 else {"$or": filtros}})
+        return next(self._coleccion.aggregate([*previas, {"$facet": facetas}]), {})
+
+    def _posiciones_aleatorias(self, fases: List[Dict[str, Any]], n: int) -> List[int]:
+        """
+        Seleccion reproducible sin reemplazamiento: cuenta los documentos de las fases y elige n posiciones
+        con el generador aleatorio. Cada posicion se lee despues con "$sort", "$skip" y "$limit".
+        """
+        total = next(self._coleccion.aggregate([*fases, {"$count": "total"}]), {"total": 0})["total"]
+        return self.aleatorio.sample(range(total), min(n, total))
+
+    def _seleccionar_anyos(self, anyos: List[int], recursos: Counter):
+        """
+        Selecciona los anyos y los rangos de anyos, sin reemplazamiento, para poder precargar sus datos
+        """
+        if not anyos:
+            return
+        self._anyos_seleccionados.extend(self.aleatorio.sample(anyos, min(recursos["anyo"], len(anyos))))
+        for _ in range(recursos["rango_anyos"]):
+            anyo_inicial = self.aleatorio.choice(anyos)
+            anyo_final = self.aleatorio.choice([anyo for anyo in anyos if anyo >= anyo_inicial])
+            self._rangos_anyos.append((anyo_inicial, anyo_final))
+
+    def _precargar_dependientes(self, recursos: Counter):
+        """
+        Segunda consulta: datos que dependen de las selecciones de la primera (concursantes de los anyos
+        seleccionados, medias de los rangos y canciones/interpretes de los paises seleccionados)
+        """
+        fases = {}
+        if recursos["participaciones_anyo"]:
+            for anyo in self._anyos_seleccionados:
+                fases[f"anyo_{anyo}"] = [
+                    {"$match": {"anyo": anyo}},
+                    {"$unwind": "$concursantes"},
+                    {"$project": {
+                        "_id": 0,
+                        "cancion": "$concursantes.cancion",
+                        "pais": "$concursantes.pais",
+                        "id_pais": "$concursantes.id_pais",
+                        "resultado": "$concursantes.resultado"
+                    }},
+                    *self._fases_muestra(_CONCURSANTES_ANYO, {"id_pais": 1})
+                ]
+        if recursos["medias_puntuacion"]:
+            for anyo_inicial, anyo_final in self._rangos_anyos:
+                fases[f"medias_{anyo_inicial}_{anyo_final}"] = [
+                    {"$match": {"anyo": {"$gte": anyo_inicial, "$lte": anyo_final}}},
+                    {"$unwind": "$concursantes"},
+                    {"$group": {
+                        "_id": "$concursantes.pais",
+                        "media_puntuacion": {"$avg": "$concursantes.puntuacion"}
+                    }},
+                    {"$sort": {"media_puntuacion": -1, "_id": 1}},
+                    {"$limit": _LIMITE_MEDIAS}
+                ]
+        if recursos["primer_anyo"] and self._paises_seleccionados:
+            paises = sorted(set(self._paises_seleccionados))
+            fases["primer_anyo"] = [
+                {"$match": {"concursantes.pais": {"$in": paises}}},
+                {"$unwind": "$concursantes"},
+                {"$match": {"concursantes.pais": {"$in": paises}}},
+                {"$group": {"_id": "$concursantes.pais", "anyo": {"$min": "$anyo"}}}
+            ]
+        if recursos["mismo_pais"] and self._participaciones:
+            paises = sorted({p["pais"] for p in self._participaciones})
+            fases["mismo_pais"] = [
+                {"$match": {"concursantes.pais": {"$in": paises}}},
+                {"$unwind": "$concursantes"},
+                {"$match": {"concursantes.pais": {"$in": paises}}},
+                {"$group": {
+                    "_id": "$concursantes.pais",
+                    "cancion": {"$addToSet": "$concursantes.cancion"},
+                    "artista": {"$addToSet": "$concursantes.artista"}
+                }}
+            ]
+
+        if not fases:
+            return
+
+        resultado = self._agregar_facetas(fases)
+
+        for anyo in self._anyos_seleccionados:
+            if f"anyo_{anyo}" in resultado:
+                participaciones = self._elegir(resultado[f"anyo_{anyo}"], _CONCURSANTES_ANYO)
+                self._participaciones_anyo[anyo] = sorted(participaciones, key=lambda p: p["resultado"])
+        for anyo_inicial, anyo_final in self._rangos_anyos:
+            if f"medias_{anyo_inicial}_{anyo_final}" in resultado:
+                self._medias[(anyo_inicial, anyo_final)] = resultado[f"medias_{anyo_inicial}_{anyo_final}"]
+        self._primer_anyo = {d["_id"]: d["anyo"] for d in resultado.get("primer_anyo", [])}
+        for documento in resultado.get("mismo_pais", []):
+            self._valores_pais[documento["_id"]] = {"cancion": sorted(documento["cancion"]),
+                                                    "artista": sorted(documento["artista"])}
+
+    def _extraer(self, cola: deque, n: int) -> Optional[List[Any]]:
+        """
+        Extrae n elementos de una cola de datos precargados. Si no hay suficientes, devuelve None.
+        """
+        with self._lock_extraer:
+            if len(cola) < n:
+                return None
+            return [cola.popleft() for _ in range(n)]
+
+    ### Metodos de OperacionesEurovision que se responden desde los datos precargados
+
+    def anyo_aleatorio(self, n: int, condiciones_extras: Optional[List[Dict[str, Any]]] = None) -> List[int]:
+        if not condiciones_extras:
+            anyos = self._extraer(self._anyos_seleccionados, n)
+            if anyos is not None:
+                return anyos
+        return super().anyo_aleatorio(n, condiciones_extras)
+
+    def paises_participantes_aleatorios(self, n: int,
+                                        condiciones_extras: Optional[List[Dict[str, Any]]] = None) -> List[str]:
+        if not condiciones_extras:
+            paises = self._extraer(self._paises_seleccionados, n)
+            if paises is not None:
+                return paises
+        return super().paises_participantes_aleatorios(n, condiciones_extras)
+
+    def participacion_aleatoria(self, n: int,
+                                condiciones_extras: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        if not condiciones_extras:
+            participaciones = self._extraer(self._participaciones, n)
+            if participaciones is not None:
+                return participaciones
+        return super().participacion_aleatoria(n, condiciones_extras)
+
+    def primer_anyo_participacion(self, pais: str) -> int:
+        if pais in self._primer_anyo:
+            return self._primer_anyo[pais]
+        return super().primer_anyo_participacion(pais)
+
+    def paises_participantes(self) -> List[str]:
+        if self._paises_participantes is not None:
+            return list(self._paises_participantes)
+        return super().paises_participantes()
+
+    def otros_paises_aleatorios(self, pais_excluido: str, n: int) -> List[str]:
+        if self._paises_participantes is not None:
+            candidatos = [pais for pais in self._paises_participantes if pais != pais_excluido]
+            return self.aleatorio.sample(candidatos, min(n, len(candidatos)))
+        return super().otros_paises_aleatorios(pais_excluido, n)
+
+    def valores_mismo_pais_aleatorios(self, pais: str, campo: str, valor_excluido: Any, n: int) -> List[Any]:
+        if pais in self._valores_pais and campo in self._valores_pais[pais]:
+            candidatos = [valor for valor in self._valores_pais[pais][campo] if valor != valor_excluido]
+            return self.aleatorio.sample(candidatos, min(n, len(candidatos)))
+        return super().valores_mismo_pais_aleatorios(pais, campo, valor_excluido, n)
+
+    def participaciones_anyo_aleatorias(self, anyo: int, n: int) -> List[Dict[str, Any]]:
+        if anyo in self._participaciones_anyo and n == _CONCURSANTES_ANYO:
+            return self._participaciones_anyo.pop(anyo)
+        return super().participaciones_anyo_aleatorias(anyo, n)
+
+    def rango_anyos_aleatorio(self) -> Tuple[int, int]:
+        rango = self._extraer(self._rangos_anyos, 1)
+        if rango is not None:
+            return rango[0]
+        return super().rango_anyos_aleatorio()
+
+    def medias_puntuacion(self, anyo_inicial: int, anyo_final: int, n: int) -> List[Dict[str, Any]]:
+        medias = self._medias.get((anyo_inicial, anyo_final))
+        if medias is not None and n <= _LIMITE_MEDIAS:
+            return medias[:n]
+        return super().medias_puntuacion(anyo_inicial, anyo_final, n)
+
+    def medias_sin_empate(self, n: int) -> Optional[Tuple[int, int, List[Dict[str, Any]]]]:
+        # Se usa el siguiente rango precargado. Si tiene empate, se buscan otros con la implementacion original
+        rango = self._extraer(self._rangos_anyos, 1)
+        if rango is not None and n <= _LIMITE_MEDIAS:
+            medias = self._medias.get(rango[0], [])[:n]
+            if mejor_media_unica(medias):
+                return (*rango[0], medias)
+        return super().medias_sin_empate(n)
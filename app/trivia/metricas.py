@@ -0,0 +1,234 @@
+"""
+Modulo de instrumentacion de las preguntas de trivia. Mide, por cada clase de pregunta, el tiempo que
+tarda su constructor, el numero de llamadas a la base de datos y los documentos devueltos. Las medidas
+se agregan en memoria como histogramas y se exportan en el formato de texto de Prometheus.
+
+La instrumentacion no cambia la logica de las preguntas: "OperacionesEurovision" envuelve la coleccion
+en una "ColeccionInstrumentada" y los constructores de "Trivia" abren una medicion con "medir".
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple
+
+# Metodos de la coleccion que cuentan como llamadas a la base de datos
+METODOS_INSTRUMENTADOS = ("aggregate", "find", "find_one", "distinct", "count_documents")
+
+# Limites superiores de los cubos de cada histograma (el cubo "+Inf" se anyade al exportar)
+CUBOS_DURACION = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CUBOS_LLAMADAS = (0, 1, 2, 3, 4, 5, 10, 20, 50)
+CUBOS_DOCUMENTOS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+
+class _Histograma:
+    """
+    Histograma acumulado con cubos fijos, como los de Prometheus
+    """
+
+    def __init__(self, cubos: Tuple[float, ...]):
+        self.cubos = cubos
+        self.cuentas = [0] * len(cubos)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        for i, limite in enumerate(self.cubos):
+            if valor <= limite:
+                self.cuentas[i] += 1
+        self.suma += valor
+        self.total += 1
+
+
+class _Medicion:
+    """
+    Contadores de una medicion en curso (la construccion de una pregunta)
+    """
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.llamadas: Dict[str, int] = {}
+        self.documentos = 0
+
+
+class RegistroMetricas:
+    """
+    Registro en memoria de las mediciones de cada clase de pregunta. Las mediciones en curso se guardan
+    por hilo, de manera que las preguntas construidas concurrentemente no se mezclan.
+    """
+
+    def __init__(self):
+        self.activo = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histogramas: Dict[str, Dict[str, _Histograma]] = {}
+        self._llamadas: Dict[Tuple[str, str], int] = {}
+
+    def _medicion_actual(self) -> Optional[_Medicion]:
+        return getattr(self._local, "medicion", None)
+
+    @contextmanager
+    def medir(self, nombre: str):
+        """
+        Mide el bloque como una construccion de "nombre". Si ya hay una medicion en curso en el hilo
+        (por ejemplo, un constructor que llama a otro), las llamadas se atribuyen a la exterior.
+        """
+        if not self.activo or self._medicion_actual() is not None:
+            yield
+            return
+
+        medicion = self._local.medicion = _Medicion(nombre)
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracion = time.perf_counter() - inicio
+            self._local.medicion = None
+            self._registrar(medicion, duracion)
+
+    def anotar_llamada(self, metodo: str):
+        medicion = self._medicion_actual()
+        if medicion is not None:
+            medicion.llamadas[metodo] = medicion.llamadas.get(metodo, 0) + 1
+
+    def anotar_documentos(self, n: int):
+        medicion = self._medicion_actual()
+        if medicion is not None:
+            medicion.documentos += n
+
+    def _registrar(self, medicion: _Medicion, duracion: float):
+        with self._lock:
+            histogramas = self._histogramas.get(medicion.nombre)
+            if histogramas is None:
+                histogramas = self._histogramas[medicion.nombre] = {
+                    "duracion_segundos": _Histograma(CUBOS_DURACION),
+                    "llamadas_bd": _Histograma(CUBOS_LLAMADAS),
+                    "documentos_bd": _Histograma(CUBOS_DOCUMENTOS),
+                }
+            histogramas["duracion_segundos"].observar(duracion)
+            histogramas["llamadas_bd"].observar(sum(medicion.llamadas.values()))
+            histogramas["documentos_bd"].observar(medicion.documentos)
+            for metodo, n in medicion.llamadas.items():
+                self._llamadas[(medicion.nombre, metodo)] = self._llamadas.get((medicion.nombre, metodo), 0) + n
+
+    def reiniciar(self):
+        """
+        Borra todas las mediciones acumuladas
+        """
+        with self._lock:
+            self._histogramas.clear()
+            self._llamadas.clear()
+
+    def exportar(self) -> str:
+        """
+        Devuelve las metricas en el formato de texto de Prometheus
+        """
+        lineas: List[str] = []
+        with self._lock:
+            for metrica in ("duracion_segundos", "llamadas_bd", "documentos_bd"):
+                nombre_metrica = f"trivia_{metrica}"
+                lineas.append(f"# TYPE {nombre_metrica} histogram")
+                for nombre in sorted(self._histogramas):
+                    histograma = self._histogramas[nombre][metrica]
+                    for limite, cuenta in zip(histograma.cubos, histograma.cuentas):
+                        lineas.append(f'{nombre_metrica}_bucket{{pregunta="{nombre}",le="{limite}"}} {cuenta}')
+                    lineas.append(f'{nombre_metrica}_bucket{{pregunta="{nombre}",le="+Inf"}} {histograma.total}')
+                    lineas.append(f'{nombre_metrica}_sum{{pregunta="{nombre}"}} {histograma.suma}')
+                    lineas.append(f'{nombre_metrica}_count{{pregunta="{nombre}"}} {histograma.total}')
+
+            lineas.append("# TYPE trivia_llamadas_bd_total counter")
+            for (nombre, metodo), n in sorted(self._llamadas.items()):
+                lineas.append(f'trivia_llamadas_bd_total{{pregunta="{nombre}",metodo="{metodo}"}} {n}')
+        return "\n".join(lineas) + "\n"
+
+
+class _CursorInstrumentado:
+    """
+    Envuelve un cursor de PyMongo y anota los documentos que se leen de el. Los metodos que devuelven
+    el propio cursor (sort, limit, skip...) devuelven el envoltorio, para poder encadenarlos.
+    """
+
+    def __init__(self, cursor, registro: RegistroMetricas):
+        self._cursor = cursor
+        self._registro = registro
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        documento = next(self._cursor)
+        self._registro.anotar_documentos(1)
+        return documento
+
+    def __getattr__(self, nombre):
+        atributo = getattr(self._cursor, nombre)
+        if not callable(atributo):
+            return atributo
+
+        def envoltorio(*args, **kwargs):
+            resultado = atributo(*args, **kwargs)
+            return self if resultado is self._cursor else resultado
+        return envoltorio
+
+
+class ColeccionInstrumentada:
+    """
+    Envuelve una coleccion de PyMongo y anota, en la medicion en curso, cada llamada a la base de datos
+    y los documentos que devuelve. El resto de atributos (name, database...) se leen de la coleccion.
+    """
+
+    def __init__(self, coleccion, registro: RegistroMetricas):
+        self._coleccion = coleccion
+        self._registro = registro
+
+    def __getattr__(self, nombre):
+        atributo = getattr(self._coleccion, nombre)
+        if nombre not in METODOS_INSTRUMENTADOS:
+            return atributo
+
+        def instrumentado(*args, **kwargs):
+            self._registro.anotar_llamada(nombre)
+            resultado = atributo(*args, **kwargs)
+            if nombre in ("aggregate", "find"):
+                return _CursorInstrumentado(resultado, self._registro)
+            if nombre == "distinct":
+                self._registro.anotar_documentos(len(resultado))
+            elif nombre == "find_one" and resultado is not None:
+                self._registro.anotar_documentos(1)
+            return resultado
+        return instrumentado
+
+
+registro_metricas = RegistroMetricas()
+
+
+def exportar_contadores(prefijo: str, valores: Dict[str, float], contadores: Tuple[str, ...] = ()) -> str:
+    """
+    Devuelve unos valores sueltos (por ejemplo, las estadisticas de la reserva de preguntas) en el formato
+    de texto de Prometheus. Los de "contadores" se exportan como "counter" (con el sufijo "_total") y el
+    resto como "gauge"
+    """
+    lineas: List[str] = []
+    for nombre, valor in valores.items():
+        if nombre in contadores:
+            lineas.append(f"# TYPE {prefijo}_{nombre}_total counter")
+            lineas.append(f"{prefijo}_{nombre}_total {valor}")
+        else:
+            lineas.append(f"# TYPE {prefijo}_{nombre} gauge")
+            lineas.append(f"{prefijo}_{nombre} {valor}")
+    return "\n".join(lineas) + "\n"
+
+
+def instrumentar(coleccion):
+    """
+    Devuelve la coleccion envuelta en una "ColeccionInstrumentada" si las metricas estan activas
+    """
+    if not registro_metricas.activo or isinstance(coleccion, ColeccionInstrumentada):
+        return coleccion
+    return ColeccionInstrumentada(coleccion, registro_metricas)
+
+
+def medir(nombre: str):
+    """
+    Abre una medicion de "nombre" en el registro global
+    """
+    return registro_metricas.medir(nombre)
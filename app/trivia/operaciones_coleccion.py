@@ -1,8 +1,35 @@
 """
 Modulo que define la clase que vamos a utilizar para seleccionar datos aleatoriamente en un formato dado.
 """
-from typing import List, Dict, Any, Optional
+import random
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 import pymongo
+from ..cache import cache_distinct
+from ..version_datos import version_datos
+from ..actuaciones import CAMPOS_NO_CONCURSANTE
+from .indice import IndiceParticipaciones, anyos_cercanos_aleatorios
+from .metricas import instrumentar
+
+# Anyos que se consideran para las opciones invalidas cuando no hay ni filtro de anyos ni indice
+ANYOS_POR_DEFECTO = range(1956, 2023)
+
+# Numero de rangos de anyos que se comprueban en una sola agregacion al buscar uno sin empate en la mejor
+# media, cuando no se puede usar el indice en memoria
+RANGOS_CANDIDATOS_MEDIAS = 10
+
+
+class ConstruccionCancelada(Exception):
+    """
+    Se ha cancelado la construccion de las preguntas (por ejemplo, porque ha pasado el tiempo maximo)
+    """
+
+
+def mejor_media_unica(medias: List[Dict[str, Any]]) -> bool:
+    """
+    Indica si la mejor media de una lista ordenada de medias (ver "medias_puntuacion") no empata con la segunda
+    """
+    return len(medias) > 0 and (len(medias) < 2 or medias[0]["media_puntuacion"] > medias[1]["media_puntuacion"])
 
 
 # Clase que encapsula la generacion de datos aleatorios para crear las consultas.
@@ -10,12 +37,109 @@ import pymongo
 # Para las complejas, es mejor utilizar los metodos "consulta" o "agregacion".
 # En el caso de las consultas complejas, debeis acceder a los campos "self.anyos"
 # y "self.paises" para organizar la informacion.
+# Opcionalmente, se puede proporcionar un "IndiceParticipaciones" ya cargado. En ese caso, los metodos
+# de seleccion aleatoria sin condiciones extras se resuelven en memoria, sin consultar a Mongo.
+# Si se proporciona un generador "aleatorio" (random.Random con semilla), todas las selecciones son
+# reproducibles: en lugar de "$sample", se ordenan los candidatos y se eligen en Python.
+# Si se proporciona la coleccion derivada "actuaciones" (un documento por actuacion, ver el modulo
+# "actuaciones"), las selecciones de actuaciones la consultan directamente, sin "$unwind".
+# Si las metricas estan activas, la coleccion se envuelve para contar las llamadas (ver "metricas").
+# Con "cancelar", las preguntas que se estan construyendo dejan de consultar a Mongo (ver "concurrencia").
 class OperacionesEurovision:
 
-    def __init__(self, coleccion, anyos: List[int], paises: List[str]):
-        self._coleccion = coleccion
+    def __init__(self, coleccion, anyos: List[int], paises: List[str],
+                 indice: Optional[IndiceParticipaciones] = None, aleatorio: Optional[random.Random] = None,
+                 actuaciones=None):
+        self._coleccion_festivales = instrumentar(coleccion)
+        self._coleccion_actuaciones = instrumentar(actuaciones) if actuaciones is not None else None
+        self._cancelada = threading.Event()
         self.anyos = anyos
         self.paises = paises
+        self._indice = indice
+        self._version = None
+        self._determinista = aleatorio is not None
+        self.aleatorio = aleatorio if aleatorio is not None else random
+
+    def cancelar(self):
+        """
+        Cancela las preguntas que se estan construyendo con este objeto: sus siguientes consultas a Mongo
+        lanzan ConstruccionCancelada
+        """
+        self._cancelada.set()
+
+    @property
+    def _coleccion(self):
+        if self._cancelada.is_set():
+            raise ConstruccionCancelada()
+        return self._coleccion_festivales
+
+    @property
+    def _actuaciones(self):
+        if self._cancelada.is_set():
+            raise ConstruccionCancelada()
+        return self._coleccion_actuaciones
+
+    def _usar_indice(self, condiciones_extras: Optional[List[Dict[str, Any]]]) -> bool:
+        """
+        Indica si se puede responder desde el indice en memoria. Las condiciones extras son fases
+        de agregacion arbitrarias, asi que en ese caso siempre se consulta a Mongo.
+        """
+        return self._indice is not None and self._indice.cargado and not condiciones_extras
+
+    def _usar_actuaciones(self, condiciones_extras: Optional[List[Dict[str, Any]]]) -> bool:
+        """
+        Indica si se puede responder desde la coleccion de actuaciones. Las condiciones extras estan
+        escritas para los documentos de "festivales", asi que en ese caso se consulta esa coleccion.
+        """
+        return self._actuaciones is not None and not condiciones_extras
+
+    def _restringir_actuacion(self) -> List[Dict[str, Any]]:
+        """
+        Fases para restringir los anyos y los paises participantes en la coleccion de actuaciones
+        """
+        condicion = {}
+        if len(self.anyos) > 0:
+            condicion["anyo"] = {"$in": self.anyos}
+        if len(self.paises) > 0:
+            condicion["pais"] = {"$in": self.paises}
+        return [{"$match": condicion}] if condicion else []
+
+    def _muestrear_actuaciones(self, fases: List[Dict[str, Any]], n: int, orden: Dict[str, int]) -> List[Any]:
+        """
+        Igual que "_muestrear", pero sobre la coleccion de actuaciones
+        """
+        return self._elegir(self._actuaciones.aggregate([*fases, *self._fases_muestra(n, orden)]), n)
+
+    def _version_datos(self) -> int:
+        """
+        Version de los datos de la coleccion. Se consulta una sola vez por objeto.
+        """
+        if self._version is None:
+            self._version = version_datos(self._coleccion.database, self._coleccion.name)
+        return self._version
+
+    def _fases_muestra(self, n: int, orden: Dict[str, int]) -> List[Dict[str, Any]]:
+        """
+        Fases para seleccionar n documentos aleatorios. Si la seleccion debe ser reproducible, en lugar de
+        "$sample" se ordenan los documentos (con un orden total) y la seleccion se hace con "_elegir".
+        """
+        return [{"$sort": orden}] if self._determinista else [{"$sample": {"size": n}}]
+
+    def _elegir(self, documentos, n: int) -> List[Any]:
+        """
+        Completa la seleccion de "_fases_muestra": si es reproducible, elige n documentos con el generador
+        aleatorio. Si no, los documentos ya vienen seleccionados por "$sample".
+        """
+        documentos = list(documentos)
+        if self._determinista:
+            return self.aleatorio.sample(documentos, min(n, len(documentos)))
+        return documentos
+
+    def _muestrear(self, fases: List[Dict[str, Any]], n: int, orden: Dict[str, int]) -> List[Any]:
+        """
+        Ejecuta las fases de agregacion y selecciona aleatoriamente n de los documentos resultantes
+        """
+        return self._elegir(self._coleccion.aggregate([*fases, *self._fases_muestra(n, orden)]), n)
 
     def _restringir_anyo(self) -> List[Dict[str, Any]]:
         """
@@ -32,15 +156,16 @@ class OperacionesEurovision:
         de acuerdo con la lista de paises restringidos. Si la lista es vacia, no hay
         ningun anyo restringido.
         """
-        return [{"$match": {"pais": {"$in": self.paises}}}] if len(self.anyos) > 0 else []
+        return [{"$match": {"pais": {"$in": self.paises}}}] if len(self.paises) > 0 else []
 
     def _restringir_pais_participante(self) -> List[Dict[str, Any]]:
         """
         Funcion para devolver las fases necesarias para restringir el pais participante,
-        de acuerdo con la lista de paises restringidos. Asume que se ha hecho previamente un
-        unwind. Si la lista es vacia, no hay ningun anyo restringido.
+        de acuerdo con la lista de paises restringidos. Despues de un unwind filtra los concursantes;
+        antes, las ediciones con algun concursante de esos paises (y puede usar el indice). Si la lista es
+        vacia, no hay ningun anyo restringido.
         """
-        return [{"$match": {"concursantes.pais": {"$in": self.paises}}}] if len(self.anyos) > 0 else []
+        return [{"$match": {"concursantes.pais": {"$in": self.paises}}}] if len(self.paises) > 0 else []
 
     def _proyectar_y_sample(self, campo: str, n: int, condiciones_extras: Optional[List[Dict[str, Any]]] = None) -> List[Any]:
         """
@@ -51,7 +176,7 @@ class OperacionesEurovision:
         if condiciones_extras is None:
             condiciones_extras = [{}]
 
-        resultado_agregacion = self._coleccion.aggregate([
+        resultado_agregacion = self._muestrear([
             *condiciones_extras,
             {
                 "$group": {
@@ -60,11 +185,8 @@ class OperacionesEurovision:
             },
             {
                 "$project": {"_id": 1}
-            },
-            {
-                "$sample": {"size": n}
             }
-        ])
+        ], n, {"_id": 1})
         return [documento["_id"] for documento in resultado_agregacion]
 
     def anyo_aleatorio(self, n: int, condiciones_extras: Optional[List[Dict[str, Any]]] = None) -> List[int]:
@@ -72,6 +194,9 @@ class OperacionesEurovision:
         Devuelve n anyos seleccionados aleatoriamente entre los años disponibles en la coleccion, usando el metodo
         "proyectar_y_sample".
         """
+        if self._usar_indice(condiciones_extras):
+            return self._indice.anyos_aleatorios(n, self.anyos, self.aleatorio)
+
         if condiciones_extras is None:
             condiciones_extras = []
 
@@ -82,6 +207,9 @@ class OperacionesEurovision:
         Devuelve n paises seleccionados aleatoriamente entre los años disponibles en la coleccion, usando el metodo
         "proyectar_y_sample".
         """
+        if self._usar_indice(condiciones_extras):
+            return self._indice.paises_organizadores_aleatorios(n, self.anyos, self.paises, self.aleatorio)
+
         if condiciones_extras is None:
             condiciones_extras = []
 
@@ -93,33 +221,241 @@ class OperacionesEurovision:
         "proyectar_y_sample". El primer paso siempre consiste en hacer unwind de los concursantes (para aplicar filtros
         una vez aplicado). Si prefieres utilizar otros pasos antes del unwind, debes utilizar otro metodo.
         """
+        if self._usar_indice(condiciones_extras):
+            return self._indice.paises_participantes_aleatorios(n, self.anyos, self.paises, self.aleatorio)
+        if self._usar_actuaciones(condiciones_extras):
+            resultado = self._muestrear_actuaciones([*self._restringir_actuacion(), {"$group": {"_id": "$pais"}}],
+                                                    n, {"_id": 1})
+            return [documento["_id"] for documento in resultado]
+
         unwind = {"$unwind": "$concursantes"}
         if condiciones_extras is None:
             condiciones_extras = []
 
-        # En lugar de hacer un append, lo sumamos para no modificar el parametro
-        condiciones_extras_modificadas = (self._restringir_anyo() + [unwind] +
-                                          self._restringir_pais_participante() + condiciones_extras)
+        # En lugar de hacer un append, lo sumamos para no modificar el parametro. El filtro de paises
+        # tambien se aplica antes del unwind, para que se pueda usar el indice de los concursantes
+        condiciones_extras_modificadas = (self._restringir_anyo() + self._restringir_pais_participante() +
+                                          [unwind] + self._restringir_pais_participante() + condiciones_extras)
 
         return self._proyectar_y_sample("concursantes.pais", n, condiciones_extras_modificadas)
 
     def participacion_aleatoria(self, n: int, condiciones_extras: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
         """
-        Devuelve n concursantes seleccionados aleatoriamente. Sigue la misma
+        Devuelve n concursantes seleccionados aleatoriamente, con el anyo de su actuacion. Sigue la misma
         filosofia que "paises_participantes_aleatorios"
         """
+        if self._usar_indice(condiciones_extras):
+            return self._indice.participaciones_aleatorias(n, self.anyos, self.paises, self.aleatorio)
+        if self._usar_actuaciones(condiciones_extras):
+            # Se quitan los campos de la edicion despues de la seleccion, para devolver solo el concursante
+            # (y el anyo, que junto con el pais identifica la actuacion)
+            return self._elegir(self._actuaciones.aggregate([
+                *self._restringir_actuacion(),
+                *self._fases_muestra(n, {"anyo": 1, "id_pais": 1}),
+                {"$project": {campo: 0 for campo in CAMPOS_NO_CONCURSANTE if campo != "anyo"}}
+            ]), n)
+
         # Para seleccionar los concursantes, primero hacemos la fase de $unwind. Lo incluimos como
         # parte de las condiciones extras
         unwind = {"$unwind": "$concursantes"}
         if condiciones_extras is None:
             condiciones_extras = []
 
-        # Restringimos primero por año, antes de hacer unwind. Despues, filtramos por pais participante
-        condiciones_extras_modificadas = (self._restringir_anyo() + [unwind] +
-                                          self._restringir_pais_participante() + condiciones_extras)
+        # Restringimos primero por año, antes de hacer unwind. Despues, filtramos por pais participante.
+        # Cada concursante lleva el anyo, que junto con el pais identifica la actuacion
+        anyo = {"$addFields": {"concursantes.anyo": "$anyo"}}
+        condiciones_extras_modificadas = (self._restringir_anyo() + self._restringir_pais_participante() +
+                                          [unwind, anyo] + self._restringir_pais_participante() +
+                                          condiciones_extras)
 
         return self._proyectar_y_sample("concursantes", n, condiciones_extras_modificadas)
 
+    def primer_anyo_participacion(self, pais: str) -> int:
+        """
+        Devuelve el primer anyo en el que participo un pais (sin tener en cuenta los filtros)
+        """
+        if self._usar_indice(None):
+            anyo = self._indice.primer_anyo_participacion(pais)
+            if anyo is not None:
+                return anyo
+        if self._actuaciones is not None:
+            documento = self._actuaciones.find_one({"pais": pais}, {"anyo": 1}, sort=[("anyo", 1)])
+            return documento["anyo"]
+
+        documento = self._coleccion.find_one({"concursantes.pais": pais}, {"anyo": 1}, sort=[("anyo", 1)])
+        return documento["anyo"]
+
+    def anyos_cercanos_aleatorios(self, anyo: int, n: int) -> List[int]:
+        """
+        Devuelve n anyos distintos de "anyo" y cercanos a el, dentro de los anyos seleccionados
+        """
+        if self._usar_indice(None):
+            return self._indice.anyos_cercanos_aleatorios(anyo, n, self.anyos, self.aleatorio)
+        return anyos_cercanos_aleatorios(anyo, n, self.anyos if self.anyos else ANYOS_POR_DEFECTO, self.aleatorio)
+
+    def paises_participantes(self) -> List[str]:
+        """
+        Devuelve todos los paises que han participado alguna vez (sin tener en cuenta los filtros)
+        """
+        if self._usar_indice(None):
+            return self._indice.paises_participantes()
+        return cache_distinct.obtener(self._coleccion, "concursantes.pais", self._version_datos())
+
+    def otros_paises_aleatorios(self, pais_excluido: str, n: int) -> List[str]:
+        """
+        Devuelve n paises participantes seleccionados aleatoriamente, distintos de "pais_excluido"
+        """
+        if self._usar_indice(None):
+            return self._indice.otros_paises_aleatorios(pais_excluido, n, self.aleatorio)
+        if self._actuaciones is not None:
+            resultado = self._muestrear_actuaciones([
+                {"$match": {"pais": {"$ne": pais_excluido}}},
+                {"$group": {"_id": "$pais"}}
+            ], n, {"_id": 1})
+            return [documento["_id"] for documento in resultado]
+
+        resultado = self._muestrear([
+            {"$unwind": "$concursantes"},
+            {"$match": {"concursantes.pais": {"$ne": pais_excluido}}},
+            {"$group": {"_id": "$concursantes.pais"}}
+        ], n, {"_id": 1})
+        return [documento["_id"] for documento in resultado]
+
+    def valores_mismo_pais_aleatorios(self, pais: str, campo: str, valor_excluido: Any, n: int) -> List[Any]:
+        """
+        Devuelve n valores distintos del campo "campo" de los concursantes de un pais,
+        excluyendo "valor_excluido". Se usa para generar opciones invalidas parecidas a la respuesta.
+        """
+        if self._usar_indice(None):
+            return self._indice.valores_mismo_pais_aleatorios(pais, campo, valor_excluido, n, self.aleatorio)
+        if self._actuaciones is not None:
+            resultado = self._muestrear_actuaciones([
+                {"$match": {"pais": pais, campo: {"$ne": valor_excluido}}},
+                {"$group": {"_id": f"${campo}"}}
+            ], n, {"_id": 1})
+            return [documento["_id"] for documento in resultado]
+
+        resultado = self._muestrear([
+            {"$match": {"concursantes.pais": pais}},
+            {"$unwind": "$concursantes"},
+            {"$match": {"concursantes.pais": pais}},
+            {"$match": {f"concursantes.{campo}": {"$ne": valor_excluido}}},
+            {"$group": {"_id": f"$concursantes.{campo}"}}
+        ], n, {"_id": 1})
+        return [documento["_id"] for documento in resultado]
+
+    def participaciones_anyo_aleatorias(self, anyo: int, n: int) -> List[Dict[str, Any]]:
+        """
+        Devuelve n concursantes de un anyo seleccionados aleatoriamente, ordenados por resultado
+        (el mejor clasificado primero). Cada documento tiene los campos "cancion", "pais" y "resultado".
+        """
+        if self._usar_indice(None):
+            return self._indice.participaciones_anyo_aleatorias(anyo, n, self.aleatorio)
+        if self._actuaciones is not None:
+            participaciones = self._muestrear_actuaciones([
+                {"$match": {"anyo": anyo}},
+                {"$project": {"_id": 0, "cancion": 1, "pais": 1, "id_pais": 1, "resultado": 1}}
+            ], n, {"id_pais": 1})
+            return sorted(participaciones, key=lambda participacion: participacion["resultado"])
+
+        participaciones = self._muestrear([
+            {"$match": {"anyo": anyo}},
+            {"$unwind": "$concursantes"},
+            {"$project": {
+                "_id": 0,
+                "cancion": "$concursantes.cancion",
+                "pais": "$concursantes.pais",
+                "id_pais": "$concursantes.id_pais",
+                "resultado": "$concursantes.resultado"
+            }}
+        ], n, {"id_pais": 1})
+        return sorted(participaciones, key=lambda participacion: participacion["resultado"])
+
+    def rango_anyos_aleatorio(self) -> Tuple[int, int]:
+        """
+        Devuelve un par de anyos (inicial, final) seleccionados aleatoriamente, con inicial <= final
+        """
+        if self._usar_indice(None):
+            return self._indice.rango_anyos_aleatorio(self.anyos, self.aleatorio)
+
+        anyo_inicial = self.anyo_aleatorio(1)[0]
+        cond_mayor = [{"$match": {"anyo": {"$gte": anyo_inicial}}}]
+        anyo_final = self.anyo_aleatorio(1, condiciones_extras=cond_mayor)[0]
+        return anyo_inicial, anyo_final
+
+    def medias_puntuacion(self, anyo_inicial: int, anyo_final: int, n: int) -> List[Dict[str, Any]]:
+        """
+        Devuelve los n paises con mejor media de puntuacion entre dos anyos (incluidos), ordenados de
+        mayor a menor media. Cada documento tiene los campos "_id" (pais) y "media_puntuacion".
+        """
+        if self._usar_indice(None) and self._indice.medias_disponibles:
+            return self._indice.medias_puntuacion(anyo_inicial, anyo_final, n)
+        if self._actuaciones is not None:
+            return list(self._actuaciones.aggregate([
+                {"$match": {"anyo": {"$gte": anyo_inicial, "$lte": anyo_final}}},
+                {"$group": {"_id": "$pais", "media_puntuacion": {"$avg": "$puntuacion"}}},
+                {"$sort": {"media_puntuacion": -1, "_id": 1}},
+                {"$limit": n}
+            ]))
+
+        return list(self._coleccion.aggregate([
+            {"$match": {"anyo": {"$gte": anyo_inicial, "$lte": anyo_final}}},
+            {"$unwind": "$concursantes"},
+            {"$group": {
+                "_id": "$concursantes.pais",
+                "media_puntuacion": {"$avg": "$concursantes.puntuacion"}
+            }},
+            {"$sort": {"media_puntuacion": -1, "_id": 1}},
+            {"$limit": n}
+        ]))
+
+    def medias_sin_empate(self, n: int) -> Optional[Tuple[int, int, List[Dict[str, Any]]]]:
+        """
+        Elige aleatoriamente un rango de anyos en el que el pais con mejor media de puntuacion no empata con
+        el segundo. Devuelve (anyo inicial, anyo final, n mejores medias), o None si no lo encuentra. Con el
+        indice se comprueban todos los rangos a la vez. Si no, se comprueban RANGOS_CANDIDATOS_MEDIAS rangos
+        aleatorios con una sola agregacion (una faceta por rango) y se elige el primero sin empate.
+        """
+        if self._usar_indice(None) and self._indice.medias_disponibles:
+            return self._indice.medias_sin_empate(self.anyos, n, self.aleatorio)
+
+        anyos = [anyo for anyo in cache_distinct.obtener(self._coleccion, "anyo", self._version_datos())
+                 if not self.anyos or anyo in self.anyos]
+        if not anyos:
+            return None
+        rangos = []
+        for _ in range(RANGOS_CANDIDATOS_MEDIAS):
+            anyo_inicial = self.aleatorio.choice(anyos)
+            rango = (anyo_inicial, self.aleatorio.choice([anyo for anyo in anyos if anyo >= anyo_inicial]))
+            if rango not in rangos:
+                rangos.append(rango)
+
+        if self._actuaciones is not None:
+            coleccion, fases_concursantes, prefijo = self._actuaciones, [], ""
+        else:
+            coleccion, fases_concursantes, prefijo = self._coleccion, [{"$unwind": "$concursantes"}], "concursantes."
+        facetas = {
+            f"rango_{i}": [
+                {"$match": {"anyo": {"$gte": anyo_inicial, "$lte": anyo_final}}},
+                *fases_concursantes,
+                {"$group": {"_id": f"${prefijo}pais", "media_puntuacion": {"$avg": f"${prefijo}puntuacion"}}},
+                {"$sort": {"media_puntuacion": -1, "_id": 1}},
+                {"$limit": n}
+            ]
+            for i, (anyo_inicial, anyo_final) in enumerate(rangos)
+        }
+        resultado = next(coleccion.aggregate([
+            {"$match": {"anyo": {"$gte": min(inicial for inicial, _ in rangos),
+                                 "$lte": max(final for _, final in rangos)}}},
+            {"$facet": facetas}
+        ]), {})
+
+        for i, (anyo_inicial, anyo_final) in enumerate(rangos):
+            medias = resultado.get(f"rango_{i}", [])
+            if mejor_media_unica(medias):
+                return anyo_inicial, anyo_final, medias
+        return None
+
     def consulta(self, consulta: Dict[str, Any], opciones_proyeccion: Dict[str, Any]) -> pymongo.cursor.Cursor:
         """
         Consulta que devuelve los resultados directamente guardados en una lista,
@@ -1,10 +1,29 @@
 """
 Modulo que contiene diferentes modelos de consulta para la seccion de "trivia".
 """
+import functools
 import random
-from typing import List
+from typing import List, Dict, Any, Optional
 from abc import ABC, abstractmethod
+from ..actuaciones import id_actuacion
 from .operaciones_coleccion import OperacionesEurovision
+from .metricas import medir
+
+
+class PreguntaSinSolucionUnica(Exception):
+    """
+    No se han encontrado datos con los que la pregunta tenga una unica respuesta correcta. Quien genera las
+    preguntas debe elegir otro tipo de pregunta
+    """
+
+
+def id_actuacion_participacion(participacion: Dict[str, Any]) -> Optional[str]:
+    """
+    Identificador de la actuacion de un concursante (ver el modulo "actuaciones"), si se conoce su anyo
+    """
+    if "anyo" not in participacion:
+        return None
+    return id_actuacion(participacion["anyo"], participacion["id_pais"])
 
 
 # Clases para encapsular las preguntas y respuestas generadas aleatoriamente
@@ -12,6 +31,22 @@ class Trivia(ABC):
     """
     Clase abstracta con los metodos que deben implementar todas las preguntas de trivia.
     """
+    # Datos aleatorios que necesita la pregunta de "OperacionesEurovision". Se utilizan para
+    # precargar en una sola consulta los datos de varias preguntas (ver "OperacionesLote")
+    recursos = ()
+
+    def __init_subclass__(cls, **kwargs):
+        # Cada constructor se mide con el nombre de su clase (ver el modulo "metricas")
+        super().__init_subclass__(**kwargs)
+        if "__init__" in cls.__dict__:
+            constructor = cls.__init__
+
+            @functools.wraps(constructor)
+            def constructor_medido(self, *args, **kwargs):
+                with medir(type(self).__name__):
+                    constructor(self, *args, **kwargs)
+            cls.__init__ = constructor_medido
+
     @abstractmethod
     def __init__(self, parametros: OperacionesEurovision):
         # Obligamos a que todos los constructores les pasen un objeto con los parametros aleatorios
@@ -49,38 +84,72 @@ class Trivia(ABC):
         """
         pass
 
-    def to_dict(self):
-        # Sorteamos aleatoriamente las respuestas
+    def referencia(self) -> Optional[Dict[str, Any]]:
+        """
+        Claves con las que se puede reconstruir la pregunta (ver "desde_referencia"): las actuaciones
+        referenciadas (en "actuacion" o "actuaciones") y los valores que no salen de ellas. Si la pregunta
+        no se puede reconstruir, devuelve None.
+        """
+        return None
+
+    @abstractmethod
+    def _restaurar(self, claves: Dict[str, Any], actuaciones: Dict[str, Dict[str, Any]]):
+        """
+        Rellena los atributos de la pregunta a partir de sus claves y de los documentos de las actuaciones
+        referenciadas (por su "_id")
+        """
+        pass
+
+    @classmethod
+    def desde_referencia(cls, claves: Dict[str, Any], actuaciones: Dict[str, Dict[str, Any]]) -> "Trivia":
+        """
+        Reconstruye una pregunta a partir de su referencia, sin volver a seleccionar datos aleatorios
+        """
+        pregunta = cls.__new__(cls)
+        pregunta._restaurar(claves, actuaciones)
+        return pregunta
+
+    def to_dict(self, aleatorio: Optional[random.Random] = None, semilla: Optional[int] = None):
+        # Sorteamos aleatoriamente las respuestas con una semilla (sacada del generador indicado, si lo hay,
+        # para que el orden se pueda reproducir), que se guarda en la referencia de la pregunta
+        if semilla is None:
+            semilla = (aleatorio if aleatorio is not None else random).getrandbits(32)
         respuestas = [self.respuesta, *self.opciones_invalidas]
-        random.shuffle(respuestas)
+        random.Random(semilla).shuffle(respuestas)
 
         # Funcion que genera la informacion que pasamos al script de trivia en el formato adecuado
-        return {"pregunta": self.pregunta,
-                "correcta": respuestas.index(self.respuesta),
-                "respuestas": respuestas,
-                "puntuacion": self.puntuacion,
-                "tipo": "pregunta"}
+        resultado = {"pregunta": self.pregunta,
+                     "correcta": respuestas.index(self.respuesta),
+                     "respuestas": respuestas,
+                     "puntuacion": self.puntuacion,
+                     "tipo": "pregunta"}
+        referencia = self.referencia()
+        if referencia is not None:
+            resultado["ref"] = {"tipo": type(self).__name__, "claves": referencia, "semilla": semilla}
+        return resultado
 
 
 class PrimerAnyoParticipacion(Trivia):
     """
     Pregunta que anyo fue el primero en el que participo un pais seleccionado aleatoriamente
     """
+    recursos = ("pais_participante", "primer_anyo")
 
     def __init__(self, parametros: OperacionesEurovision):
 
         self.pais = parametros.paises_participantes_aleatorios(1)[0]
+        self._respuesta = parametros.primer_anyo_participacion(self.pais)
 
-        respuesta = parametros._coleccion.find_one(
-            {"concursantes.pais": self.pais},
-            {"anyo": 1},
-            sort=[("anyo", 1)]
-        )
-        self._respuesta = respuesta["anyo"]
+        # Las opciones invalidas son anyos cercanos a la respuesta (dentro de los anyos seleccionados)
+        self._opciones_invalidas = parametros.anyos_cercanos_aleatorios(int(self._respuesta), 3)
 
-        opciones_invalidas = [anio for anio in (parametros.anyos if parametros.anyos else range(1956, 2023)) if
-                              anio != int(self._respuesta)]
-        self._opciones_invalidas = random.sample(opciones_invalidas, 3)
+    def referencia(self) -> Optional[Dict[str, Any]]:
+        return {"pais": self.pais, "respuesta": self._respuesta, "opciones": self._opciones_invalidas}
+
+    def _restaurar(self, claves: Dict[str, Any], actuaciones: Dict[str, Dict[str, Any]]):
+        self.pais = claves["pais"]
+        self._respuesta = claves["respuesta"]
+        self._opciones_invalidas = claves["opciones"]
 
     @property
     def pregunta(self) -> str:
@@ -106,16 +175,30 @@ class CancionPais(Trivia):
     """
     Pregunta de que pais es el interprete de una cancion, dada el titulo de la cancion
     """
+    recursos = ("participacion", "paises_participantes")
 
     def __init__(self, parametros: OperacionesEurovision):
 
         participacion = parametros.participacion_aleatoria(1)[0]
         self._respuesta = participacion["pais"]
         self._cancion = participacion["cancion"]
+        self._actuacion = id_actuacion_participacion(participacion)
 
-        paises_invalidos = list(parametros._coleccion.distinct("concursantes.pais"))
+        paises_invalidos = parametros.paises_participantes()
         paises_invalidos.remove(self._respuesta)  # Elimina el país correcto de la lista
-        self._opciones_invalidas = random.sample(paises_invalidos, 3)
+        self._opciones_invalidas = parametros.aleatorio.sample(paises_invalidos, 3)
+
+    def referencia(self) -> Optional[Dict[str, Any]]:
+        if self._actuacion is None:
+            return None
+        return {"actuacion": self._actuacion, "opciones": self._opciones_invalidas}
+
+    def _restaurar(self, claves: Dict[str, Any], actuaciones: Dict[str, Dict[str, Any]]):
+        actuacion = actuaciones[claves["actuacion"]]
+        self._respuesta = actuacion["pais"]
+        self._cancion = actuacion["cancion"]
+        self._actuacion = claves["actuacion"]
+        self._opciones_invalidas = claves["opciones"]
 
     @property
     def pregunta(self) -> str:
@@ -145,27 +228,20 @@ class MejorClasificacion(Trivia):
     IMPORTANTE: la solucion debe ser unica. Ademas, todos las opciones
     deben haber participado el mismo anyo.
     """
+    recursos = ("anyo", "participaciones_anyo")
+
     def __init__(self, parametros: OperacionesEurovision):
 
         # Seleccionar un año aleatorio entre los disponibles
         self._anyo = parametros.anyo_aleatorio(1)[0]
 
-        # Agregación en MongoDB
-        pipeline = [
-            {"$match": {"anyo": self._anyo}},
-            {"$unwind": "$concursantes"},
-            {"$sample": {"size": 4}},
-            {"$sort": {"concursantes.resultado": 1}},  # Asegura que el mejor posicionado sea el primero
-            {"$project": {
-                "cancion": "$concursantes.cancion",
-                "pais": "$concursantes.pais",
-                "resultado": "$concursantes.resultado"
-            }}
-        ]
+        # Cuatro concursantes de ese anyo, con el mejor posicionado primero
+        resultado = parametros.participaciones_anyo_aleatorias(self._anyo, 4)
 
-        # Ejecutamos la agregación
-        resultado = list(parametros.agregacion(pipeline))
+        self._opciones_concursantes(resultado)
+        self._actuaciones = [id_actuacion(self._anyo, concursante["id_pais"]) for concursante in resultado]
 
+    def _opciones_concursantes(self, resultado: List[Dict[str, Any]]):
         # Tomamos el ganador del resultado de la agregación
         ganador = resultado[0]
 
@@ -177,6 +253,16 @@ class MejorClasificacion(Trivia):
 
         self._opciones_invalidas = restantes
 
+    def referencia(self) -> Optional[Dict[str, Any]]:
+        return {"actuaciones": self._actuaciones}
+
+    def _restaurar(self, claves: Dict[str, Any], actuaciones: Dict[str, Dict[str, Any]]):
+        # Las actuaciones estan guardadas en orden de resultado, con el ganador primero
+        resultado = [actuaciones[actuacion] for actuacion in claves["actuaciones"]]
+        self._anyo = resultado[0]["anyo"]
+        self._actuaciones = claves["actuaciones"]
+        self._opciones_concursantes(resultado)
+
     @property
     def pregunta(self) -> str:
         return f"¿Que canción/país obtuvo la mejor posición en {self._anyo}?"
@@ -200,32 +286,29 @@ class MejorMediaPuntos(Trivia):
 
     IMPORTANTE: la solución debe ser única.
     """
+    recursos = ("rango_anyos", "medias_puntuacion")
 
     def __init__(self, parametros: OperacionesEurovision):
 
-        self._anyo_inicial = parametros.anyo_aleatorio(1)[0]
-        cond_mayor = [{"$match": {"anyo": {"$gte": self._anyo_inicial}}}]
-        self._anyo_final = parametros.anyo_aleatorio(1, condiciones_extras=cond_mayor)[0]
-
-        print(self._anyo_inicial)
-        print(self._anyo_final)
-        # Agregación para obtener la media de puntuación por país
-        pipeline = [
-            {"$match": {"anyo": {"$gte": self._anyo_inicial, "$lte": self._anyo_final}}},
-            {"$unwind": "$concursantes"},
-            {"$group": {
-                "_id": "$concursantes.pais",
-                "media_puntuacion": {"$avg": "$concursantes.puntuacion"}
-            }},
-            {"$sort": {"media_puntuacion": -1}},
-            {"$limit": 10}
-        ]
-
-        resultados = list(parametros.agregacion(pipeline))
+        # Buscamos un rango de anyos en el que el mejor pais no empate con el segundo. Si no hay ninguno,
+        # la pregunta tendria dos respuestas correctas, asi que no se puede generar
+        rango = parametros.medias_sin_empate(10)
+        if rango is None:
+            raise PreguntaSinSolucionUnica(type(self).__name__)
+        self._anyo_inicial, self._anyo_final, resultados = rango
 
         self._respuesta = resultados[0]["_id"]
         self._opciones_invalidas = [r["_id"] for r in resultados[1:4]]
 
+    def referencia(self) -> Optional[Dict[str, Any]]:
+        return {"anyos": [self._anyo_inicial, self._anyo_final], "respuesta": self._respuesta,
+                "opciones": self._opciones_invalidas}
+
+    def _restaurar(self, claves: Dict[str, Any], actuaciones: Dict[str, Dict[str, Any]]):
+        self._anyo_inicial, self._anyo_final = claves["anyos"]
+        self._respuesta = claves["respuesta"]
+        self._opciones_invalidas = claves["opciones"]
+
     @property
     def pregunta(self) -> str:
         return f"¿Qué país quedó mejor posicionado de media entre los años {self._anyo_inicial} y {self._anyo_final}?"
@@ -0,0 +1,80 @@
+"""
+Modulo con el formato compacto de los quizzes guardados. En lugar del texto de cada pregunta, las
+respuestas ya barajadas y las URLs de los videos, cada pregunta se guarda como una referencia: su tipo,
+las claves de las actuaciones a las que se refiere (ver el modulo "actuaciones") y la semilla con la que
+se barajaron las respuestas. Al leer el quiz, las preguntas se reconstruyen con "expandir_preguntas".
+
+Las preguntas que no tienen referencia (por ejemplo, las de quizzes guardados antes de este formato) se
+guardan y se devuelven tal cual. Si alguna pregunta ya no se puede reconstruir (porque ha desaparecido una
+de sus actuaciones), se lanza PreguntaNoDisponible: el quiz completo deja de estar disponible, en lugar de
+quitarle preguntas y cambiar la posicion de las demas (las estadisticas de cada pregunta van por posicion).
+"""
+import logging
+from typing import List, Dict, Any
+from .preguntas import CancionPais, PrimerAnyoParticipacion, MejorClasificacion, MejorMediaPuntos
+from .videos import PaisActuacion, NombreCancion, InterpreteCancion
+
+logger = logging.getLogger(__name__)
+
+class PreguntaNoDisponible(Exception):
+    """
+    Una pregunta del quiz hace referencia a actuaciones que ya no existen
+    """
+
+
+# Tipos de pregunta que se pueden reconstruir, por nombre
+TIPOS_PREGUNTA = {tipo.__name__: tipo for tipo in (PrimerAnyoParticipacion, CancionPais, MejorClasificacion,
+                                                   MejorMediaPuntos, PaisActuacion, NombreCancion,
+                                                   InterpreteCancion)}
+
+
+def _referencia_valida(referencia: Any) -> bool:
+    return (isinstance(referencia, dict) and referencia.get("tipo") in TIPOS_PREGUNTA
+            and isinstance(referencia.get("claves"), dict) and isinstance(referencia.get("semilla"), int))
+
+
+def _actuaciones_referenciadas(claves: Dict[str, Any]) -> List[str]:
+    actuaciones = list(claves.get("actuaciones", []))
+    if "actuacion" in claves:
+        actuaciones.append(claves["actuacion"])
+    return actuaciones
+
+
+def compactar_preguntas(preguntas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Sustituye cada pregunta (diccionario de "Trivia.to_dict") por su referencia, si la tiene
+    """
+    compactas = []
+    for pregunta in preguntas:
+        referencia = pregunta.get("ref")
+        if _referencia_valida(referencia):
+            compactas.append({"ref": {campo: referencia[campo] for campo in ("tipo", "claves", "semilla")}})
+        else:
+            compactas.append(pregunta)
+    return compactas
+
+
+def expandir_preguntas(preguntas: List[Dict[str, Any]], coleccion_actuaciones) -> List[Dict[str, Any]]:
+    """
+    Reconstruye las preguntas guardadas como referencia, con una sola consulta a la coleccion de actuaciones.
+    Si las actuaciones de alguna pregunta ya no existen, lanza PreguntaNoDisponible.
+    """
+    referencias = [pregunta["ref"] for pregunta in preguntas if _referencia_valida(pregunta.get("ref"))]
+    ids = sorted({actuacion for referencia in referencias
+                  for actuacion in _actuaciones_referenciadas(referencia["claves"])})
+    actuaciones = {actuacion["_id"]: actuacion
+                   for actuacion in coleccion_actuaciones.find({"_id": {"$in": ids}})} if ids else {}
+
+    expandidas = []
+    for pregunta in preguntas:
+        referencia = pregunta.get("ref")
+        if not _referencia_valida(referencia):
+            expandidas.append(pregunta)
+            continue
+        try:
+            trivia = TIPOS_PREGUNTA[referencia["tipo"]].desde_referencia(referencia["claves"], actuaciones)
+        except (KeyError, IndexError, TypeError, ValueError) as error:
+            logger.warning("No se puede reconstruir la pregunta %s", referencia)
+            raise PreguntaNoDisponible(referencia) from error
+        expandidas.append(trivia.to_dict(semilla=referencia["semilla"]))
+    return expandidas
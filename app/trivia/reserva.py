@@ -0,0 +1,206 @@
+"""
+Modulo que define una reserva de preguntas ya generadas. Un hilo en segundo plano se encarga de
+rellenarla, de manera que las peticiones solo generan preguntas cuando la reserva esta vacia.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import List, Dict, Any, Callable, Tuple, Sequence, Optional
+
+logger = logging.getLogger(__name__)
+
+# Estadisticas de la reserva que solo crecen (el resto son niveles o medias)
+CONTADORES_RESERVA = ("aciertos", "fallos", "expulsiones", "vaciados", "recargas", "preguntas_recargadas")
+
+# Clave normalizada de los filtros de un quiz: (anyos ordenados, paises ordenados)
+ClaveFiltros = Tuple[Tuple[int, ...], Tuple[str, ...]]
+
+
+def normalizar_filtros(anyos: Sequence[int], paises: Sequence[str]) -> ClaveFiltros:
+    """
+    Normaliza los filtros de un quiz, para que el orden o las repeticiones no generen claves distintas
+    """
+    return tuple(sorted(set(anyos))), tuple(sorted(set(paises)))
+
+
+class ReservaPreguntas:
+    """
+    Reserva acotada de preguntas (diccionarios generados con "Trivia.to_dict()") agrupadas por filtros.
+    Cuando una reserva baja del nivel minimo, el hilo de recarga la rellena hasta el nivel maximo. Solo
+    se guardan las reservas de los "max_filtros" filtros usados mas recientemente (LRU).
+
+    El "generador" es una funcion que recibe (anyos, paises, n) y devuelve una lista de n preguntas.
+    La funcion opcional "version" devuelve la version de los datos con los que se generan: cuando cambia,
+    se vacian todas las reservas, para no servir preguntas de los datos anteriores.
+    """
+
+    def __init__(self, generador: Callable[[List[int], List[str], int], List[Dict[str, Any]]],
+                 nivel_minimo: int = 10, nivel_maximo: int = 50, max_filtros: int = 32,
+                 tam_lote: int = 10, version: Optional[Callable[[], Any]] = None):
+        self._generador = generador
+        self._version = version
+        self.nivel_minimo = nivel_minimo
+        self.nivel_maximo = nivel_maximo
+        self.max_filtros = max_filtros
+        self.tam_lote = tam_lote
+
+        self._reservas: "OrderedDict[ClaveFiltros, deque]" = OrderedDict()
+        self._pendientes: "OrderedDict[ClaveFiltros, None]" = OrderedDict()
+        self._condicion = threading.Condition()
+        self._hilo = None
+        self._parar = False
+        self._version_reservas = None
+
+        # Contadores
+        self._aciertos = 0
+        self._fallos = 0
+        self._expulsiones = 0
+        self._vaciados = 0
+        self._recargas = 0
+        self._preguntas_recargadas = 0
+        self._tiempo_recarga = 0.0
+        self._tiempo_recarga_max = 0.0
+
+    def iniciar(self):
+        """
+        Arranca el hilo de recarga (si no esta ya arrancado)
+        """
+        with self._condicion:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._parar = False
+            self._hilo = threading.Thread(target=self._bucle_recarga, name="reserva-preguntas", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        """
+        Detiene el hilo de recarga
+        """
+        with self._condicion:
+            self._parar = True
+            self._condicion.notify_all()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+
+    def obtener(self, anyos: List[int], paises: List[str], n: int) -> List[Dict[str, Any]]:
+        """
+        Devuelve n preguntas para los filtros dados. Se cogen de la reserva las que haya, y el resto
+        se generan en el momento. Despues se avisa al hilo de recarga si la reserva ha quedado baja.
+        """
+        self.iniciar()
+        clave = normalizar_filtros(anyos, paises)
+        version = self._version_actual()
+
+        with self._condicion:
+            self._comprobar_version(version)
+            reserva = self._reserva(clave)
+            preguntas = [reserva.popleft() for _ in range(min(n, len(reserva)))]
+            self._aciertos += len(preguntas)
+            self._fallos += n - len(preguntas)
+
+            if len(reserva) < self.nivel_minimo and clave not in self._pendientes:
+                self._pendientes[clave] = None
+                self._condicion.notify()
+
+        if len(preguntas) < n:
+            preguntas.extend(self._generador(list(clave[0]), list(clave[1]), n - len(preguntas)))
+        return preguntas
+
+    def _version_actual(self) -> Any:
+        return self._version() if self._version is not None else None
+
+    def _comprobar_version(self, version: Any) -> bool:
+        """
+        Vacia las reservas si han cambiado los datos. Devuelve True si la version es la de las reservas.
+        Hay que llamarla con el lock cogido.
+        """
+        if version == self._version_reservas:
+            return True
+        if self._reservas:
+            self._vaciados += 1
+        self._reservas.clear()
+        self._pendientes.clear()
+        self._version_reservas = version
+        return False
+
+    def _reserva(self, clave: ClaveFiltros) -> deque:
+        """
+        Devuelve la reserva de una clave (creandola si no existe) y la marca como la mas reciente.
+        Si hay demasiadas claves, se expulsa la usada hace mas tiempo. Hay que llamarla con el lock cogido.
+        """
+        if clave in self._reservas:
+            self._reservas.move_to_end(clave)
+            return self._reservas[clave]
+
+        reserva = self._reservas[clave] = deque()
+        while len(self._reservas) > self.max_filtros:
+            expulsada, _ = self._reservas.popitem(last=False)
+            self._pendientes.pop(expulsada, None)
+            self._expulsiones += 1
+        return reserva
+
+    def _bucle_recarga(self):
+        while True:
+            with self._condicion:
+                while not self._pendientes and not self._parar:
+                    self._condicion.wait()
+                if self._parar:
+                    return
+                clave = next(iter(self._pendientes))
+                reserva = self._reservas.get(clave)
+                faltan = 0 if reserva is None else self.nivel_maximo - len(reserva)
+                if faltan <= 0:
+                    del self._pendientes[clave]
+                    continue
+
+            # La generacion se hace fuera del lock, para no bloquear a las peticiones
+            inicio = time.perf_counter()
+            try:
+                version = self._version_actual()
+                preguntas = self._generador(list(clave[0]), list(clave[1]), min(faltan, self.tam_lote))
+            except Exception:
+                logger.exception("Error al recargar la reserva de preguntas %s", clave)
+                with self._condicion:
+                    self._pendientes.pop(clave, None)
+                continue
+            duracion = time.perf_counter() - inicio
+
+            with self._condicion:
+                self._recargas += 1
+                self._preguntas_recargadas += len(preguntas)
+                self._tiempo_recarga += duracion
+                self._tiempo_recarga_max = max(self._tiempo_recarga_max, duracion)
+
+                # Si la clave se ha expulsado o los datos han cambiado mientras tanto, descartamos las
+                # preguntas. Si no se ha podido generar ninguna, dejamos la recarga para la proxima peticion
+                if not self._comprobar_version(version):
+                    continue
+                reserva = self._reservas.get(clave)
+                if reserva is None or not preguntas:
+                    self._pendientes.pop(clave, None)
+                    continue
+                reserva.extend(preguntas[:self.nivel_maximo - len(reserva)])
+                if len(reserva) >= self.nivel_maximo:
+                    self._pendientes.pop(clave, None)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """
+        Devuelve los contadores de la reserva: tasa de aciertos y latencia de las recargas
+        """
+        with self._condicion:
+            servidas = self._aciertos + self._fallos
+            return {
+                "aciertos": self._aciertos,
+                "fallos": self._fallos,
+                "tasa_aciertos": self._aciertos / servidas if servidas else 0.0,
+                "filtros": len(self._reservas),
+                "preguntas_en_reserva": sum(len(reserva) for reserva in self._reservas.values()),
+                "expulsiones": self._expulsiones,
+                "vaciados": self._vaciados,
+                "recargas": self._recargas,
+                "preguntas_recargadas": self._preguntas_recargadas,
+                "tiempo_recarga_medio": self._tiempo_recarga / self._recargas if self._recargas else 0.0,
+                "tiempo_recarga_max": self._tiempo_recarga_max,
+            }
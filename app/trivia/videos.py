@@ -4,11 +4,12 @@ a Trivia y almacena el id de reproduccion de video
 """
 
 from abc import ABC, abstractmethod
-from typing import List
+import random
+from typing import List, Dict, Any, Optional
 from pathlib import Path
 
 from.operaciones_coleccion import OperacionesEurovision
-from .preguntas import Trivia
+from .preguntas import Trivia, id_actuacion_participacion
 
 
 def extraer_id_url(url) -> str:
@@ -32,10 +33,27 @@ class TriviaVideo(Trivia, ABC):
     def url(self) -> str:
         pass
 
-    def to_dict(self):
+    # Campo de la actuacion con la respuesta correcta
+    campo_respuesta = "pais"
+
+    def referencia(self) -> Optional[Dict[str, Any]]:
+        # La respuesta y el video salen de la actuacion, asi que solo se guardan las opciones invalidas
+        if self._actuacion is None:
+            return None
+        return {"actuacion": self._actuacion, "opciones": self._opciones_invalidas}
+
+    def _restaurar(self, claves: Dict[str, Any], actuaciones: Dict[str, Dict[str, Any]]):
+        actuacion = actuaciones[claves["actuacion"]]
+        self._respuesta = actuacion[self.campo_respuesta]
+        self._url = actuacion["url_youtube"]
+        self._pais = actuacion["pais"]
+        self._actuacion = claves["actuacion"]
+        self._opciones_invalidas = claves["opciones"]
+
+    def to_dict(self, aleatorio: Optional[random.Random] = None, semilla: Optional[int] = None):
         # Modifica el diccionario de Trivia con la url del video
         # y el tipo "video"
-        super_dict = super().to_dict()
+        super_dict = super().to_dict(aleatorio, semilla)
         super_dict["url"] = self.url
         # Extraemos el id de la URL
         super_dict["url_id"] = extraer_id_url(self.url)
@@ -47,6 +65,7 @@ class PaisActuacion(TriviaVideo):
     """
     ¿Qué país representó esta canción?
     """
+    recursos = ("participacion", "paises_participantes")
 
     def __init__(self, parametros: OperacionesEurovision):
 
@@ -56,17 +75,10 @@ class PaisActuacion(TriviaVideo):
         # Extraer datos relevantes
         self._respuesta = participacion["pais"]
         self._url = participacion["url_youtube"]
+        self._actuacion = id_actuacion_participacion(participacion)
 
-        # Generar opciones inválidas directamente aquí (otros países)
-        pipeline = [
-            {"$unwind": "$concursantes"},
-            {"$match": {"concursantes.pais": {"$ne": self._respuesta}}},  # Excluye el país correcto
-            {"$group": {"_id": "$concursantes.pais"}},  # Agrupamos por país
-            {"$sample": {"size": 3}}  # Seleccionamos 3 países aleatorios
-        ]
-
-        result = list(parametros.agregacion(pipeline))
-        self._opciones_invalidas = [r["_id"] for r in result]
+        # Generar opciones inválidas (otros países)
+        self._opciones_invalidas = parametros.otros_paises_aleatorios(self._respuesta, 3)
 
     @property
     def url(self) -> str:
@@ -95,6 +107,8 @@ class NombreCancion(TriviaVideo):
 
     NOTA: Para dificultar la respuesta, se deben seleccionar canciones del mismo país.
     """
+    recursos = ("participacion", "mismo_pais")
+    campo_respuesta = "cancion"
 
     def __init__(self, parametros: OperacionesEurovision):
 
@@ -105,20 +119,11 @@ class NombreCancion(TriviaVideo):
         self._respuesta = participacion["cancion"]
         self._url = participacion["url_youtube"]
         self._pais = participacion["pais"]
+        self._actuacion = id_actuacion_participacion(participacion)
 
-        # Generar opciones inválidas directamente aquí (otras canciones del mismo país)
-        pipeline = [
-            {"$unwind": "$concursantes"},  # Descomponemos la lista de concursantes
-            {"$match": {"concursantes.pais": self._pais}},  # Filtramos por el país
-            {"$match": {"concursantes.cancion": {"$ne": self._respuesta}}},  # Excluimos la canción correcta
-            {"$group": {"_id": "$concursantes.cancion"}},  # Agrupamos por canción
-            {"$sample": {"size": 3}}  # Seleccionamos 3 canciones aleatorias
-        ]
-
-        result = list(parametros.agregacion(pipeline))
-
-        # Asignamos las opciones inválidas
-        self._opciones_invalidas = [r["_id"] for r in result]
+        # Generar opciones inválidas (otras canciones del mismo país)
+        self._opciones_invalidas = parametros.valores_mismo_pais_aleatorios(self._pais, "cancion",
+                                                                            self._respuesta, 3)
 
     @property
     def url(self) -> str:
@@ -147,6 +152,8 @@ class InterpreteCancion(TriviaVideo):
 
     NOTA: Para dificultar la respuesta, se deben seleccionar intérpretes del mismo país.
     """
+    recursos = ("participacion", "mismo_pais")
+    campo_respuesta = "artista"
 
     def __init__(self, parametros: OperacionesEurovision):
 
@@ -157,20 +164,11 @@ class InterpreteCancion(TriviaVideo):
         self._respuesta = participacion["artista"]
         self._url = participacion["url_youtube"]
         self._pais = participacion["pais"]
+        self._actuacion = id_actuacion_participacion(participacion)
 
-        # Generar opciones inválidas directamente aquí (otros intérpretes del mismo país)
-        pipeline = [
-            {"$unwind": "$concursantes"},  # Descomponemos la lista de concursantes
-            {"$match": {"concursantes.pais": self._pais}},  # Filtramos por el país
-            {"$match": {"concursantes.artista": {"$ne": self._respuesta}}},  # Excluimos al intérprete correcto
-            {"$group": {"_id": "$concursantes.artista"}},  # Agrupamos por intérprete
-            {"$sample": {"size": 3}}  # Seleccionamos 3 intérpretes aleatorios
-        ]
-
-        result = list(parametros.agregacion(pipeline))
-
-        # Asignamos las opciones inválidas
-        self._opciones_invalidas = [r["_id"] for r in result]
+        # Generar opciones inválidas (otros intérpretes del mismo país)
+        self._opciones_invalidas = parametros.valores_mismo_pais_aleatorios(self._pais, "artista",
+                                                                            self._respuesta, 3)
 
     @property
     def url(self) -> str:
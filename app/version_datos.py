@@ -0,0 +1,67 @@
+"""
+Modulo que gestiona la version de los datos de las colecciones. Cada vez que cambian los datos de una
+coleccion (por ejemplo, al cargar un nuevo festival) se incrementa su version, de manera que las
+caches que dependen de esos datos saben cuando tienen que refrescarse.
+"""
+import datetime
+import threading
+import time
+from typing import Dict, Any, Optional
+
+# Coleccion en la que se guarda un documento por cada coleccion versionada
+COLECCION_METADATOS = "metadatos"
+
+
+def documento_version(db, coleccion: str = "festivales") -> Dict[str, Any]:
+    """
+    Devuelve el documento de version de una coleccion, con los campos "version" y "actualizado".
+    Si los datos nunca se han modificado, la version es 0.
+    """
+    documento = db[COLECCION_METADATOS].find_one({"_id": coleccion})
+    if documento is None:
+        return {"_id": coleccion, "version": 0, "actualizado": None}
+    return documento
+
+
+def version_datos(db, coleccion: str = "festivales") -> int:
+    """
+    Devuelve la version actual de los datos de una coleccion
+    """
+    return documento_version(db, coleccion)["version"]
+
+
+def incrementar_version(db, coleccion: str = "festivales") -> int:
+    """
+    Incrementa la version de los datos de una coleccion. Hay que llamarla cada vez que se modifican.
+    """
+    documento = db[COLECCION_METADATOS].find_one_and_update(
+        {"_id": coleccion},
+        {"$inc": {"version": 1}, "$set": {"actualizado": datetime.datetime.now(datetime.timezone.utc)}},
+        upsert=True,
+        return_document=True
+    )
+    return documento["version"]
+
+
+class VersionReciente:
+    """
+    Version de los datos de una coleccion leida como mucho cada "ttl" segundos. Sirve para las caches que
+    pueden tolerar unos segundos de retraso al cambiar los datos y quieren evitar la consulta en cada acierto.
+    """
+
+    def __init__(self, coleccion: str = "festivales", ttl: float = 1.0):
+        self.coleccion = coleccion
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._leida = 0.0
+
+    def obtener(self, db) -> int:
+        with self._lock:
+            if self._version is not None and time.monotonic() - self._leida < self.ttl:
+                return self._version
+        version = version_datos(db, self.coleccion)
+        with self._lock:
+            self._version = version
+            self._leida = time.monotonic()
+        return version
@@ -0,0 +1,3 @@
+"""
+Paquete con las herramientas para medir el rendimiento de las preguntas de trivia.
+"""
@@ -0,0 +1,69 @@
+"""
+Generador de conjuntos de datos sinteticos a partir de "festivales.json". Escala el numero de ediciones
+por un factor (10x, 100x, 1000x...) creando anyos sinteticos, y multiplica los paises participantes
+por la raiz cuadrada del factor, de manera que crecen tanto el numero de ediciones como el de paises
+y el de participaciones de cada pais.
+
+Se escribe linea a linea, en el mismo formato (Extended JSON) que "festivales.json", asi que no hace
+falta tener el conjunto completo en memoria.
+
+Uso:
+    python -m benchmark.escalar_datos festivales.json festivales_x100.json --factor 100
+"""
+import argparse
+import copy
+import json
+import math
+import os
+from typing import Dict, Any, Iterator, List
+
+
+def leer_festivales(ruta: str) -> List[Dict[str, Any]]:
+    """
+    Lee el fichero original (una edicion por linea)
+    """
+    with open(ruta, encoding="utf-8") as fichero:
+        return [json.loads(linea) for linea in fichero if linea.strip()]
+
+
+def escalar_festivales(festivales: List[Dict[str, Any]], factor: int) -> Iterator[Dict[str, Any]]:
+    """
+    Genera "factor" copias de cada edicion. La copia j desplaza los anyos en j veces el periodo original
+    y cambia los paises por una de las ceil(sqrt(factor)) variantes sinteticas de cada pais.
+    """
+    anyos = [festival["anyo"] for festival in festivales]
+    periodo = max(anyos) - min(anyos) + 1
+    variantes = math.ceil(math.sqrt(factor))
+
+    for copia in range(factor):
+        variante = copia % variantes
+        for festival in festivales:
+            nuevo = copy.deepcopy(festival)
+            nuevo["_id"] = {"$oid": os.urandom(12).hex()}
+            nuevo["anyo"] = festival["anyo"] + copia * periodo
+            if variante:
+                nuevo["pais"] = f"{festival['pais']} {variante}"
+                for concursante in nuevo["concursantes"]:
+                    concursante["id_pais"] = f"{concursante['id_pais']}{variante}"
+                    concursante["pais"] = f"{concursante['pais']} {variante}"
+            yield nuevo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera un conjunto de datos escalado a partir de festivales.json")
+    parser.add_argument("origen", help="fichero original (festivales.json)")
+    parser.add_argument("destino", help="fichero en el que se escribe el conjunto escalado")
+    parser.add_argument("--factor", type=int, default=10, help="factor de escala (10, 100, 1000...)")
+    argumentos = parser.parse_args()
+
+    festivales = leer_festivales(argumentos.origen)
+    ediciones = 0
+    with open(argumentos.destino, "w", encoding="utf-8") as destino:
+        for festival in escalar_festivales(festivales, argumentos.factor):
+            destino.write(json.dumps(festival, ensure_ascii=False) + "\n")
+            ediciones += 1
+    print(f"Escritas {ediciones} ediciones en {argumentos.destino}")
+
+
+if __name__ == "__main__":
+    main()
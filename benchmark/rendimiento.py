@@ -0,0 +1,188 @@
+"""
+Micro-benchmark de cada tipo de pregunta de trivia. Para cada clase que extiende a Trivia y cada
+estrategia de generacion (consultas a Mongo, consultas a la coleccion de actuaciones, indice en memoria
+y precarga en lote), mide:
+    * preguntas por segundo
+    * latencia p50 y p99 por pregunta
+    * en la estrategia "lote", latencia p50 y p99 por lote (precarga incluida)
+    * llamadas a las colecciones de festivales y actuaciones por pregunta
+
+Se ejecuta contra una base de datos local de pruebas (por defecto "eurovision_benchmark", que se
+sobrescribe) o, con "--mongomock", contra una base de datos en memoria (requiere el paquete mongomock).
+Los datos se pueden escalar con "--factor" (ver "benchmark.escalar_datos").
+
+Uso:
+    python -m benchmark.rendimiento --factor 100 --preguntas 200
+"""
+import argparse
+import json
+import time
+from typing import List, Dict, Any, Callable
+
+import pymongo
+from bson import json_util
+
+from app.actuaciones import COLECCION_ACTUACIONES, sincronizar_actuaciones
+from app.indices import aplicar_indices
+from app.trivia import (OperacionesEurovision, OperacionesLote, IndiceParticipaciones, PrimerAnyoParticipacion,
+                        CancionPais, MejorClasificacion, MejorMediaPuntos, PaisActuacion, NombreCancion,
+                        InterpreteCancion)
+from .escalar_datos import leer_festivales, escalar_festivales
+
+CLASES = [PrimerAnyoParticipacion, CancionPais, MejorClasificacion, MejorMediaPuntos,
+          PaisActuacion, NombreCancion, InterpreteCancion]
+
+ESTRATEGIAS = ["mongo", "actuaciones", "indice", "lote"]
+
+
+class ColeccionContada:
+    """
+    Envuelve una coleccion de PyMongo y cuenta las llamadas que llegan a la base de datos
+    """
+    METODOS = ("aggregate", "find", "find_one", "distinct", "count_documents")
+
+    def __init__(self, coleccion):
+        self._coleccion = coleccion
+        self.llamadas = 0
+
+    def __getattr__(self, nombre):
+        atributo = getattr(self._coleccion, nombre)
+        if nombre not in self.METODOS:
+            return atributo
+
+        def contado(*args, **kwargs):
+            self.llamadas += 1
+            return atributo(*args, **kwargs)
+        return contado
+
+
+def cargar_datos(coleccion, ruta: str, factor: int, tam_lote: int = 1000):
+    """
+    Sustituye el contenido de la coleccion por los datos de "ruta" escalados por "factor"
+    """
+    coleccion.drop()
+    lote = []
+    for festival in escalar_festivales(leer_festivales(ruta), factor):
+        lote.append(json_util.loads(json.dumps(festival)))
+        if len(lote) >= tam_lote:
+            coleccion.insert_many(lote)
+            lote = []
+    if lote:
+        coleccion.insert_many(lote)
+    aplicar_indices(coleccion.database, [coleccion.name])
+
+
+def percentil(valores: List[float], p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p / 100 * len(ordenados)))]
+
+
+def medir(clase: type, crear_operaciones: Callable[[int], OperacionesEurovision],
+          contadas: List[ColeccionContada], preguntas: int, tam_lote: int) -> Dict[str, Any]:
+    """
+    Construye "preguntas" preguntas de la clase, en grupos de "tam_lote" que comparten las mismas
+    operaciones. La latencia de cada pregunta se mide por separado (sin la creacion de las operaciones,
+    que en la estrategia "lote" incluye la precarga). La latencia de cada grupo (con la creacion de las
+    operaciones) se devuelve aparte.
+    """
+    latencias = []
+    latencias_grupo = []
+    llamadas_iniciales = sum(contada.llamadas for contada in contadas)
+    inicio_total = time.perf_counter()
+    for inicio in range(0, preguntas, tam_lote):
+        n = min(tam_lote, preguntas - inicio)
+        inicio_grupo = time.perf_counter()
+        operaciones = crear_operaciones(n)
+        for _ in range(n):
+            inicio_pregunta = time.perf_counter()
+            clase(operaciones)
+            latencias.append(time.perf_counter() - inicio_pregunta)
+        latencias_grupo.append(time.perf_counter() - inicio_grupo)
+    duracion = time.perf_counter() - inicio_total
+
+    return {
+        "preguntas_por_segundo": preguntas / duracion,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+        "p50_grupo_ms": percentil(latencias_grupo, 50) * 1000,
+        "p99_grupo_ms": percentil(latencias_grupo, 99) * 1000,
+        "llamadas_por_pregunta": (sum(contada.llamadas for contada in contadas) - llamadas_iniciales) / preguntas,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark de las preguntas de trivia")
+    parser.add_argument("--uri", default="mongodb://localhost:27017", help="URI del servidor de Mongo local")
+    parser.add_argument("--base-datos", default="eurovision_benchmark",
+                        help="base de datos de pruebas (se sobrescribe la coleccion de festivales)")
+    parser.add_argument("--mongomock", action="store_true", help="usar una base de datos en memoria (mongomock)")
+    parser.add_argument("--datos", default="festivales.json", help="fichero con los festivales originales")
+    parser.add_argument("--factor", type=int, default=1, help="factor de escala de los datos")
+    parser.add_argument("--no-cargar", action="store_true", help="usar los datos que ya hay en la coleccion")
+    parser.add_argument("--preguntas", type=int, default=100, help="preguntas por clase y estrategia")
+    parser.add_argument("--tam-lote", type=int, default=10, help="preguntas por lote en la estrategia 'lote'")
+    parser.add_argument("--estrategias", nargs="+", default=ESTRATEGIAS, choices=ESTRATEGIAS)
+    argumentos = parser.parse_args()
+
+    if argumentos.mongomock:
+        import mongomock
+        cliente = mongomock.MongoClient()
+    else:
+        cliente = pymongo.MongoClient(argumentos.uri)
+    coleccion = cliente[argumentos.base_datos]["festivales"]
+
+    if not argumentos.no_cargar:
+        inicio = time.perf_counter()
+        cargar_datos(coleccion, argumentos.datos, argumentos.factor)
+        print(f"Datos cargados (x{argumentos.factor}) en {time.perf_counter() - inicio:.2f} s")
+
+    contada = ColeccionContada(coleccion)
+    print(f"Ediciones: {coleccion.count_documents({})}")
+
+    actuaciones = ColeccionContada(coleccion.database[COLECCION_ACTUACIONES])
+    if "actuaciones" in argumentos.estrategias:
+        inicio = time.perf_counter()
+        sincronizar_actuaciones(coleccion.database)
+        print(f"Actuaciones sincronizadas en {time.perf_counter() - inicio:.2f} s")
+
+    indice = IndiceParticipaciones()
+    if "indice" in argumentos.estrategias:
+        inicio = time.perf_counter()
+        indice.cargar(coleccion)
+        print(f"Indice cargado en {time.perf_counter() - inicio:.2f} s")
+
+    def crear_operaciones(estrategia: str, clase: type) -> Callable[[int], OperacionesEurovision]:
+        if estrategia == "mongo":
+            return lambda n: OperacionesEurovision(contada, [], [])
+        if estrategia == "actuaciones":
+            return lambda n: OperacionesEurovision(contada, [], [], actuaciones=actuaciones)
+        if estrategia == "indice":
+            return lambda n: OperacionesEurovision(contada, [], [], indice)
+
+        def lote(n: int) -> OperacionesEurovision:
+            operaciones = OperacionesLote(contada, [], [])
+            operaciones.precargar([clase] * n)
+            return operaciones
+        return lote
+
+    # En las estrategias sin lote, cada pregunta crea sus operaciones: la latencia por pregunta incluye esa
+    # creacion (es la del grupo de una pregunta). En "lote", la precarga solo aparece en la latencia por lote
+    print(f"{'Pregunta':<26}{'Estrategia':<12}{'preg/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'p50 lote':>10}{'p99 lote':>10}{'llamadas':>10}")
+    for clase in CLASES:
+        for estrategia in argumentos.estrategias:
+            tam_lote = argumentos.tam_lote if estrategia == "lote" else 1
+            resultado = medir(clase, crear_operaciones(estrategia, clase), [contada, actuaciones],
+                              argumentos.preguntas, tam_lote)
+            if estrategia == "lote":
+                p50, p99 = resultado["p50_ms"], resultado["p99_ms"]
+                lote = f"{resultado['p50_grupo_ms']:>10.2f}{resultado['p99_grupo_ms']:>10.2f}"
+            else:
+                p50, p99 = resultado["p50_grupo_ms"], resultado["p99_grupo_ms"]
+                lote = f"{'-':>10}{'-':>10}"
+            print(f"{clase.__name__:<26}{estrategia:<12}{resultado['preguntas_por_segundo']:>10.1f}"
+                  f"{p50:>10.2f}{p99:>10.2f}{lote}{resultado['llamadas_por_pregunta']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
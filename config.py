@@ -21,3 +21,71 @@ class ConfiguracionFlask:
     # URI de conexion a la base de datos de Mongo
     MONGO_URI = f"mongodb://{os.environ.get('HOST')}:{os.environ.get('PORT')}/{os.environ.get('DATABASE')}"
 
+    # Si es True, la seleccion aleatoria de datos para el trivia se hace desde un indice
+    # en memoria (se carga una vez desde la coleccion). Si es False, se consulta siempre a Mongo.
+    TRIVIA_USAR_INDICE = os.environ.get('TRIVIA_USAR_INDICE', 'true').lower() == 'true'
+
+    # Si es True, los datos de todas las preguntas de un quiz se precargan en lote con una o dos
+    # agregaciones, en lugar de hacer varias consultas por pregunta
+    TRIVIA_GENERACION_LOTE = os.environ.get('TRIVIA_GENERACION_LOTE', 'false').lower() == 'true'
+
+    # Reserva de preguntas pregeneradas por un hilo en segundo plano. Se rellena hasta el nivel
+    # maximo cuando baja del nivel minimo, y solo se guardan los filtros usados mas recientemente.
+    # Se vacia cuando cambia la version de los festivales, y sus contadores se exponen en "/metricas"
+    TRIVIA_RESERVA = os.environ.get('TRIVIA_RESERVA', 'false').lower() == 'true'
+    TRIVIA_RESERVA_NIVEL_MINIMO = int(os.environ.get('TRIVIA_RESERVA_NIVEL_MINIMO', 10))
+    TRIVIA_RESERVA_NIVEL_MAXIMO = int(os.environ.get('TRIVIA_RESERVA_NIVEL_MAXIMO', 50))
+    TRIVIA_RESERVA_MAX_FILTROS = int(os.environ.get('TRIVIA_RESERVA_MAX_FILTROS', 32))
+
+    # Numero maximo de preguntas que se construyen a la vez (1 = una detras de otra) y tiempo maximo
+    # en segundos para generar todas las preguntas de un quiz
+    TRIVIA_MAX_CONCURRENCIA = int(os.environ.get('TRIVIA_MAX_CONCURRENCIA', 1))
+    TRIVIA_TIMEOUT_QUIZ = float(os.environ.get('TRIVIA_TIMEOUT_QUIZ', 10))
+
+    # Numero maximo de quizzes generados con semilla que se guardan en cache
+    CACHE_QUIZZES_SEMILLA = int(os.environ.get('CACHE_QUIZZES_SEMILLA', 256))
+
+    # Memoria maxima (en bytes) de la cache de quizzes guardados, que guarda sus preguntas ya serializadas
+    # en JSON. La version de los festivales con la que se valida se lee como mucho cada
+    # CACHE_QUIZZES_VERSION_TTL segundos, asi que un acierto no consulta a Mongo
+    CACHE_QUIZZES_GUARDADOS_BYTES = int(os.environ.get('CACHE_QUIZZES_GUARDADOS_BYTES', 32 * 1024 * 1024))
+    CACHE_QUIZZES_VERSION_TTL = float(os.environ.get('CACHE_QUIZZES_VERSION_TTL', 1))
+
+    # Si es True, se crean los indices del manifiesto (ver el modulo "indices") al arrancar la app
+    CREAR_INDICES_AL_ARRANCAR = os.environ.get('CREAR_INDICES_AL_ARRANCAR', 'true').lower() == 'true'
+
+    # Si es True, las selecciones de actuaciones de la trivia consultan la coleccion derivada "actuaciones"
+    # (un documento por actuacion) en lugar de hacer "$unwind" de los festivales
+    TRIVIA_USAR_ACTUACIONES = os.environ.get('TRIVIA_USAR_ACTUACIONES', 'true').lower() == 'true'
+
+    # Numero maximo de paginas renderizadas (por URL y version de los datos) que se guardan en cache
+    CACHE_PAGINAS = int(os.environ.get('CACHE_PAGINAS', 512))
+
+    # Numero maximo de totales de paginacion (por consulta y version de los datos) que se guardan en cache
+    CACHE_TOTALES_PAGINACION = int(os.environ.get('CACHE_TOTALES_PAGINACION', 256))
+
+    # Si es True, se mide el tiempo, las llamadas a Mongo y los documentos devueltos al construir cada
+    # tipo de pregunta. Las metricas se exponen en la ruta "/metricas"
+    TRIVIA_METRICAS = os.environ.get('TRIVIA_METRICAS', 'false').lower() == 'true'
+
+    # Ruta del directorio de la instantanea del indice de la trivia (ver "flask exportar-instantanea"). Si
+    # se indica, todos los procesos leen el indice de la instantanea (compartida con mmap) en lugar de
+    # construir cada uno el suyo. Si no existe o no es de la version actual de los datos, no se usa
+    TRIVIA_INSTANTANEA = os.environ.get('TRIVIA_INSTANTANEA', '')
+
+    # Escritura diferida de los quizzes guardados: se encolan en memoria y un hilo los escribe con
+    # "insert_many" cuando hay un lote completo o cuando pasa el intervalo (en segundos). Si la cola esta
+    # llena, las peticiones esperan como mucho QUIZZES_ESPERA_COLA segundos. Un lote que falla
+    # QUIZZES_INTENTOS_ESCRITURA veces se descarta (sus quizzes quedan en el log)
+    QUIZZES_ESCRITURA_DIFERIDA = os.environ.get('QUIZZES_ESCRITURA_DIFERIDA', 'false').lower() == 'true'
+    QUIZZES_LOTE_ESCRITURA = int(os.environ.get('QUIZZES_LOTE_ESCRITURA', 100))
+    QUIZZES_INTERVALO_ESCRITURA = float(os.environ.get('QUIZZES_INTERVALO_ESCRITURA', 0.5))
+    QUIZZES_MAX_PENDIENTES = int(os.environ.get('QUIZZES_MAX_PENDIENTES', 1000))
+    QUIZZES_ESPERA_COLA = float(os.environ.get('QUIZZES_ESPERA_COLA', 5))
+    QUIZZES_INTENTOS_ESCRITURA = int(os.environ.get('QUIZZES_INTENTOS_ESCRITURA', 3))
+
+    # Filtro de Bloom de los nombres de quizzes en uso: capacidad inicial, tasa de falsos positivos y
+    # segundos tras los que se vuelve a cargar de Mongo (para ver los quizzes de otros procesos)
+    QUIZZES_BLOOM_CAPACIDAD = int(os.environ.get('QUIZZES_BLOOM_CAPACIDAD', 100000))
+    QUIZZES_BLOOM_FALSOS_POSITIVOS = float(os.environ.get('QUIZZES_BLOOM_FALSOS_POSITIVOS', 0.01))
+    QUIZZES_BLOOM_RECARGA = float(os.environ.get('QUIZZES_BLOOM_RECARGA', 300))